@@ -7,8 +7,115 @@ File contains custom filters for use in Ansible playbooks.
 https://www.ansible.com/
 """
 
+import functools
+import importlib
+import os
 import re
 import socket
+from collections import OrderedDict
+from collections.abc import Mapping
+from operator import attrgetter, itemgetter
+
+# NumPy is optional and only needed for structured array batch output
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# The parsers and other machinery behind the filters live in the private
+# _perf package in plugins/plugin_utils. Ansible loads filter plugins by file
+# path under a generated module name, and loads every file below
+# plugins/filter as a filter plugin, so the package is kept outside of it and
+# this module serves as its parent for a package-relative import.
+__path__ = [
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "plugin_utils"
+    )
+]
+perf = importlib.import_module("._perf", __name__)
+
+# Matches the loopback suffix of target names (eg, CSR1_LB0) after they are
+# uppercased, leaving the inventory host name
+_RE_LB_SUFFIX = re.compile(r"_LB\d+$")
+
+
+# Sequence of keys written to the CSV string by ios_ipsla_csv
+# ... varies depending on verbosity needed
+_IPSLA_CSV_BRIEF = (
+    "rtt_cnt",
+    "rtt_avg",
+    "lat_cnt",
+    "lat_sd_avg",
+    "lat_ds_avg",
+    "jit_sd_cnt",
+    "jit_sd_avg",
+    "jit_ds_cnt",
+    "jit_ds_avg",
+    "los_sd",
+    "los_ds",
+    "voc_mos",
+)
+_IPSLA_CSV_FULL = (
+    "rtt_cnt",
+    "rtt_min",
+    "rtt_avg",
+    "rtt_max",
+    "rtt_ovthr",
+    "rtt_ovthp",
+    "lat_cnt",
+    "lat_sd_min",
+    "lat_sd_avg",
+    "lat_sd_max",
+    "lat_ds_min",
+    "lat_ds_avg",
+    "lat_ds_max",
+    "jit_sd_cnt",
+    "jit_sd_min",
+    "jit_sd_avg",
+    "jit_sd_max",
+    "jit_ds_cnt",
+    "jit_ds_min",
+    "jit_ds_avg",
+    "jit_ds_max",
+    "los_sd",
+    "los_sd_per",
+    "los_sd_pmin",
+    "los_sd_pmax",
+    "los_sd_imin",
+    "los_sd_imax",
+    "los_ds",
+    "los_ds_per",
+    "los_ds_pmin",
+    "los_ds_pmax",
+    "los_ds_imin",
+    "los_ds_imax",
+    "pkt_ooseq",
+    "pkt_tdrop",
+    "pkt_late",
+    "pkt_skip",
+    "voc_mos_min",
+    "voc_mos_max",
+    "voc_icpif_min",
+    "voc_icpif_max",
+)
+
+# Precomputed CSV row templates, indexed by the brief flag, which format
+# a whole row in one call. Values are fetched in sequence by attribute for
+# IpslaStats records and by key for any other mapping.
+_IPSLA_CSV_FORMAT = tuple(
+    ",".join(["{}"] * len(key_sequence)).format
+    for key_sequence in (_IPSLA_CSV_FULL, _IPSLA_CSV_BRIEF)
+)
+_IPSLA_CSV_ATTRS = (attrgetter(*_IPSLA_CSV_FULL), attrgetter(*_IPSLA_CSV_BRIEF))
+_IPSLA_CSV_ITEMS = (itemgetter(*_IPSLA_CSV_FULL), itemgetter(*_IPSLA_CSV_BRIEF))
+
+
+# CSV row template of the hash returned by ios_ping_stats
+_PING_CSV_ITEMS = itemgetter(*perf.parse.PING_KEYS)
+_PING_CSV_FORMAT = ",".join(["{}"] * len(perf.parse.PING_KEYS)).format
+
+# Key names added by ios_ping_loss_batch for the per-echo loss pattern
+_PING_LOSS_KEYS = ("loss_cnt", "loss_bursts", "burst_max", "burst_avg")
 
 
 class FilterModule(object):
@@ -16,26 +123,81 @@ class FilterModule(object):
     Defines a filter module object.
     """
 
+    # Filters implemented entirely by the helper modules
+    intersect_block_delta = staticmethod(perf.fib.intersect_block_delta)
+    plan_probe_batches = staticmethod(perf.plan.plan_probe_batches)
+    simulate_probe_plan = staticmethod(perf.plan.simulate_probe_plan)
+    sla_sketch_update = staticmethod(perf.sketch.sla_sketch_update)
+    sla_sketch_merge = staticmethod(perf.sketch.sla_sketch_merge)
+    sla_sketch_report = staticmethod(perf.sketch.sla_sketch_report)
+    rollup_write = staticmethod(perf.files.rollup_write)
+    ipsla_store_append = staticmethod(perf.store.ipsla_store_append)
+    ipsla_store_read = staticmethod(perf.store.ipsla_store_read)
+    filter_stats_merge = staticmethod(perf.stats.filter_stats_merge)
+    probe_archive_write = staticmethod(perf.archive.probe_archive_write)
+    probe_archive_read = staticmethod(perf.archive.probe_archive_read)
+    raw_archive_append = staticmethod(perf.archive.raw_archive_append)
+    raw_archive_index = staticmethod(perf.archive.raw_archive_index)
+    raw_archive_read = staticmethod(perf.archive.raw_archive_read)
+    parse_cache_trim = staticmethod(perf.cache.parse_cache_trim)
+
     @staticmethod
     def filters():
         """
         Return a list of hashes where the key is the filter
         name exposed to playbooks and the value is the function.
         """
-        return {
+        filter_hash = {
             "resolve": FilterModule.resolve,
             "ios_ipsla_stats": FilterModule.ios_ipsla_stats,
+            "ios_ipsla_intervals": FilterModule.ios_ipsla_intervals,
             "ios_ipsla_csv": FilterModule.ios_ipsla_csv,
             "ios_ping_stats": FilterModule.ios_ping_stats,
             "ios_ping_csv": FilterModule.ios_ping_csv,
             "intersect_block": FilterModule.intersect_block,
+            "intersect_block_delta": FilterModule.intersect_block_delta,
             "ios_parse_ip": FilterModule.ios_parse_ip,
             "perf_synopsis": FilterModule.perf_synopsis,
             "get_sla": FilterModule.get_sla,
+            "plan_probe_batches": FilterModule.plan_probe_batches,
+            "simulate_probe_plan": FilterModule.simulate_probe_plan,
+            "sla_sketch_update": FilterModule.sla_sketch_update,
+            "sla_sketch_merge": FilterModule.sla_sketch_merge,
+            "sla_sketch_report": FilterModule.sla_sketch_report,
+            "ios_ipsla_stats_batch": FilterModule.ios_ipsla_stats_batch,
+            "ios_ipsla_csv_batch": FilterModule.ios_ipsla_csv_batch,
+            "ios_ping_stats_batch": FilterModule.ios_ping_stats_batch,
+            "ios_ping_loss_batch": FilterModule.ios_ping_loss_batch,
+            "perf_synopsis_batch": FilterModule.perf_synopsis_batch,
+            "rollup_write": FilterModule.rollup_write,
+            "ipsla_store_append": FilterModule.ipsla_store_append,
+            "ipsla_store_read": FilterModule.ipsla_store_read,
+            "filter_stats_merge": FilterModule.filter_stats_merge,
+            "sperf_matrix": FilterModule.sperf_matrix,
+            "mperf_rows": FilterModule.mperf_rows,
+            "lperf_rows": FilterModule.lperf_rows,
+            "sperf_row": FilterModule.sperf_row,
+            "probe_archive_write": FilterModule.probe_archive_write,
+            "probe_archive_read": FilterModule.probe_archive_read,
+            "raw_archive_append": FilterModule.raw_archive_append,
+            "raw_archive_index": FilterModule.raw_archive_index,
+            "raw_archive_read": FilterModule.raw_archive_read,
+            "parse_cache_trim": FilterModule.parse_cache_trim,
         }
 
+        # Wrap every filter to record call statistics only when enabled,
+        # so the functions are untouched (and cost nothing) otherwise
+        stats_dir = os.environ.get("PERF_FILTER_STATS")
+        if stats_dir:
+            for name, func in filter_hash.items():
+                if name != "filter_stats_merge":
+                    filter_hash[name] = perf.stats.instrument(
+                        name, func, stats_dir
+                    )
+        return filter_hash
+
     @staticmethod
-    def intersect_block(text, cp_hash_list):
+    def intersect_block(text, cp_hash_list, lpm=False):
         """
         This filter takes a block of text and a list of Cisco
         ping hashes. Each ipv4addr within the hash list is checked
@@ -47,10 +209,19 @@ class FilterModule(object):
         within the text block. The filter returns false only if
         there is a logic error whereby the subset is greater than
         the original parameter in length, which should be impossible.
+
+        The text is parsed once into an index of FIB prefixes, so each
+        target is an exact lookup rather than a substring search (which
+        wrongly matched 10.0.0.1 inside 10.0.0.11). By default a target
+        must have a /32 host route. When lpm is true, any covering prefix
+        other than a default route counts, using longest-prefix match.
         """
+        fib = perf.fib.fib_index(text)
         intersect_list = []
         for d in cp_hash_list:
-            if d["ipv4addr"] in text:
+            if d["ipv4addr"] in fib["hosts"]:
+                intersect_list.append(d)
+            elif lpm and perf.fib.fib_lpm(fib, d["ipv4addr"]):
                 intersect_list.append(d)
         # Sanity check; new list cannot be longer than original
         if len(intersect_list) > len(cp_hash_list):
@@ -58,21 +229,7 @@ class FilterModule(object):
         return intersect_list
 
     @staticmethod
-    def _try_int(val, base=10):
-        """
-        Trivial integer parser that tries to extract an integer
-        (base 10 by default) from a string. If it fails, the function
-        returns the original input unmodified, as would be the case
-        if the input were a string or float, for example.
-        """
-        try:
-            return int(val, base)
-        except ValueError:
-            # Just return the input as is
-            return val
-
-    @staticmethod
-    def resolve(key):
+    def resolve(key, workers=16, ttl=300, cache_file=None):
         """
         Given an IPv4 or hostname as input (key), the other value can
         be discovered. When the key is a string, the return type is
@@ -84,252 +241,151 @@ class FilterModule(object):
         is False. If any errors are raised when resolving a given
         key, False is populated into the hostname and ipv4addr fields.
         Only the 'hosts' database can be used; this simplifies security.
+
+        Lists are resolved concurrently using up to 'workers' threads.
+        Successful lookups are cached in-process for 'ttl' seconds (0
+        disables caching) and, when 'cache_file' or the PERF_RESOLVE_CACHE
+        environment variable names a JSON file, persisted across runs.
+        Failed lookups are never cached.
         """
         # print("resolve key is {0}".format(key))
 
         if isinstance(key, list):
-            return FilterModule._resolve_list(key)
+            return perf.resolve.resolve_list(key, workers, ttl, cache_file)
         if isinstance(key, str):
-            return FilterModule._resolve_host(key)
+            return perf.resolve.resolve_list([key], 1, ttl, cache_file)[0]
 
         # Some invalid value
         # print("input was not list or string, saw {0}".format(type(key)))
         return False
 
     @staticmethod
-    def _resolve_host(key):
+    def ios_ipsla_stats(text):
         """
-        Resolves a single host given a key and database.
+        This filter parses through the relevant information from an
+        exec-issued "ip sla udp-jitter" probe. This is useful for quickly
+        collecting detailed statistics about the network performance. The
+        return value is an IpslaStats record, which behaves like a hash,
+        with several self-explanatory keys containing values of the parsed
+        information. Integers are parsed into ints while MOS scores are
+        left as strings, and any field not found in the text is set to -1.
+
+        The text is walked once using a precompiled alternation of all
+        field labels. The first occurrence of each label followed by a
+        valid value wins, which matches the previous behavior of running
+        one re.search per field.
         """
-
-        try:
-            # Resolve the IPv4 address and hostname from the key
-            new_ipv4 = socket.gethostbyname(key)
-            # print("new_ipv4: {0}".format(new_ipv4))
-            new_host = socket.gethostbyaddr(new_ipv4)[0]
-            # print("new_host: {0}".format(new_host))
-            d = {"key": key, "hostname": new_host, "ipv4addr": new_ipv4}
-        except (socket.gaierror, socket.herror, TypeError):
-            # need to add 'as ex' when uncommenting line below
-            # print("Error for key '{0}': rc={1}".format(key, ex.returncode))
-            d = {"key": key, "hostname": False, "ipv4addr": False}
-        return d
+        return perf.parse.IpslaStats(perf.parse.ipsla_values(text))
 
     @staticmethod
-    def _resolve_list(key_list):
+    def ios_ipsla_intervals(text):
         """
-        Resolves a list of hosts given a list of keys and a database.
+        This filter parses "show ip sla statistics aggregated" output that
+        may contain several aggregation intervals (one per hour kept by
+        "history hours-of-statistics-kept"). A list of ios_ipsla_stats
+        hashes is returned, one per interval in order of appearance, each
+        with an added "start_time" key holding the "Start Time Index"
+        string. Text without any interval marker is parsed as a single
+        record with an empty start time.
         """
-        d_list = []
-        for key in key_list:
-            d = FilterModule._resolve_host(key)
-            d_list.append(d)
-        return d_list
+        return list(FilterModule.iter_ipsla_intervals(text))
 
     @staticmethod
-    def ios_ipsla_stats(text):
+    def iter_ipsla_intervals(chunks):
         """
-        This filter parses through the relevant information from an
-        exec-issued "ip sla udp-jitter" probe. This is useful for quickly
-        collecting detailed statistics about the network performance. The
-        return value is a hash that contains several self-explanatory keys
-        containing values of the parsed information. The values are all
-        strings at present though parsing them into ints/floats is
-        an easy future enhancement.
-        """
-        # Regex patterns for ints, 2-ints, 3-ints, and floats are constant
-        re_int = r"\d+"
-        re_int2 = r"(\d+)/(\d+)"
-        re_int3 = r"(\d+)/(\d+)/(\d+)"
-        re_float = r"\d+\.\d+"
-
-        # List of lookahead regexs to extract numbers
-        re_list = [
-            r"(?<=Number Of RTT: )" + re_int,
-            r"(?<=RTT Min/Avg/Max: )" + re_int3,
-            r"(?<=Number of Latency one-way Samples: )" + re_int,
-            r"(?<=Destination Latency one way Min/Avg/Max: )" + re_int3,
-            r"(?<=Source Latency one way Min/Avg/Max: )" + re_int3,
-            r"(?<=Number of SD Jitter Samples: )" + re_int,
-            r"(?<=Source to Destination Jitter Min/Avg/Max: )" + re_int3,
-            r"(?<=Number of DS Jitter Samples: )" + re_int,
-            r"(?<=Destination to Source Jitter Min/Avg/Max: )" + re_int3,
-            r"(?<=Number Of RTT Over Threshold: )(\d+) \((\d+)%\)",
-            r"(?<=Loss Source to Destination: )" + re_int,
-            r"(?<=Destination Loss Periods Number: )" + re_int,
-            r"(?<=Destination Loss Period Length Min/Max: )" + re_int2,
-            r"(?<=Destination Inter Loss Period Length Min/Max: )" + re_int2,
-            r"(?<=Loss Destination to Source: )" + re_int,
-            r"(?<=Source Loss Periods Number: )" + re_int,
-            r"(?<=Source Loss Period Length Min/Max: )" + re_int2,
-            r"(?<=Source Inter Loss Period Length Min/Max: )" + re_int2,
-            r"(?<=Out Of Sequence: )" + re_int,
-            r"(?<=Tail Drop: )" + re_int,
-            r"(?<=Packet Late Arrival: )" + re_int,
-            r"(?<=Packet Skipped: )" + re_int,
-            r"(?<=Planning Impairment Factor \(ICPIF\): )" + re_int,
-            r"(?<=MOS score: )" + re_float,
-            r"(?<=MinOfMOS: )" + re_float,
-            r"(?<=MaxOfMOS: )" + re_float,
-            r"(?<=MinOfICPIF: )" + re_int,
-            r"(?<=MaxOfICPIF: )" + re_int,
-        ]
-
-        # List of key names for the returned hash
-        # Values must be strings or lists of strings
-        key_list = [
-            "rtt_cnt",
-            ["rtt_min", "rtt_avg", "rtt_max"],
-            "lat_cnt",
-            ["lat_sd_min", "lat_sd_avg", "lat_sd_max"],
-            ["lat_ds_min", "lat_ds_avg", "lat_ds_max"],
-            "jit_sd_cnt",
-            ["jit_sd_min", "jit_sd_avg", "jit_sd_max"],
-            "jit_ds_cnt",
-            ["jit_ds_min", "jit_ds_avg", "jit_ds_max"],
-            ["rtt_ovthr", "rtt_ovthp"],
-            "los_sd",
-            "los_sd_per",
-            ["los_sd_pmin", "los_sd_pmax"],
-            ["los_sd_imin", "los_sd_imax"],
-            "los_ds",
-            "los_ds_per",
-            ["los_ds_pmin", "los_ds_pmax"],
-            ["los_ds_imin", "los_ds_imax"],
-            "pkt_ooseq",
-            "pkt_tdrop",
-            "pkt_late",
-            "pkt_skip",
-            "voc_icpif",
-            "voc_mos",
-            "voc_mos_min",
-            "voc_mos_max",
-            "voc_icpif_min",
-            "voc_icpif_max",
-        ]
-
-        # Ensure the two lists have the same length
-        if len(key_list) != len(re_list):
-            raise ValueError("lists not same length")
-
-        # Initialize the hash to return
-        stats_hash = {}
-
-        # Iterate over the regex and key list in parallel
-        for regex, key in zip(re_list, key_list):
-
-            # Perform the regex match against IOS SLA output test
-            re_search = re.search(regex, text)
-
-            # For lists, iterate over the list of values and parse
-            # These values are always integers, never floats (or should be)
-            if isinstance(key, list):
-                for sub_key, i in zip(key, range(1, len(key) + 1)):
-                    if isinstance(sub_key, str):
-                        if re_search:
-                            val = FilterModule._try_int(re_search.group(i))
-                        else:
-                            val = -1
-                        # print("adding k:v :: {0}:{1}".format(sub_key,val))
-                        stats_hash.update({sub_key: val})
-
-            # For strings, parse the single value
-            # Could be int or float (MOS), but don't parse the float.
-            # Better to leave it as a nice string rather than imperfect float
-            elif isinstance(key, str):
-                if re_search:
-                    val = FilterModule._try_int(re_search.group())
-                else:
-                    val = -1
-                # print("adding k:v {0}:{1}".format(key,val))
-                stats_hash.update({key: val})
-            # For invalid data types, do nothing, and loop again
-
-        # Return the hash containing parsed data
-        return stats_hash
+        Generator version of ios_ipsla_intervals which accepts either a
+        string or any iterable of text chunks (such as lines read from a
+        file or socket) and yields each interval's stats hash as soon as
+        the next interval marker, or the end of input, is seen. Only the
+        current interval is buffered, regardless of the total input size.
+        """
+        for values in perf.parse.interval_values(chunks):
+            yield perf.parse.IpslaStats(values)
 
     @staticmethod
-    def ios_ipsla_csv(stats_hash, brief=True):
+    def ios_ipsla_csv(stats_hash, brief=True, buf=None):
         """
         This filter converts a stats_hash (generated by the ios_ipsla_stats
         filter) and writes it to a CSV string. This is useful for printing
         to spreadsheet rollups which contain the output from many probes.
+        The values are fetched in one step by a precomputed getter for the
+        brief or full key sequence and formatted by a precomputed template.
+        When buf is given (any object with a write method, such as an open
+        file), the row and a newline are written to it instead and the row
+        count (1) is returned.
         """
 
-        # Ensure input is a dict before continuing
-        if not isinstance(stats_hash, dict):
+        # Ensure input is a mapping before continuing; IpslaStats records
+        # are read by attribute, which is faster than by key
+        if isinstance(stats_hash, perf.parse.IpslaStats):
+            getter = _IPSLA_CSV_ATTRS[bool(brief)]
+        elif isinstance(stats_hash, Mapping):
+            getter = _IPSLA_CSV_ITEMS[bool(brief)]
+        else:
             return False
 
-        # Define the sequence of values in the CSV string
-        # ... varies depending on verbosity needed
-        if brief:
-            key_sequence = [
-                "rtt_cnt",
-                "rtt_avg",
-                "lat_cnt",
-                "lat_sd_avg",
-                "lat_ds_avg",
-                "jit_sd_cnt",
-                "jit_sd_avg",
-                "jit_ds_cnt",
-                "jit_ds_avg",
-                "los_sd",
-                "los_ds",
-                "voc_mos",
-            ]
+        csv_str = _IPSLA_CSV_FORMAT[bool(brief)](*getter(stats_hash))
+        if buf is None:
+            return csv_str
+        buf.write(csv_str + "\n")
+        return 1
 
-        else:
-            key_sequence = [
-                "rtt_cnt",
-                "rtt_min",
-                "rtt_avg",
-                "rtt_max",
-                "rtt_ovthr",
-                "rtt_ovthp",
-                "lat_cnt",
-                "lat_sd_min",
-                "lat_sd_avg",
-                "lat_sd_max",
-                "lat_ds_min",
-                "lat_ds_avg",
-                "lat_ds_max",
-                "jit_sd_cnt",
-                "jit_sd_min",
-                "jit_sd_avg",
-                "jit_sd_max",
-                "jit_ds_cnt",
-                "jit_ds_min",
-                "jit_ds_avg",
-                "jit_ds_max",
-                "los_sd",
-                "los_sd_per",
-                "los_sd_pmin",
-                "los_sd_pmax",
-                "los_sd_imin",
-                "los_sd_imax",
-                "los_ds",
-                "los_ds_per",
-                "los_ds_pmin",
-                "los_ds_pmax",
-                "los_ds_imin",
-                "los_ds_imax",
-                "pkt_ooseq",
-                "pkt_tdrop",
-                "pkt_late",
-                "pkt_skip",
-                "voc_mos_min",
-                "voc_mos_max",
-                "voc_icpif_min",
-                "voc_icpif_max",
-            ]
+    @staticmethod
+    def ios_ipsla_stats_batch(
+        results, cmd_index=0, as_numpy=False, intervals=False, checkpoint=None
+    ):
+        """
+        Batch version of ios_ipsla_stats which accepts an entire list of
+        registered loop results (eg, PROBE_OUTPUT.results), skips any
+        skipped items, and parses the stdout at cmd_index from the rest.
+        The return value is columnar: a hash with one list per stats key
+        plus an "index" list holding the position of each row within the
+        original results. When as_numpy is true, a NumPy structured array
+        with the same field names is returned instead, or False if NumPy
+        is not installed. When intervals is true, aggregated statistics
+        are split by ios_ipsla_intervals so each result contributes one
+        row per aggregation interval, with a "start_time" column added.
+
+        When checkpoint names a JSON file (one per router), intervals are
+        always used and only new or changed intervals are returned. See
+        _checkpoint_records for details.
+        """
+        intervals = intervals or bool(checkpoint)
+        keys = (
+            perf.parse.IPSLA_KEYS + ("start_time",)
+            if intervals
+            else perf.parse.IPSLA_KEYS
+        )
+        columns = {"index": []}
+        columns.update((key, []) for key in keys)
+        appends = [columns[key].append for key in keys]
+
+        rows = perf.parse.ipsla_rows(results, cmd_index, intervals, checkpoint)
+        for i, values in rows:
+            columns["index"].append(i)
+            for append, value in zip(appends, values):
+                append(value)
 
-        # Write values to the string in sequence
-        csv_str = ""
-        for key in key_sequence:
-            csv_str += str(stats_hash[key]) + ","
+        if as_numpy:
+            return perf.matrix.to_structured_array(columns)
+        return columns
 
-        # Trim the trailing comma and return the CSV string
-        return csv_str[:-1]
+    @staticmethod
+    def ios_ipsla_csv_batch(stats_cols, brief=True, buf=None):
+        """
+        Batch version of ios_ipsla_csv which converts the columns returned
+        by ios_ipsla_stats_batch into a list of CSV strings, one per row.
+        Each row is formatted by one call of a precomputed template. When
+        buf is given, newline-terminated rows are instead written to it in
+        large chunks, without building the whole list, and the row count is
+        returned.
+        """
+        key_sequence = _IPSLA_CSV_BRIEF if brief else _IPSLA_CSV_FULL
+        csv_format = _IPSLA_CSV_FORMAT[bool(brief)]
+        rows = zip(*[stats_cols[key] for key in key_sequence])
+        if buf is None:
+            return [csv_format(*row) for row in rows]
+        return perf.files.write_csv_rows(rows, csv_format, buf)
 
     @staticmethod
     def perf_synopsis(stats_hash, lspv_str="", mtu_ok=False, lspv_success_n=4):
@@ -344,13 +400,24 @@ class FilterModule(object):
         if stats_hash is None:
             return False
 
+        return FilterModule._synopsis(
+            stats_hash["rtt_cnt"], lspv_str, mtu_ok, lspv_success_n
+        )
+
+    @staticmethod
+    def _synopsis(rtt_cnt, lspv_str, mtu_ok, lspv_success_n):
+        """
+        Builds the synopsis string for a single probe given its RTT count,
+        LSPV code string, and MTU test result. Shared by the per-row and
+        batch synopsis filters.
+        """
         # Success defined when success is greater than 80%
         lspv_ok = lspv_str.count("!") >= lspv_success_n
 
         # Success defined when the RTT count is greater than 0
         # 0 means the probe ran but nothing completed
         # -1 means the system failed to collect any output
-        ipsla_ok = int(stats_hash["rtt_cnt"]) > 0
+        ipsla_ok = int(rtt_cnt) > 0
 
         # Most common case, so it is processed first
         # Everything succeeded, so return OK
@@ -370,34 +437,101 @@ class FilterModule(object):
         return issues
 
     @staticmethod
-    def _get_sla_group(host, groups):
-        """
-        This function finds an inventory group corresponding to a host. Checks
-        all the groups to see if a host is contained in that group. Given that
-        this search is SLA specific, a host should only be in one group, so
-        the function returns immediately upon the first match. False is
-        returned if the host is not found in any group, which is considered
-        to be an error case.
-        """
-        # print('groups.keys():')
-        # print(groups.keys())
-        # Iterate over all group names
-        for key in groups.keys():
-            # If its a regional grouping of routers
-            if "region" in key:
-                # print('checking key ' + key)
-                # Iterate over each host in the group list
-                for inv_item in groups[key]:
-                    # Check to see if the host is in a given group
-                    hostu = host.upper()
-                    inv_itemu = inv_item.upper()
-                    # print('compare: {0} {1}'.format(hostu, inv_itemu))
-                    if hostu in inv_itemu or inv_itemu in hostu:
-                        # print('{0} is in group {1}'.format(host, key))
-                        return key
-
-        # print('{0} not found in any group'.format(host))
-        return False
+    def perf_synopsis_batch(stats_cols, lspv_list, mtu_list, lspv_success_n=4):
+        """
+        Batch version of perf_synopsis. Takes the columns returned by
+        ios_ipsla_stats_batch plus parallel lists of LSPV code strings and
+        MTU results, returning a parallel list of synopsis strings. MTU
+        results may be booleans or packet counts such as the pkt_cmp column
+        from ios_ping_stats_batch; any value greater than 0 is a pass.
+        """
+        return [
+            FilterModule._synopsis(
+                rtt_cnt, lspv_str, int(mtu) > 0, lspv_success_n
+            )
+            for rtt_cnt, lspv_str, mtu in zip(
+                stats_cols["rtt_cnt"], lspv_list, mtu_list
+            )
+        ]
+
+    @staticmethod
+    @functools.lru_cache(maxsize=16)
+    def _sla_index(group_items, sla_items):
+        """
+        Builds (and memoizes) an SLA lookup index for a given inventory.
+        The group_items tuple holds (group, hosts) pairs for every group
+        whose name contains "region", and the sla_items tuple holds the
+        regional_sla (key, value) pairs. Each regional group is mapped to
+        the SLA whose key the group name ends with; groups matching zero
+        or several keys get no SLA, which is considered an error later.
+        Hosts are indexed by their uppercase name for exact lookups, and
+        the uppercase host lists are kept for the substring fallback.
+        """
+        group_sla = {}
+        for group, _ in group_items:
+            values = [int(val) for key, val in sla_items if group.endswith(key)]
+            if len(values) == 1:
+                group_sla[group] = values[0]
+
+        exact = {}
+        upper_items = []
+        for group, hosts in group_items:
+            hosts_upper = tuple(host.upper() for host in hosts)
+            upper_items.append((group, hosts_upper))
+            for hostu in hosts_upper:
+                exact.setdefault(hostu, []).append(group)
+
+        return {
+            "group_sla": group_sla,
+            "exact": exact,
+            "upper_items": upper_items,
+            "memo": {},
+        }
+
+    @staticmethod
+    def _get_sla_group(host, index):
+        """
+        This function finds the inventory group corresponding to a host
+        using an index from _sla_index. An exact (case-insensitive) host
+        name match is preferred, then an exact match of the name without
+        its "_lbN" loopback suffix (eg, csr1_lb0 is host csr1). Otherwise
+        the inventory hosts containing, or contained within, the host name
+        match, and only those closest in length to it are kept, so csr12
+        is never mistaken for csr1. Given that this search is SLA specific,
+        a host should only be in one group, so a ValueError is raised when
+        equally specific matches are in several groups. False is returned
+        if the host is not found in any group, which is considered to be
+        an error case. Results are memoized within the index.
+        """
+        hostu = host.upper()
+        memo = index["memo"]
+        if hostu in memo:
+            return memo[hostu]
+
+        groups = index["exact"].get(hostu) or index["exact"].get(
+            _RE_LB_SUFFIX.sub("", hostu)
+        )
+        if not groups:
+            matches = [
+                (abs(len(inv_itemu) - len(hostu)), group)
+                for group, hosts_upper in index["upper_items"]
+                for inv_itemu in hosts_upper
+                if hostu in inv_itemu or inv_itemu in hostu
+            ]
+            best = min((diff for diff, _ in matches), default=None)
+            groups = [group for diff, group in matches if diff == best]
+
+        # Remove duplicates while preserving inventory order
+        groups = list(OrderedDict.fromkeys(groups))
+        if len(groups) > 1:
+            raise ValueError(
+                "host {0} is ambiguous; found in groups {1}".format(
+                    host, ", ".join(groups)
+                )
+            )
+
+        memo[hostu] = groups[0] if groups else False
+        return memo[hostu]
 
     @staticmethod
     def get_sla(sla, groups, targets):
@@ -407,42 +541,33 @@ class FilterModule(object):
         the target list and can be used for parallel iteration. The SLA
         value represents the threshold RTT from the inventory host to
         the specific target as documented in the provider's SLA. If
-        a sanity check fails, such as the two lists not having the
-        same length after the function's logic is complete, a value
-        of False is returned.
+        a sanity check fails, such as a target not being found in any
+        regional group or its group not mapping to exactly one SLA,
+        a value of False is returned. A target found in several regional
+        groups raises a ValueError rather than silently using the first.
+
+        The group-to-SLA index is built once per (groups, sla) pair and
+        memoized. Targets named after an inventory host, with or without
+        the "_lbN" loopback suffix, are answered with a hash lookup, and
+        any other name falls back to a search of every inventory host.
         """
-        # Find out what group the target hosts are in
-        target_group_list = []
-        for t in targets:
-            # Find the group for a given target
-            tgt_group = FilterModule._get_sla_group(t["hostname"], groups)
-            if not tgt_group:
-                return False
-            # Add that group to the group list
-            target_group_list.append(tgt_group)
+        # Build or reuse the index for this inventory and SLA
+        index = FilterModule._sla_index(
+            tuple(
+                (key, tuple(hosts))
+                for key, hosts in groups.items()
+                if "region" in key
+            ),
+            tuple(sla.items()),
+        )
 
         sla_list = []
-
-        # Iterate over target groups, since each one needed
-        # to be mapped to a regional SLA
-        for t in target_group_list:
-            # print( 'getting SLA to group ' + t )
-            # iterate over the 4 regional SLA keys
-            for key in sla.keys():
-                # print ('testing sla ' + key )
-                # If the name of the group (eg, ios_per_conus) ends in
-                # the name of the key, we've found the right SLA
-                if t.endswith(key):
-                    # print('group {0} ends with {1}'.format(t,key))
-                    sla_list.append(int(sla[key]))
-                    continue
-
-        # print(sla_list)
-
-        # Sanity check; target and SLA lists must be same length
-        if len(sla_list) != len(targets):
-            # print('lists not same length')
-            return False
+        for t in targets:
+            # Find the group for a given target, then its regional SLA
+            tgt_group = FilterModule._get_sla_group(t["hostname"], index)
+            if not tgt_group or tgt_group not in index["group_sla"]:
+                return False
+            sla_list.append(index["group_sla"][tgt_group])
 
         return sla_list
 
@@ -458,7 +583,9 @@ class FilterModule(object):
           rtt_avg: Average RTT time (rtt_min<=rtt_avg<=rtt_max)
           rtt_max: Maximum/worse RTT time
 
-        There are two forms of input strings. One is a successful case:
+        The input may be the entire ping output, in which case the success
+        rate line is found wherever it appears, or just that line. There
+        are two forms of the line. One is a successful case:
 
         "Success rate is 100 percent (5/5), /
          round-trip min/avg/max = 247/247/248 ms"
@@ -471,22 +598,8 @@ class FilterModule(object):
         correct and the integers make sense. Any failure results in
         a return false of False.
         """
-        if text is None or text == "":
-            return False
-
-        # Develop regex and find digits
-        pattern = r"\d+"
-        re_list = re.findall(pattern, text)
-
-        # Parse values to integers
-        stats_list = [int(s) for s in re_list]
-
-        # Ping failed; just populate RTT times with 0
-        if len(stats_list) == 3:
-            stats_list.extend([0, 0, 0])
-
-        # Sanity check; length must be 6
-        if len(stats_list) != 6:
+        stats_list = perf.parse.ping_values(text)
+        if stats_list is None:
             return False
 
         # Construct dictionary of parsed values
@@ -518,25 +631,264 @@ class FilterModule(object):
         return cp_hash
 
     @staticmethod
-    def ios_ping_csv(cp_hash):
+    def ios_ping_loss_batch(outputs, cmd_index=0, as_numpy=False):
+        """
+        Parses many complete ping outputs at once, given either a list of
+        output strings or a list of registered loop results (skipping any
+        skipped items and using the stdout at cmd_index from the rest). Each
+        output is scanned once, finding the success rate line wherever it
+        appears along with the per-echo result characters (such as !!.!!),
+        so no line indexes are needed. The return value is columnar, like
+        ios_ping_stats_batch, with an "index" list, the ios_ping_stats keys,
+        a "marks" list holding the result characters, and these loss
+        pattern keys:
+          loss_cnt: Echoes not returned ('.' and any other non-'!' result)
+          loss_bursts: Number of runs of consecutive lost echoes
+          burst_max: Length of the longest run of lost echoes
+          burst_avg: Average length of a run of lost echoes (float)
+
+        Outputs that fail to parse are recorded as -1 in the ios_ping_stats
+        columns. The loss pattern columns are always derived from the result
+        characters found, which are empty if there were none.
+        """
+        keys = perf.parse.PING_KEYS + _PING_LOSS_KEYS + ("marks",)
+        columns = {"index": []}
+        columns.update((key, []) for key in keys)
+        appends = [columns[key].append for key in keys]
+
+        for i, output in enumerate(outputs):
+            if isinstance(output, str):
+                text = output
+            elif "skipped" in output:
+                continue
+            else:
+                text = output["stdout"][cmd_index]
+            columns["index"].append(i)
+            for append, value in zip(appends, perf.parse.ping_loss(text)):
+                append(value)
+
+        if as_numpy:
+            return perf.matrix.to_structured_array(columns)
+        return columns
+
+    @staticmethod
+    def ios_ping_stats_batch(
+        results, cmd_index=0, line_index=None, as_numpy=False
+    ):
+        """
+        Batch version of ios_ping_stats which accepts an entire list of
+        registered loop results, skips any skipped items, and parses the
+        ping output from the rest. When line_index is given, only that line
+        of stdout_lines[cmd_index] is parsed, otherwise the entire stdout
+        at cmd_index is used. The return value is columnar, like
+        ios_ipsla_stats_batch, with an "index" list plus one list per ping
+        key. Outputs that fail to parse are recorded as -1 in every column.
+        """
+        columns = {"index": []}
+        columns.update((key, []) for key in perf.parse.PING_KEYS)
+        appends = [columns[key].append for key in perf.parse.PING_KEYS]
+
+        for i, result in enumerate(results):
+            if "skipped" in result:
+                continue
+            if line_index is None:
+                text = result["stdout"][cmd_index]
+            else:
+                text = result["stdout_lines"][cmd_index][line_index]
+            cp_hash = FilterModule.ios_ping_stats(text)
+            columns["index"].append(i)
+            for append, key in zip(appends, perf.parse.PING_KEYS):
+                append(cp_hash[key] if cp_hash else -1)
+
+        if as_numpy:
+            return perf.matrix.to_structured_array(columns)
+        return columns
+
+    @staticmethod
+    def ios_ping_csv(cp_hash, buf=None):
         """
         This filter return a string of values in clean CSV format given
         an input of a cisco ping hash (cp_hash) from the previous filter.
         This filter can simplify jinja2 templates, for example.
         The 6 integers are returned in CSV format as a string:
         "pkt_per,pkt_cmp,pkt_tot,rtt_min,rtt_avg,rtt_max"
+        When buf is given, the row and a newline are written to it instead
+        and the row count (1) is returned, like ios_ipsla_csv.
         """
 
         # Return string of values in clean CSV format
         # This can simplify jinja2 templates, for example
-        return "{0},{1},{2},{3},{4},{5}".format(
-            cp_hash["pkt_per"],
-            cp_hash["pkt_cmp"],
-            cp_hash["pkt_tot"],
-            cp_hash["rtt_min"],
-            cp_hash["rtt_avg"],
-            cp_hash["rtt_max"],
+        csv_str = _PING_CSV_FORMAT(*_PING_CSV_ITEMS(cp_hash))
+        if buf is None:
+            return csv_str
+        buf.write(csv_str + "\n")
+        return 1
+
+    @staticmethod
+    def mperf_rows(results, src_host, src_ip, lspv_line=13):
+        """
+        Builds the mperf rollup rows for one host from its registered loop
+        results (PROBE_OUTPUT.results), where each result holds the IP SLA,
+        DF-bit ping, and LSPV outputs in that order. Each row holds the
+        source and target, the brief IP SLA CSV, whether the ping passed
+        (True/False), the LSPV codes from line lspv_line of the third
+        output, and the synopsis. Skipped results produce no row. The rows
+        are returned as one newline-terminated string, as templates/mperf.j2
+        renders them, so they can also be rebuilt outside of Ansible.
+        """
+        stats = FilterModule.ios_ipsla_stats_batch(results)
+        pings = FilterModule.ios_ping_stats_batch(results, 1)
+        lspvs = FilterModule._mperf_lspvs(results, stats["index"], lspv_line)
+        csvs = FilterModule.ios_ipsla_csv_batch(stats)
+        synopses = FilterModule.perf_synopsis_batch(
+            stats, lspvs, pings["pkt_cmp"]
+        )
+
+        rows = [
+            FilterModule._rollup_row(
+                src_host,
+                src_ip,
+                results[i]["item"],
+                csv_str,
+                pkt_cmp > 0,
+                lspv,
+                synopsis,
+            )
+            for i, csv_str, pkt_cmp, lspv, synopsis in zip(
+                stats["index"], csvs, pings["pkt_cmp"], lspvs, synopses
+            )
+        ]
+        rows.append("")
+        return "\n".join(rows) if len(rows) > 1 else ""
+
+    @staticmethod
+    def _mperf_lspvs(results, index, lspv_line):
+        """
+        Returns line lspv_line of the third output of each result in index,
+        or an empty string when the LSPV output is shorter than that.
+        """
+        lspvs = []
+        for i in index:
+            lines = results[i]["stdout_lines"][2]
+            lspvs.append(lines[lspv_line] if len(lines) > lspv_line else "")
+        return lspvs
+
+    @staticmethod
+    def _rollup_row(src_host, src_ip, target, *cells):
+        """
+        Returns one rollup row: the source host and IP, the hostname and
+        ipv4addr of the target hash, then the remaining cells, each
+        rendered as str() (as Jinja2 would) and joined with commas.
+        """
+        row = [src_host, src_ip, target["hostname"], target["ipv4addr"]]
+        return ",".join(str(cell) for cell in row + list(cells))
+
+    @staticmethod
+    def lperf_rows(stats_cols, src_host, src_ip, lookup_hashes):
+        """
+        Builds the lperf_get rollup rows for one host from the interval
+        columns returned by ios_ipsla_stats_batch (with intervals enabled)
+        and the LOOKUP_HASHES list giving the target of each result index.
+        Each row holds the source and target, the interval start time, and
+        the full IP SLA CSV. The rows are returned as one newline-terminated
+        string, as templates/lperf_get.j2 renders them.
+        """
+        csvs = FilterModule.ios_ipsla_csv_batch(stats_cols, False)
+        rows = []
+        for i, start_time, csv_str in zip(
+            stats_cols["index"], stats_cols["start_time"], csvs
+        ):
+            rows.append(
+                FilterModule._rollup_row(
+                    src_host, src_ip, lookup_hashes[i], start_time, csv_str
+                )
+            )
+        rows.append("")
+        return "\n".join(rows) if len(rows) > 1 else ""
+
+    @staticmethod
+    def sperf_row(results, src_host, line_index=None):
+        """
+        Builds the single sperf rollup row for one host: the host name
+        followed by the average RTT to each target, in the order of the
+        results, with an empty cell for each skipped result (the host
+        itself) and -1 for output that failed to parse. The success rate
+        line is found anywhere within each stdout, unless line_index picks
+        one line of stdout_lines instead. The row is returned as
+        templates/sperf.j2 renders it, without a trailing newline.
+        """
+        pings = FilterModule.ios_ping_stats_batch(results, 0, line_index)
+        cells = [""] * len(results)
+        for i, rtt_avg in zip(pings["index"], pings["rtt_avg"]):
+            cells[i] = rtt_avg
+        return ",".join([src_host] + [str(cell) for cell in cells])
+
+    @staticmethod
+    def sperf_matrix(hosts, host_vars, dests, path=None, line_index=None):
+        """
+        This filter gathers the sperf ping results of every host into
+        NumPy matrices with one row per source host (in the order of the
+        hosts list) and one column per target key (in the order of dests,
+        eg CSV_NAMES). The "rtt" matrix holds the average RTT and the
+        "loss" matrix the percentage of echoes lost. Cells are NaN when the
+        target was skipped (the host itself), the output failed to parse,
+        or the host has no PROBE_OUTPUT in host_vars. RTT cells are also
+        NaN when every echo was lost, since no RTT was measured. As with
+        sperf_row, the success rate line is searched for within each
+        stdout unless line_index picks one line of stdout_lines.
+
+        Row (per source), column (per target), and all-pairs statistics
+        are computed in a vectorized way, as is the RTT asymmetry between
+        each pair of hosts. A host's own target column is the one skipped
+        in its results, so the A to B and B to A cells can be compared.
+        Outliers are cells whose robust z-score, based on the median
+        absolute deviation of all RTTs, exceeds 3.5.
+
+        When path is given, it is used as a file name prefix for the
+        outputs: the float32 matrices and names (path.npz), the statistics
+        (path_stats.csv), every host pair's asymmetry, largest first
+        (path_asym.csv), and the outliers, largest first
+        (path_outliers.csv). A summary hash is returned, or False if
+        NumPy is not installed.
+        """
+        if np is None:
+            return False
+
+        cells, self_cols = FilterModule._sperf_cells(
+            hosts, host_vars, dests, line_index
         )
+        return perf.matrix.sperf_summary(cells, self_cols, hosts, dests, path)
+
+    @staticmethod
+    def _sperf_cells(hosts, host_vars, dests, line_index):
+        """
+        Gathers the parsed ping results of every host for sperf_matrix as
+        flat coordinate lists: the "src" row and "dst" column of each cell
+        and its "rtt_avg", "pkt_cmp", and "pkt_tot" values. Results for
+        unknown targets get column -1. Also returns the column skipped in
+        each host's results, which is the host's own target column.
+        """
+        dest_index = {key: i for i, key in enumerate(dests)}
+        cells = {"src": [], "dst": [], "rtt_avg": [], "pkt_cmp": []}
+        cells["pkt_tot"] = []
+        self_cols = {}
+        for row, host in enumerate(hosts):
+            results = host_vars[host].get("PROBE_OUTPUT", {}).get("results")
+            if not results:
+                continue
+            cols = [
+                dest_index.get(result.get("item", {}).get("key"), -1)
+                for result in results
+            ]
+            for col, result in zip(cols, results):
+                if col >= 0 and "skipped" in result:
+                    self_cols[row] = col
+            pings = FilterModule.ios_ping_stats_batch(results, 0, line_index)
+            cells["src"].extend([row] * len(pings["index"]))
+            cells["dst"].extend(cols[i] for i in pings["index"])
+            for key in ("rtt_avg", "pkt_cmp", "pkt_tot"):
+                cells[key].extend(pings[key])
+        return cells, self_cols
 
     @staticmethod
     def ios_parse_ip(text):
@@ -0,0 +1,18 @@
+"""
+Parsers, stores, and other machinery behind the custom filters in
+plugins/filter/filter.py, which imports this package relative to itself.
+"""
+
+from . import (
+    archive,
+    cache,
+    fib,
+    files,
+    matrix,
+    parse,
+    plan,
+    resolve,
+    sketch,
+    stats,
+    store,
+)
@@ -0,0 +1,312 @@
+"""
+Archives of raw probe output for the probe_archive_* and raw_archive_*
+filters: gzipped JSON copies of the registered loop results of one run,
+and append-only segments of individually compressed outputs with an
+index for random access.
+"""
+
+import gzip
+import json
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from collections.abc import Mapping
+
+from . import files
+
+# Keys of each registered loop result kept by probe_archive_write
+_ARCHIVE_KEYS = ("item", "skipped", "stdout")
+
+# Raw output archive layout used by raw_archive_append. Each frame in the
+# segment file holds a fixed header (magic, version, metadata length, data
+# length), the JSON metadata, then the zlib-compressed output text. The
+# sidecar index holds one (frame offset, frame length) record per frame.
+_RAW_MAGIC = b"RAWF"
+_RAW_VERSION = 1
+_RAW_FRAME = struct.Struct("<4sBHI")
+_RAW_INDEX = struct.Struct("<QI")
+_RAW_META_KEYS = ("src_host", "dest_host", "probe", "dtg")
+
+# Preset zlib dictionary of the fixed text in IOS probe outputs. Single
+# outputs are too short to compress well alone, so each frame is deflated
+# against these phrases. Changing it requires a new _RAW_VERSION.
+_RAW_ZDICT = (
+    b"Type escape sequence to abort.\n"
+    b"Sending 5, 100-byte MPLS Echos to /32,\n"
+    b"     timeout is 2 seconds, send interval is 0 msec:\n\n"
+    b"Codes: '!' - success, 'Q' - request not sent, '.' - timeout,\n"
+    b"  'L' - labeled output interface, 'B' - unlabeled output interface,\n"
+    b"  'D' - DS Map mismatch, 'F' - no FEC mapping, 'f' - FEC mismatch,\n"
+    b"  'M' - malformed request, 'm' - unsupported tlvs, 'N' - no label\n"
+    b"  'P' - no rx intf label prot, 'p' - premature termination of LSP,\n"
+    b"  'R' - transit router, 'I' - unknown upstream index,\n"
+    b"  'l' - Label switched with FEC change, 'd' - see DDMAP for return\n"
+    b"  'X' - unknown return code, 'x' - return code 0\n\n"
+    b"Sending 5, 1500-byte ICMP Echos to , timeout is 1 seconds:\n"
+    b"Packet sent with a source address of \n"
+    b"Packet sent with the DF bit set\n"
+    b"Success rate is 100 percent (5/5), round-trip min/avg/max =  ms\n"
+    b"IPSLA operation id: \n"
+    b"Latest RTT:  milliseconds\n"
+    b"Latest operation start time: \n"
+    b"Latest operation return code: OK\n"
+    b"Start Time Index:  UTC \n"
+    b"Type of operation: udp-jitter\n"
+    b"Voice Scores:\n"
+    b"MinOfICPIF: \tMaxOfICPIF: \tMinOfMOS: \tMaxOfMOS: \n"
+    b"RTT Values:\n"
+    b"Number Of RTT: \t\tRTT Min/Avg/Max:  milliseconds\n"
+    b"Latency one-way time:\n"
+    b"Number of Latency one-way Samples: \n"
+    b"Source to Destination Latency one way Min/Avg/Max:  milliseconds\n"
+    b"Destination to Source Latency one way Min/Avg/Max:  milliseconds\n"
+    b"Jitter Time:\n"
+    b"Number of SD Jitter Samples: \n"
+    b"Number of DS Jitter Samples: \n"
+    b"Source to Destination Jitter Min/Avg/Max:  milliseconds\n"
+    b"Destination to Source Jitter Min/Avg/Max:  milliseconds\n"
+    b"Over Threshold:\n"
+    b"Number Of RTT Over Threshold:  (%)\n"
+    b"Packet Loss Values:\n"
+    b"Loss Source to Destination: \n"
+    b"Source to Destination Loss Periods Number: \n"
+    b"Source to Destination Loss Period Length Min/Max: \n"
+    b"Source to Destination Inter Loss Period Length Min/Max: \n"
+    b"Loss Destination to Source: \n"
+    b"Destination to Source Loss Periods Number: \n"
+    b"Destination to Source Loss Period Length Min/Max: \n"
+    b"Destination to Source Inter Loss Period Length Min/Max: \n"
+    b"Out Of Sequence: \tTail Drop: \n"
+    b"Packet Late Arrival: \tPacket Skipped: \n"
+    b"Voice Score Values:\n"
+    b"Calculated Planning Impairment Factor (ICPIF): \n"
+    b"MOS score: \n"
+    b"Number of successes: \n"
+    b"Number of failures: \n"
+)
+
+
+def probe_archive_write(results, path, meta=None):
+    """
+    This filter saves the raw registered loop results of a probe task
+    (eg, PROBE_OUTPUT.results) for one host as gzipped JSON at path,
+    along with a hash of metadata (such as file_id, dtg, src_host,
+    src_ip, and csv_header) needed to rebuild the rollup rows later.
+    Only the item, skipped, and stdout keys of each result are kept;
+    stdout_lines is rebuilt from stdout by probe_archive_read. The file
+    is written to a temporary name and then renamed, so a partially
+    written archive is never seen. The number of results is returned.
+    """
+    archive = {
+        "meta": meta or {},
+        "results": [
+            {key: result[key] for key in _ARCHIVE_KEYS if key in result}
+            for result in results
+        ],
+    }
+    out_dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as handle:
+            handle.write(json.dumps(archive).encode("utf-8"))
+    os.replace(tmp_path, path)
+    return len(archive["results"])
+
+
+def probe_archive_read(path):
+    """
+    Reads an archive written by probe_archive_write and returns a hash
+    with its "meta" hash and "results" list. The stdout_lines key of
+    each unskipped result is rebuilt by splitting each stdout string on
+    newlines, as the ios_command module does, so the results can be
+    passed to the same filters as the original PROBE_OUTPUT.results.
+    """
+    with gzip.open(path, "rb") as handle:
+        archive = json.loads(handle.read().decode("utf-8"))
+    for result in archive["results"]:
+        if "stdout" in result:
+            result["stdout_lines"] = [
+                str(text).split("\n") for text in result["stdout"]
+            ]
+    return archive
+
+
+def raw_archive_append(results, path, meta, probes=None):
+    """
+    This filter appends the raw output of every command in the
+    registered loop results of a probe task (eg, PROBE_OUTPUT.results)
+    to an append-only segment file at path on the control machine.
+    Each output is one frame holding its src_host, dest_host, probe
+    type, and dtg as metadata, and its text compressed by zlib with a
+    preset dictionary of IOS phrases. A sidecar index at path + ".idx"
+    records the offset and length of every frame, so any output can be
+    read back by raw_archive_read without scanning the segment.
+
+    The meta hash gives the "src_host" and "dtg" of the run, like the
+    one given to probe_archive_write. The probes list names the commands
+    of each result in order, eg ['udp-jitter', 'ping-df', 'lspv'], and
+    defaults to their position. The target of each result is its loop
+    item, or the hash at the same index of the "lookup_hashes" list of
+    meta when given. Skipped results are not stored.
+    Appends are serialized with a file lock so every fork can share one
+    segment, and frames are flushed before they are indexed so the index
+    never points past the data. The number of frames appended is
+    returned.
+    """
+    lookup_hashes = meta.get("lookup_hashes")
+    frames = []
+    for i, result in enumerate(results):
+        if "stdout" not in result:
+            continue
+        target = lookup_hashes[i] if lookup_hashes else result["item"]
+        for j, text in enumerate(result["stdout"]):
+            frame_meta = {
+                "src_host": meta["src_host"],
+                "dest_host": target["hostname"],
+                "probe": probes[j] if probes else str(j),
+                "dtg": meta["dtg"],
+            }
+            frames.append(_raw_frame_pack(frame_meta, text))
+
+    def _write(handle):
+        records = []
+        offset = handle.tell()
+        for frame in frames:
+            handle.write(frame)
+            records.append(_RAW_INDEX.pack(offset, len(frame)))
+            offset += len(frame)
+        handle.flush()
+        _raw_index_append(path + ".idx", records)
+        return len(records)
+
+    if not frames:
+        return 0
+    return files.locked_append(path, _write, binary=True)
+
+
+def _raw_frame_pack(meta, text):
+    """
+    Returns one raw output archive frame: the header, the compact JSON
+    metadata hash, and the text compressed with the preset dictionary.
+    """
+    meta = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+    comp = zlib.compressobj(zdict=_RAW_ZDICT)
+    data = comp.compress(str(text).encode("utf-8")) + comp.flush()
+    header = _RAW_FRAME.pack(_RAW_MAGIC, _RAW_VERSION, len(meta), len(data))
+    return header + meta + data
+
+
+def _raw_index_append(idx_path, records):
+    """
+    Appends packed index records to a raw output archive index, first
+    dropping any partial record left by an interrupted append.
+    """
+    with open(idx_path, "ab") as index:
+        size = index.tell()
+        if size % _RAW_INDEX.size:
+            index.truncate(size - size % _RAW_INDEX.size)
+        index.write(b"".join(records))
+
+
+def _raw_frames(path, entries=None):
+    """
+    Generator of (entry, metadata hash, compressed data view) for the
+    frames of a raw output archive, read through memory maps of the
+    segment and its index. All frames are returned in order unless
+    entries lists the frame numbers wanted. Entries beyond the index,
+    or indexed frames beyond the end of the segment (from an append
+    that was interrupted), are skipped. Each data view is released
+    when the next frame is requested.
+    """
+    try:
+        seg_file = open(path, "rb")
+        idx_file = open(path + ".idx", "rb")
+    except FileNotFoundError:
+        return
+    with seg_file, idx_file:
+        count = os.fstat(idx_file.fileno()).st_size // _RAW_INDEX.size
+        if not os.fstat(seg_file.fileno()).st_size or not count:
+            return
+        seg = mmap.mmap(seg_file.fileno(), 0, access=mmap.ACCESS_READ)
+        idx = mmap.mmap(idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+        with seg, idx, memoryview(seg) as view:
+            for entry in range(count) if entries is None else entries:
+                if not 0 <= entry < count:
+                    continue
+                offset, length = _RAW_INDEX.unpack_from(
+                    idx, entry * _RAW_INDEX.size
+                )
+                if offset + length > len(view):
+                    continue
+                meta, data = _raw_frame_unpack(view, offset)
+                with data:
+                    yield entry, meta, data
+
+
+def _raw_frame_unpack(view, offset):
+    """
+    Returns the metadata hash and a view of the compressed data of the
+    raw output archive frame at offset within the segment view, raising
+    ValueError if no valid frame header is found there.
+    """
+    magic, version, meta_len, data_len = _RAW_FRAME.unpack_from(view, offset)
+    if magic != _RAW_MAGIC or version != _RAW_VERSION:
+        raise ValueError("bad archive frame at offset {0}".format(offset))
+    start = offset + _RAW_FRAME.size
+    meta = json.loads(bytes(view[start : start + meta_len]))
+    start += meta_len
+    return meta, view[start : start + data_len]
+
+
+def raw_archive_index(
+    path, src_host=None, dest_host=None, probe=None, dtg=None
+):
+    """
+    Lists the outputs in a raw output archive written by
+    raw_archive_append without decompressing any of them. Each hash in
+    the returned list holds the "entry" number of the output along with
+    its "src_host", "dest_host", "probe", and "dtg". When any of those
+    arguments are given, only outputs with matching values are listed.
+    An empty list is returned when the archive does not exist.
+    """
+    wanted = {
+        key: value
+        for key, value in zip(_RAW_META_KEYS, (src_host, dest_host, probe, dtg))
+        if value is not None
+    }
+    listing = []
+    for entry, meta, _ in _raw_frames(path):
+        if all(meta.get(key) == value for key, value in wanted.items()):
+            meta["entry"] = entry
+            listing.append(meta)
+    return listing
+
+
+def raw_archive_read(path, entries):
+    """
+    Reads outputs back from a raw output archive written by
+    raw_archive_append. The entries are one entry number, a list of
+    them, or the list of hashes returned by raw_archive_index. The
+    index gives the position of each output directly, so only the
+    frames asked for are decompressed, straight from the memory-mapped
+    segment. A list of hashes is returned in the order asked for, each
+    holding the metadata and "entry" number of the output plus its
+    "text". Entries not in the archive are left out.
+    """
+    if isinstance(entries, (int, Mapping)):
+        entries = [entries]
+    numbers = [
+        entry["entry"] if isinstance(entry, Mapping) else int(entry)
+        for entry in entries
+    ]
+    outputs = []
+    for entry, meta, data in _raw_frames(path, numbers):
+        decomp = zlib.decompressobj(zdict=_RAW_ZDICT)
+        text = decomp.decompress(data) + decomp.flush()
+        meta["entry"] = entry
+        meta["text"] = text.decode("utf-8")
+        outputs.append(meta)
+    return outputs
@@ -0,0 +1,219 @@
+"""
+Cache of parse results for the IP SLA parsers, kept in process and
+optionally in an SQLite database shared by every fork and later runs.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# In-process cache of parse results, keyed by a digest of the parser name,
+# parser version, and input text; least recently used entries are evicted
+# once the size limit is reached. When the environment variable
+# PERF_PARSE_CACHE names an SQLite database file, results are also kept
+# there so other forks and later runs can reuse them. The database is
+# trimmed to PERF_PARSE_CACHE_MB megabytes of entries each time about a
+# tenth of that has been written by a process.
+_PARSE_CACHE = OrderedDict()
+_PARSE_CACHE_MAX = 8192
+_PARSE_CACHE_LOCK = threading.RLock()
+_PARSE_CACHE_DB = {}
+
+# SQLite connections inherited from the parent across a fork. SQLite must
+# not use or close a connection in a forked child, so they are only kept
+# referenced here to stop garbage collection from closing them.
+_PARSE_CACHE_DB_FORKED = []
+_PARSE_CACHE_WRITTEN = {"pid": None, "bytes": 0}
+_PARSE_CACHE_MB = 64
+
+# Version of each cached parser. Bump it whenever the parser's output
+# changes so results cached by an older version are never used.
+_PARSER_VERSIONS = {"ipsla": 1}
+
+
+def cached_parse(name, text, parse):
+    """
+    Returns parse(text), a flat list of JSON-compatible values, from
+    the in-process cache or the PERF_PARSE_CACHE database when the
+    same parser version has already seen the same text. Otherwise the
+    text is parsed and the result stored in both. A new list is always
+    returned, so callers may modify it without affecting the cache.
+    """
+    key = hashlib.blake2b(
+        "{0}|{1}|{2}".format(name, _PARSER_VERSIONS[name], text).encode(
+            "utf-8"
+        ),
+        digest_size=16,
+    ).hexdigest()
+    with _PARSE_CACHE_LOCK:
+        cached = _PARSE_CACHE.get(key)
+        if cached is not None:
+            _PARSE_CACHE.move_to_end(key)
+            return list(cached)
+
+    cache_path = os.environ.get("PERF_PARSE_CACHE")
+    values = None
+    if cache_path:
+        values = parse_cache_read(cache_path, key)
+    if values is None:
+        values = parse(text)
+        if cache_path:
+            parse_cache_write(cache_path, key, values)
+
+    with _PARSE_CACHE_LOCK:
+        _PARSE_CACHE[key] = tuple(values)
+        if len(_PARSE_CACHE) > _PARSE_CACHE_MAX:
+            _PARSE_CACHE.popitem(last=False)
+    return list(values)
+
+
+def parse_cache_clear():
+    """
+    Empties the in-process parse cache, so the next parse of each text
+    is served by the database or the parser itself.
+    """
+    _PARSE_CACHE.clear()
+
+
+def _parse_cache_db(path):
+    """
+    Returns this process's connection to the SQLite parse cache at
+    path, creating the database on first use. Connections are keyed
+    by process ID, so forked children open their own; those inherited
+    from the parent are set aside without being closed. WAL journaling
+    lets every fork read while another writes, and durability is not
+    needed since a lost entry is only parsed again.
+    """
+    db_key = (os.getpid(), path)
+    conn = _PARSE_CACHE_DB.get(db_key)
+    if conn is None:
+        for key in [key for key in _PARSE_CACHE_DB if key[0] != db_key[0]]:
+            _PARSE_CACHE_DB_FORKED.append(_PARSE_CACHE_DB.pop(key))
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(
+            path, timeout=30, isolation_level=None, check_same_thread=False
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS parse_cache (key TEXT PRIMARY KEY,"
+            " value TEXT, used REAL, size INTEGER) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS parse_cache_used"
+            " ON parse_cache (used)"
+        )
+        _PARSE_CACHE_DB[db_key] = conn
+    return conn
+
+
+def parse_cache_read(path, key):
+    """
+    Loads one cached result from the on-disk cache, or returns None on
+    a miss or any database error. The last-used time, which decides
+    what trimming removes first, is refreshed at most once an hour per
+    entry to avoid a write on every hit.
+    """
+    try:
+        with _PARSE_CACHE_LOCK:
+            conn = _parse_cache_db(path)
+            row = conn.execute(
+                "SELECT value, used FROM parse_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if now - row[1] > 3600:
+                conn.execute(
+                    "UPDATE parse_cache SET used = ? WHERE key = ?",
+                    (now, key),
+                )
+    except sqlite3.Error:
+        return None
+    return json.loads(row[0])
+
+
+def parse_cache_write(path, key, values):
+    """
+    Stores one result in the on-disk cache, then trims the cache once
+    this process has written about a tenth of its size limit since the
+    last trim. Database errors, such as a lock held for too long, only
+    mean the result is not shared.
+    """
+    data = json.dumps(values)
+    max_mb = float(os.environ.get("PERF_PARSE_CACHE_MB", _PARSE_CACHE_MB))
+    with _PARSE_CACHE_LOCK:
+        try:
+            _parse_cache_db(path).execute(
+                "INSERT OR REPLACE INTO parse_cache VALUES (?, ?, ?, ?)",
+                (key, data, time.time(), len(key) + len(data)),
+            )
+        except sqlite3.Error:
+            return
+        if _PARSE_CACHE_WRITTEN["pid"] != os.getpid():
+            _PARSE_CACHE_WRITTEN.update(pid=os.getpid(), bytes=0)
+        _PARSE_CACHE_WRITTEN["bytes"] += len(key) + len(data)
+        if _PARSE_CACHE_WRITTEN["bytes"] < max_mb * (1 << 20) / 10:
+            return
+        _PARSE_CACHE_WRITTEN["bytes"] = 0
+    try:
+        parse_cache_trim(path, max_mb)
+    except sqlite3.Error:
+        pass
+
+
+def parse_cache_trim(path, max_mb=_PARSE_CACHE_MB):
+    """
+    This filter trims the on-disk parse cache (the SQLite database
+    named by PERF_PARSE_CACHE) so its entries hold at most max_mb
+    megabytes, removing the least recently used entries until 80% of
+    the limit remains. Freed space is reused by later entries rather
+    than returned, so the file stays near its high-water mark. A hash
+    is returned with the number of "entries" and "bytes" kept and the
+    number of entries "removed".
+    """
+    limit = max_mb * (1 << 20)
+    with _PARSE_CACHE_LOCK:
+        conn = _parse_cache_db(path)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            entries, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM parse_cache"
+            ).fetchone()
+            removed = 0
+            if total > limit:
+                for key, size in conn.execute(
+                    "SELECT key, size FROM parse_cache ORDER BY used"
+                ).fetchall():
+                    if total <= 0.8 * limit:
+                        break
+                    conn.execute(
+                        "DELETE FROM parse_cache WHERE key = ?", (key,)
+                    )
+                    total -= size
+                    removed += 1
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            # There is nothing to roll back when BEGIN itself failed
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+            raise
+    return {
+        "entries": entries - removed,
+        "bytes": total,
+        "removed": removed,
+    }
+
+
+def digest(text):
+    """
+    Returns a short hex digest of a string, used to detect unchanged
+    device output without storing the output itself.
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
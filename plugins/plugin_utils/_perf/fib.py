@@ -0,0 +1,273 @@
+"""
+FIB helpers for the intersect_block filters: indexing the host routes of
+"show ip cef" output, longest-prefix matching, and the FIB snapshots
+used by intersect_block_delta to skip unchanged FIBs.
+"""
+
+import hashlib
+import os
+import re
+import socket
+import struct
+import sys
+import tempfile
+from array import array
+
+# Matches the prefix column at the start of each "show ip cef" line,
+# capturing the address and the prefix length
+_RE_FIB_PREFIX = re.compile(
+    r"^\s*(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})/(\d{1,2})\b", re.MULTILINE
+)
+
+# FIB snapshot layout used by intersect_block_delta: a fixed header (magic,
+# version, lpm flag, FIB text digest, target list digest, host route count,
+# online target count), then the sorted /32 host routes as packed 4-byte
+# addresses, then the indexes of the online targets as little-endian uint32
+_FIB_SNAP_MAGIC = b"FIBS"
+_FIB_SNAP_VERSION = 1
+_FIB_SNAP_HEADER = struct.Struct("<4sIB16s16sII")
+
+
+def intersect_block_delta(text, cp_hash_list, snapshot, lpm=False):
+    """
+    Incremental version of intersect_block for repeated runs. The
+    snapshot is a file path (one per device) on the control machine
+    where a compact record of the last FIB seen is kept: digests of
+    the FIB text and of the target list, the sorted /32 host routes
+    packed as 4-byte addresses, and the indexes of the online targets.
+
+    When the text and targets are identical to the last run, the FIB
+    is not parsed at all and the stored online targets are returned.
+    Otherwise the FIB is parsed and its host routes are compared with
+    the snapshot, so the routes and targets that changed are reported,
+    and the snapshot is replaced. A missing or unreadable snapshot is
+    treated as an empty FIB with no online targets.
+
+    A hash is returned with these keys:
+      online: The online targets, exactly as intersect_block returns
+      appeared: Targets online now but not in the previous run
+      disappeared: Targets online in the previous run but not now
+      routes_added: Number of /32 host routes new since the last run
+      routes_removed: Number of /32 host routes no longer present
+      unchanged: True when the FIB was not parsed at all
+    """
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    tgt_digest = hashlib.blake2b(
+        "\n".join(d["ipv4addr"] for d in cp_hash_list).encode("utf-8"),
+        digest_size=16,
+    ).digest()
+    prev = _snapshot_load(snapshot)
+
+    result = {
+        "appeared": [],
+        "disappeared": [],
+        "routes_added": 0,
+        "routes_removed": 0,
+    }
+    if (
+        prev
+        and prev["digest"] == digest
+        and prev["targets"] == tgt_digest
+        and prev["lpm"] == bool(lpm)
+    ):
+        result["online"] = [cp_hash_list[i] for i in prev["online"]]
+        result["unchanged"] = True
+        return result
+
+    # Compare the packed host routes of both runs as byte strings
+    fib = fib_index(text)
+    hosts = _packed_hosts(fib)
+    old_hosts = prev["hosts"] if prev else set()
+    new_hosts = set(hosts)
+    result["routes_added"] = len(new_hosts - old_hosts)
+    result["routes_removed"] = len(old_hosts - new_hosts)
+
+    online_idx = array("I")
+    for i, d in enumerate(cp_hash_list):
+        if d["ipv4addr"] in fib["hosts"] or (
+            lpm and fib_lpm(fib, d["ipv4addr"])
+        ):
+            online_idx.append(i)
+    result["online"] = [cp_hash_list[i] for i in online_idx]
+    result["unchanged"] = False
+
+    result["appeared"], result["disappeared"] = _online_changes(
+        cp_hash_list, prev["online_addrs"] if prev else set(), result["online"]
+    )
+    _snapshot_save(
+        snapshot,
+        (digest, tgt_digest, lpm),
+        hosts,
+        online_idx,
+        [d["ipv4addr"] for d in result["online"]],
+    )
+    return result
+
+
+def _packed_hosts(fib):
+    """
+    Returns the /32 host routes of a FIB index from fib_index as a
+    sorted list of packed 4-byte addresses, skipping invalid addresses.
+    """
+    hosts = []
+    for addr in fib["hosts"]:
+        try:
+            hosts.append(socket.inet_aton(addr))
+        except OSError:
+            continue
+    hosts.sort()
+    return hosts
+
+
+def _online_changes(cp_hash_list, old_online, online):
+    """
+    Compares the online targets of this run with the set of target
+    addresses online in the previous run, returning the lists of
+    targets that appeared and disappeared. Targets are matched by
+    address, since the list may have changed.
+    """
+    new_online = {d["ipv4addr"] for d in online}
+    appeared = [
+        d
+        for d in cp_hash_list
+        if d["ipv4addr"] in new_online and d["ipv4addr"] not in old_online
+    ]
+    by_addr = {d["ipv4addr"]: d for d in cp_hash_list}
+    disappeared = [
+        by_addr.get(addr, {"ipv4addr": addr})
+        for addr in sorted(old_online - new_online)
+    ]
+    return appeared, disappeared
+
+
+def _snapshot_load(snapshot):
+    """
+    Reads a FIB snapshot written by _snapshot_save, returning a
+    hash with the "digest" of the FIB text, the "targets" digest, the
+    "lpm" flag, the set of packed "hosts", the list of "online" target
+    indexes, and the set of online target addresses ("online_addrs").
+    None is returned if the file is missing, truncated, or of another
+    format or version.
+    """
+    try:
+        with open(snapshot, "rb") as handle:
+            data = handle.read()
+        fields = _FIB_SNAP_HEADER.unpack_from(data)
+    except (OSError, struct.error):
+        return None
+    magic, version, lpm, digest, tgt_digest, n_hosts, n_online = fields
+    hosts_end = _FIB_SNAP_HEADER.size + 4 * n_hosts
+    addrs_end = hosts_end + 4 * n_online
+    if (
+        magic != _FIB_SNAP_MAGIC
+        or version != _FIB_SNAP_VERSION
+        or len(data) != addrs_end + 4 * n_online
+    ):
+        return None
+
+    online = array("I", data[addrs_end:])
+    if sys.byteorder != "little":
+        online.byteswap()
+    return {
+        "digest": digest,
+        "targets": tgt_digest,
+        "lpm": bool(lpm),
+        "hosts": {
+            data[i : i + 4] for i in range(_FIB_SNAP_HEADER.size, hosts_end, 4)
+        },
+        "online": online.tolist(),
+        "online_addrs": {
+            socket.inet_ntoa(data[i : i + 4])
+            for i in range(hosts_end, addrs_end, 4)
+        },
+    }
+
+
+def _snapshot_save(snapshot, fields, hosts, online, addrs):
+    """
+    Writes a FIB snapshot by way of a temporary file in the same
+    directory, like files.atomic_write_json. The fields are the
+    digests of the FIB text and target list followed by the lpm flag,
+    hosts are the sorted packed /32 routes, and online is an array of
+    indexes into the target list. The online target addresses are stored
+    as well, so a later run with another target list can still tell
+    which targets were online.
+    """
+    out_dir = os.path.dirname(os.path.abspath(snapshot))
+    os.makedirs(out_dir, exist_ok=True)
+    online = array("I", online)
+    if sys.byteorder != "little":
+        online.byteswap()
+    header = _FIB_SNAP_HEADER.pack(
+        _FIB_SNAP_MAGIC,
+        _FIB_SNAP_VERSION,
+        bool(fields[2]),
+        fields[0],
+        fields[1],
+        len(hosts),
+        len(online),
+    )
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as handle:
+        handle.write(header)
+        handle.write(b"".join(hosts))
+        handle.write(b"".join(socket.inet_aton(addr) for addr in addrs))
+        handle.write(online.tobytes())
+    os.replace(tmp_path, snapshot)
+
+
+def fib_index(text):
+    """
+    Parses the prefix column of "show ip cef" output into an index.
+    The returned hash has a "hosts" set of /32 addresses as dotted
+    strings, for constant time host route checks, and a "prefixes"
+    hash mapping each prefix length to a set of integer network
+    addresses, which is built lazily on the first longest-prefix match.
+    """
+    pairs = _RE_FIB_PREFIX.findall(text)
+    hosts = {addr for addr, length in pairs if length == "32"}
+    return {"pairs": pairs, "hosts": hosts, "prefixes": None}
+
+
+def fib_lpm(fib, ipv4addr):
+    """
+    Performs a longest-prefix match of an IPv4 address against a FIB
+    index from fib_index. The per-length tables are probed from the
+    longest length down, returning the matching prefix as a string
+    such as "10.0.0.0/8", or False when no prefix covers the address.
+    Default routes are ignored since they would cover every address.
+    """
+    if fib["prefixes"] is None:
+        prefixes = {}
+        for addr, length in fib["pairs"]:
+            length = int(length)
+            if not 0 < length <= 32:
+                continue
+            # Skip malformed rows, such as octets above 255
+            try:
+                net = _ipv4_to_int(addr)
+            except (OSError, ValueError):
+                continue
+            net &= (0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF
+            prefixes.setdefault(length, set()).add(net)
+        fib["lengths"] = sorted(prefixes, reverse=True)
+        fib["prefixes"] = prefixes
+
+    try:
+        addr = _ipv4_to_int(ipv4addr)
+    except (OSError, TypeError, ValueError):
+        return False
+    for length in fib["lengths"]:
+        net = addr & (0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF
+        if net in fib["prefixes"][length]:
+            return "{0}/{1}".format(
+                socket.inet_ntoa(net.to_bytes(4, "big")), length
+            )
+    return False
+
+
+def _ipv4_to_int(ipv4addr):
+    """
+    Converts a dotted IPv4 address string into a 32-bit integer.
+    """
+    return int.from_bytes(socket.inet_aton(ipv4addr), "big")
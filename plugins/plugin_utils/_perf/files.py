@@ -0,0 +1,105 @@
+"""
+File helpers shared by the filters: atomic JSON writes, appends
+serialized by a file lock, rollup files, and CSV output.
+"""
+
+import fcntl
+import json
+import os
+import tempfile
+from itertools import islice
+
+# Rows joined per write when serializing CSV into a caller's buffer
+_CSV_CHUNK_ROWS = 4096
+
+
+def atomic_write_json(path, data):
+    """
+    Writes data to path as JSON by way of a temporary file in the same
+    directory, which then atomically replaces the destination. Readers
+    therefore see either the old or the new file, never a partial one.
+    """
+    out_dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as handle:
+        json.dump(data, handle)
+    os.replace(tmp_path, path)
+
+
+def write_csv(path, header, rows):
+    """
+    Writes a header and a list of value lists to a CSV file, replacing
+    any existing file. Floats are rounded to 3 decimal places and None
+    values are left empty.
+    """
+
+    def _cell(value):
+        if value is None:
+            return ""
+        if isinstance(value, float):
+            return "{0:.3f}".format(value).rstrip("0").rstrip(".")
+        return str(value)
+
+    with open(path, "w", encoding="utf-8", buffering=1 << 20) as handle:
+        handle.write(header + "\n")
+        for row in rows:
+            handle.write(",".join(map(_cell, row)) + "\n")
+
+
+def locked_append(path, writer, binary=False):
+    """
+    Opens path for appending (creating parent directories as needed),
+    takes an exclusive advisory lock, positions the handle at the end
+    of the file, and calls writer with the open handle. The lock is
+    held until the buffered data has been flushed, which serializes
+    concurrent writers from different processes.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    mode, encoding = ("ab", None) if binary else ("a", "utf-8")
+    with open(path, mode, encoding=encoding, buffering=1 << 20) as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            handle.seek(0, os.SEEK_END)
+            result = writer(handle)
+            handle.flush()
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+    return result
+
+
+def write_csv_rows(rows, csv_format, buf):
+    """
+    Formats an iterable of value tuples with csv_format and writes them
+    to buf as newline-terminated rows, joining up to _CSV_CHUNK_ROWS
+    rows per write call. The number of rows written is returned.
+    """
+    count = 0
+    while True:
+        chunk = [csv_format(*row) for row in islice(rows, _CSV_CHUNK_ROWS)]
+        if not chunk:
+            return count
+        count += len(chunk)
+        chunk.append("")
+        buf.write("\n".join(chunk))
+
+
+def rollup_write(text, path, header=""):
+    """
+    This filter streams rendered CSV rows (typically the output of a
+    template lookup for one host) straight into the final rollup file
+    at path. The file is opened in append mode under an exclusive lock
+    so that every Ansible fork can write safely at the same time. The
+    first writer to find the file empty also writes the header. A
+    trailing newline is added to the rows when missing. The number of
+    rows written is returned.
+    """
+    rows = text if not text or text.endswith("\n") else text + "\n"
+
+    def _write(handle):
+        if header and handle.tell() == 0:
+            handle.write(header + "\n")
+        handle.write(rows)
+
+    locked_append(path, _write)
+    return rows.count("\n")
@@ -0,0 +1,204 @@
+"""
+NumPy helpers of the filters: structured arrays of columnar batch output,
+and the statistics of the sperf RTT and loss matrices built by the
+sperf_matrix filter.
+"""
+
+import warnings
+
+# NumPy is optional; the filters check for it before calling these helpers
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from . import files
+
+
+def sperf_summary(cells, self_cols, hosts, dests, path=None):
+    """
+    Fills the RTT and loss matrices of the sperf_matrix filter from the
+    coordinate lists of the parsed cells, and computes the statistics,
+    asymmetry, and outliers of the matrices. When path is given, the
+    matrices and reports are saved with it as a file name prefix. Returns
+    the summary hash of sperf_matrix.
+    """
+    rtt, loss = _sperf_fill(cells, (len(hosts), len(dests)))
+
+    stats = _sperf_stats(rtt, loss, hosts, dests)
+    asym = _sperf_asym(rtt, hosts, dests, self_cols)
+    outliers = _sperf_outliers(rtt, hosts, dests)
+
+    if path:
+        np.savez_compressed(
+            path + ".npz",
+            rtt=rtt.astype(np.float32),
+            loss=loss.astype(np.float32),
+            sources=np.array(hosts, dtype=str),
+            dests=np.array(dests, dtype=str),
+        )
+        files.write_csv(
+            path + "_stats.csv",
+            "scope,name,probes,rtt_min,rtt_median,rtt_p95,loss_pct",
+            stats,
+        )
+        files.write_csv(
+            path + "_asym.csv", "src,dst,rtt_fwd,rtt_rev,rtt_asym", asym
+        )
+        files.write_csv(path + "_outliers.csv", "src,dst,rtt,zscore", outliers)
+
+    overall = stats[-1]
+    return {
+        "sources": len(hosts),
+        "dests": len(dests),
+        "probes": overall[2],
+        "rtt_min": overall[3],
+        "rtt_median": overall[4],
+        "rtt_p95": overall[5],
+        "loss_pct": overall[6],
+        "max_asym": asym[0] if asym else None,
+        "outliers": len(outliers),
+    }
+
+
+def _sperf_fill(cells, shape):
+    """
+    Fills the RTT and loss matrices of sperf_matrix at once from the
+    coordinate lists given to sperf_summary. Cells of unknown targets are
+    dropped, while failures and missing cells stay NaN, as do the RTTs
+    of cells where every echo was lost.
+    """
+    rtt = np.full(shape, np.nan)
+    loss = np.full(shape, np.nan)
+    cells = {key: np.array(values) for key, values in cells.items()}
+    parsed = (cells["dst"] >= 0) & (cells["pkt_tot"] > 0)
+    src, dst = cells["src"][parsed], cells["dst"][parsed]
+    pkt_cmp, pkt_tot = cells["pkt_cmp"][parsed], cells["pkt_tot"][parsed]
+    loss[src, dst] = 100 * (1 - pkt_cmp / pkt_tot)
+    answered = pkt_cmp > 0
+    rtt[src[answered], dst[answered]] = cells["rtt_avg"][parsed][answered]
+    return rtt, loss
+
+
+def _sperf_stats(rtt, loss, hosts, dests):
+    """
+    Returns the statistics rows for sperf_matrix: one per source host,
+    one per target, and a final all-pairs row. Each row holds the scope,
+    name, number of cells with a loss value, the minimum, median, and
+    95th percentile RTT, and the mean loss percentage. Values are None
+    where no data exists.
+    """
+    rows = []
+    with warnings.catch_warnings():
+        # Rows or columns without any data are expected to be all NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for scope, names, axis in (
+            ("src", hosts, 1),
+            ("dst", dests, 0),
+            ("all", ["all"], None),
+        ):
+            columns = [
+                np.atleast_1d(np.sum(~np.isnan(loss), axis=axis)),
+                np.atleast_1d(np.nanmin(rtt, axis=axis)),
+                np.atleast_1d(np.nanmedian(rtt, axis=axis)),
+                np.atleast_1d(np.nanpercentile(rtt, 95, axis=axis)),
+                np.atleast_1d(np.nanmean(loss, axis=axis)),
+            ]
+            for i, name in enumerate(names):
+                row = [scope, name, int(columns[0][i])]
+                row.extend(_nan_to_none(col[i]) for col in columns[1:])
+                rows.append(row)
+    return rows
+
+
+def _sperf_asym(rtt, hosts, dests, self_cols):
+    """
+    Returns a row per pair of source hosts with a known target column
+    and RTTs measured in both directions: the two names, the RTT from
+    the first to the second, the reverse RTT, and their difference.
+    Rows are sorted by the absolute asymmetry, largest first.
+    """
+    rows = sorted(self_cols)
+    if len(rows) < 2:
+        return []
+    cols = [self_cols[row] for row in rows]
+    square = rtt[np.ix_(rows, cols)]
+    asym = square - square.T
+    first, second = np.triu_indices(len(rows), 1)
+    valid = ~np.isnan(asym[first, second])
+    first, second = first[valid], second[valid]
+    order = np.argsort(-np.abs(asym[first, second]), kind="stable")
+    return [
+        [
+            hosts[rows[a]],
+            dests[cols[b]],
+            float(square[a, b]),
+            float(square[b, a]),
+            float(asym[a, b]),
+        ]
+        for a, b in zip(first[order], second[order])
+    ]
+
+
+def _sperf_outliers(rtt, hosts, dests, z_limit=3.5):
+    """
+    Returns a row (source, target, RTT, robust z-score) per cell whose
+    RTT is unusually high compared to all measured RTTs, sorted by
+    z-score, largest first. The robust z-score uses the median and
+    median absolute deviation, so a few extreme cells cannot mask each
+    other. No outliers are reported when the deviation is 0.
+    """
+    measured = rtt[~np.isnan(rtt)]
+    if not measured.size:
+        return []
+    median = np.median(measured)
+    mad = np.median(np.abs(measured - median))
+    if not mad:
+        return []
+    with np.errstate(invalid="ignore"):
+        zscore = 0.6745 * (rtt - median) / mad
+        src, dst = np.nonzero(zscore > z_limit)
+    order = np.argsort(-zscore[src, dst], kind="stable")
+    return [
+        [hosts[a], dests[b], float(rtt[a, b]), float(zscore[a, b])]
+        for a, b in zip(src[order], dst[order])
+    ]
+
+
+def _nan_to_none(value):
+    """
+    Converts a NumPy scalar to a float, or None if it is NaN, so the
+    value can be returned to Ansible and written to CSV files.
+    """
+    return None if np.isnan(value) else float(value)
+
+
+def to_structured_array(columns):
+    """
+    Converts a hash of equal-length lists into a NumPy structured
+    array. Columns containing any float or numeric string (such as MOS
+    scores) become 64-bit floats, other string columns (such as start
+    times) become unicode, and the rest become 64-bit integers.
+    Returns False if NumPy is not installed.
+    """
+    if np is None:
+        return False
+
+    dtype = []
+    converted = {}
+    for key, values in columns.items():
+        if not any(isinstance(v, (str, float)) for v in values):
+            dtype.append((key, "i8"))
+            converted[key] = values
+            continue
+        try:
+            converted[key] = [float(v) for v in values]
+            dtype.append((key, "f8"))
+        except ValueError:
+            converted[key] = [str(v) for v in values]
+            dtype.append((key, "U{0}".format(max(map(len, values)))))
+
+    struct_array = np.empty(len(columns["index"]), dtype=dtype)
+    for key, values in converted.items():
+        struct_array[key] = values
+    return struct_array
@@ -0,0 +1,417 @@
+"""
+Parsers of IOS IP SLA and ping output used by the filters, including
+the IpslaStats record and the per-router IP SLA checkpoints.
+"""
+
+import json
+import re
+from collections.abc import Mapping
+
+from . import cache, files
+
+# Matches the line starting each interval of aggregated IP SLA statistics
+_RE_INTERVAL_START = re.compile(
+    r"^[ \t]*Start Time Index: ([^\r\n]*)", re.MULTILINE
+)
+
+# Matches the probe identifier printed before aggregated IP SLA statistics
+_RE_OPER_ID = re.compile(r"IPSLA operation id: (\d+)")
+
+# Precompiled value patterns for ints, 2-ints, 3-ints, and floats
+_RE_INT = re.compile(r"\d+")
+_RE_INT2 = re.compile(r"(\d+)/(\d+)")
+_RE_INT3 = re.compile(r"(\d+)/(\d+)/(\d+)")
+_RE_OVTHR = re.compile(r"(\d+) \((\d+)%\)")
+_RE_FLOAT = re.compile(r"\d+\.\d+")
+
+# Matches the lines of a ping output that matter, in a single pass: each
+# line of per-echo result characters (IOS wraps them every 70 echoes) and
+# the success rate line, capturing the rest of it which holds any RTTs
+_RE_PING_LINE = re.compile(
+    r"^(?:([!.UQM?&C]+)"
+    r"|Success rate is (\d+) percent \((\d+)/(\d+)\)(.*))\r?$",
+    re.M,
+)
+
+# Runs of consecutive lost echoes within the result characters
+_RE_LOSS_RUN = re.compile(r"[^!]+")
+
+# IP SLA field table: the label preceding the value in IOS output, the
+# value pattern, and the key names for the returned hash
+_IPSLA_FIELDS = (
+    ("Number Of RTT: ", _RE_INT, ("rtt_cnt",)),
+    ("RTT Min/Avg/Max: ", _RE_INT3, ("rtt_min", "rtt_avg", "rtt_max")),
+    ("Number of Latency one-way Samples: ", _RE_INT, ("lat_cnt",)),
+    (
+        "Destination Latency one way Min/Avg/Max: ",
+        _RE_INT3,
+        ("lat_sd_min", "lat_sd_avg", "lat_sd_max"),
+    ),
+    (
+        "Source Latency one way Min/Avg/Max: ",
+        _RE_INT3,
+        ("lat_ds_min", "lat_ds_avg", "lat_ds_max"),
+    ),
+    ("Number of SD Jitter Samples: ", _RE_INT, ("jit_sd_cnt",)),
+    (
+        "Source to Destination Jitter Min/Avg/Max: ",
+        _RE_INT3,
+        ("jit_sd_min", "jit_sd_avg", "jit_sd_max"),
+    ),
+    ("Number of DS Jitter Samples: ", _RE_INT, ("jit_ds_cnt",)),
+    (
+        "Destination to Source Jitter Min/Avg/Max: ",
+        _RE_INT3,
+        ("jit_ds_min", "jit_ds_avg", "jit_ds_max"),
+    ),
+    ("Number Of RTT Over Threshold: ", _RE_OVTHR, ("rtt_ovthr", "rtt_ovthp")),
+    ("Loss Source to Destination: ", _RE_INT, ("los_sd",)),
+    ("Destination Loss Periods Number: ", _RE_INT, ("los_sd_per",)),
+    (
+        "Destination Loss Period Length Min/Max: ",
+        _RE_INT2,
+        ("los_sd_pmin", "los_sd_pmax"),
+    ),
+    (
+        "Destination Inter Loss Period Length Min/Max: ",
+        _RE_INT2,
+        ("los_sd_imin", "los_sd_imax"),
+    ),
+    ("Loss Destination to Source: ", _RE_INT, ("los_ds",)),
+    ("Source Loss Periods Number: ", _RE_INT, ("los_ds_per",)),
+    (
+        "Source Loss Period Length Min/Max: ",
+        _RE_INT2,
+        ("los_ds_pmin", "los_ds_pmax"),
+    ),
+    (
+        "Source Inter Loss Period Length Min/Max: ",
+        _RE_INT2,
+        ("los_ds_imin", "los_ds_imax"),
+    ),
+    ("Out Of Sequence: ", _RE_INT, ("pkt_ooseq",)),
+    ("Tail Drop: ", _RE_INT, ("pkt_tdrop",)),
+    ("Packet Late Arrival: ", _RE_INT, ("pkt_late",)),
+    ("Packet Skipped: ", _RE_INT, ("pkt_skip",)),
+    ("Planning Impairment Factor (ICPIF): ", _RE_INT, ("voc_icpif",)),
+    ("MOS score: ", _RE_FLOAT, ("voc_mos",)),
+    ("MinOfMOS: ", _RE_FLOAT, ("voc_mos_min",)),
+    ("MaxOfMOS: ", _RE_FLOAT, ("voc_mos_max",)),
+    ("MinOfICPIF: ", _RE_INT, ("voc_icpif_min",)),
+    ("MaxOfICPIF: ", _RE_INT, ("voc_icpif_max",)),
+)
+
+# Flattened key names (43 in total) in field table order
+IPSLA_KEYS = tuple(key for field in _IPSLA_FIELDS for key in field[2])
+
+# Single alternation of every label so the text is scanned only once,
+# plus a map from the matched label back to its field table index
+_IPSLA_LABEL_RE = re.compile(
+    "|".join(re.escape(field[0]) for field in _IPSLA_FIELDS)
+)
+_IPSLA_LABEL_INDEX = {field[0]: i for i, field in enumerate(_IPSLA_FIELDS)}
+
+# Per field table entry: the value pattern, the position of its first key
+# within IPSLA_KEYS, and its number of keys
+_IPSLA_FIELD_POS = tuple(
+    (field[1], IPSLA_KEYS.index(field[2][0]), len(field[2]))
+    for field in _IPSLA_FIELDS
+)
+
+# Every key an IpslaStats record can hold; start_time is set only for
+# aggregated statistics split into intervals
+_IPSLA_SLOTS = IPSLA_KEYS + ("start_time",)
+_IPSLA_SLOT_SET = frozenset(_IPSLA_SLOTS)
+
+# Key names for the hash returned by ios_ping_stats, in CSV order
+PING_KEYS = ("pkt_per", "pkt_cmp", "pkt_tot", "rtt_min", "rtt_avg", "rtt_max")
+
+
+class IpslaStats(Mapping):
+    """
+    Compact record of parsed IP SLA statistics returned by ios_ipsla_stats.
+    Each stats key is a slot rather than a hash entry, which takes a
+    fraction of the memory of a 43-key dict when many records are held at
+    once. It is a read-only mapping, so Jinja can use either stats.rtt_cnt
+    or stats['rtt_cnt'], and its repr is that of the equivalent dict so
+    Ansible converts it to a regular hash when it is stored as a fact.
+    Values may still be replaced by key, but no new keys can be added.
+    """
+
+    __slots__ = _IPSLA_SLOTS
+
+    def __init__(self, values):
+        for key, value in zip(_IPSLA_SLOTS, values):
+            setattr(self, key, value)
+
+    def __getitem__(self, key):
+        if key in _IPSLA_SLOT_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in _IPSLA_SLOT_SET:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        for key in _IPSLA_SLOTS:
+            if hasattr(self, key):
+                yield key
+
+    def __len__(self):
+        return len(IPSLA_KEYS) + hasattr(self, "start_time")
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+def ipsla_values(text):
+    """
+    Parses IP SLA statistics text into a list of values parallel to
+    IPSLA_KEYS, with -1 for any field not found. This is the core of
+    ios_ipsla_stats, used directly by the batch filters to avoid
+    building a record per row. Identical text is only parsed once, as
+    results are cached by cache.cached_parse.
+    """
+    return cache.cached_parse("ipsla", text, _parse_ipsla_values)
+
+
+def _parse_ipsla_values(text):
+    """
+    Uncached implementation of ipsla_values.
+    """
+    values = [-1] * len(IPSLA_KEYS)
+    remaining = len(_IPSLA_FIELDS)
+    found = [False] * remaining
+
+    # Iterate over every label in the text, in order of appearance
+    for label in _IPSLA_LABEL_RE.finditer(text):
+        index = _IPSLA_LABEL_INDEX[label.group()]
+        if found[index]:
+            continue
+
+        # Perform the value match immediately after the label
+        value_re, pos, count = _IPSLA_FIELD_POS[index]
+        re_match = value_re.match(text, label.end())
+        if not re_match:
+            continue
+
+        # Multi-value fields use groups; single values use the whole
+        # match. Only MOS values are floats, which are left as strings.
+        if count > 1:
+            values[pos : pos + count] = map(int, re_match.groups())
+        elif value_re is _RE_FLOAT:
+            values[pos] = re_match.group()
+        else:
+            values[pos] = int(re_match.group())
+
+        # Stop scanning once every field has been found
+        found[index] = True
+        remaining -= 1
+        if not remaining:
+            break
+
+    return values
+
+
+def interval_values(chunks):
+    """
+    Generates a list of values per interval, as from ipsla_values,
+    with the interval's start time appended so that the values are
+    parallel to _IPSLA_SLOTS.
+    """
+    for start_time, block in split_ipsla_intervals(chunks):
+        values = ipsla_values(block)
+        values.append(start_time)
+        yield values
+
+
+def split_ipsla_intervals(chunks):
+    """
+    Splits aggregated IP SLA output into (start_time, block) tuples
+    without parsing the statistics. Each block runs from one "Start
+    Time Index" line up to the next. Any preamble before the first
+    marker is dropped, unless no marker exists at all, in which case
+    the whole text is yielded once with an empty start time.
+    """
+    if isinstance(chunks, str):
+        chunks = (chunks,)
+
+    buf = ""
+    start_time = None
+    for chunk in chunks:
+        buf += chunk
+        # Only look for markers within complete lines. Once a marker has
+        # been seen, the buffer starts with it, so skip past it.
+        pos = 0
+        for marker in _RE_INTERVAL_START.finditer(
+            buf, 0 if start_time is None else 1, buf.rfind("\n") + 1
+        ):
+            if start_time is not None:
+                yield start_time, buf[pos : marker.start()]
+            start_time = marker.group(1).strip()
+            pos = marker.start()
+        buf = buf[pos:]
+
+    # Flush the final interval, or the whole text if no marker was seen,
+    # including any marker on a last line lacking a trailing newline
+    pos = 0
+    for marker in _RE_INTERVAL_START.finditer(
+        buf, 0 if start_time is None else 1
+    ):
+        if start_time is not None:
+            yield start_time, buf[pos : marker.start()]
+        start_time = marker.group(1).strip()
+        pos = marker.start()
+    yield ("" if start_time is None else start_time), buf[pos:]
+
+
+def checkpoint_load(checkpoint):
+    """
+    Loads the per-probe checkpoint state for one router. A missing or
+    corrupt checkpoint file is treated as empty, so all data is new.
+    """
+    try:
+        with open(checkpoint, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return {}
+
+
+def checkpoint_records(text, index, state, new_state):
+    """
+    Generates value lists, like interval_values, for the new or changed
+    intervals of one probe's aggregated output. Probes are keyed by the
+    "IPSLA operation id" in the text (or the result index if absent),
+    and intervals by their start time. The checkpoint stores a digest of
+    the whole text and of each interval block. When the whole text is
+    unchanged since the last run, nothing is parsed at all. Otherwise
+    only intervals whose block digest is new or different are parsed,
+    so the still accumulating latest interval is re-emitted as it
+    grows. The new state for the probe, covering only the intervals the
+    device still reports, is stored in new_state, which the caller seeds
+    with the previous state so probes absent from a run keep their
+    entries.
+    """
+    re_search = _RE_OPER_ID.search(text)
+    probe_id = re_search.group(1) if re_search else "index{0}".format(index)
+    prev = state.get(probe_id, {})
+    digest = cache.digest(text)
+    if prev.get("digest") == digest:
+        new_state[probe_id] = prev
+        return
+
+    prev_intervals = prev.get("intervals", {})
+    seen = {}
+    new_state[probe_id] = {"digest": digest, "intervals": seen}
+    for start_time, block in split_ipsla_intervals(text):
+        seen[start_time] = cache.digest(block)
+        if prev_intervals.get(start_time) != seen[start_time]:
+            values = ipsla_values(block)
+            values.append(start_time)
+            yield values
+
+
+def ping_values(text, marks=None):
+    """
+    Returns the six integers of a ping success rate line as a list,
+    with zero RTTs when no echo returned, or None if there are not
+    three or six of them. The line is located by _RE_PING_LINE, which
+    also collects the per-echo result characters into the marks list
+    when one is given. Text without a recognizable success rate line
+    is parsed as a whole, as it was before the line was searched for.
+    """
+    if not text:
+        return None
+    line = None
+    for re_match in _RE_PING_LINE.finditer(text):
+        if re_match.group(1):
+            if marks is not None:
+                marks.append(re_match.group(1))
+        elif line is None:
+            line = re_match
+            if marks is None:
+                break
+
+    if line is None:
+        stats_list = [int(s) for s in _RE_INT.findall(text)]
+    else:
+        stats_list = [int(s) for s in line.group(2, 3, 4)]
+        stats_list.extend(int(s) for s in _RE_INT.findall(line.group(5)))
+
+    # Ping failed; just populate RTT times with 0
+    if len(stats_list) == 3:
+        stats_list.extend([0, 0, 0])
+    return stats_list if len(stats_list) == 6 else None
+
+
+def ping_loss(text):
+    """
+    Returns the values of one ios_ping_loss_batch row for a ping output:
+    the six ios_ping_stats integers (-1 if they fail to parse), the loss
+    pattern values, and the result characters found.
+    """
+    mark_lines = []
+    stats_list = ping_values(text, mark_lines)
+    if stats_list is None or not _ping_sane(stats_list):
+        stats_list = [-1] * len(PING_KEYS)
+    marks = "".join(mark_lines)
+    bursts = [len(run) for run in _RE_LOSS_RUN.findall(marks)]
+    loss_cnt = sum(bursts)
+    stats_list.extend(
+        [
+            loss_cnt,
+            len(bursts),
+            max(bursts) if bursts else 0,
+            loss_cnt / len(bursts) if bursts else 0.0,
+            marks,
+        ]
+    )
+    return stats_list
+
+
+def _ping_sane(stats_list):
+    """
+    Applies the ios_ping_stats sanity checks to the six integers from
+    ping_values, returning True when they make sense.
+    """
+    pkt_per, pkt_cmp, pkt_tot, rtt_min, rtt_avg, rtt_max = stats_list
+    return (
+        0 <= pkt_per <= 100
+        and 0 <= pkt_cmp <= pkt_tot
+        and rtt_min <= rtt_avg <= rtt_max
+    )
+
+
+def ipsla_rows(results, cmd_index, intervals, checkpoint):
+    """
+    Generates the rows of ios_ipsla_stats_batch as (result index, value
+    list) pairs: one per result, one per interval, or one per new or
+    changed interval when a checkpoint is given. The checkpoint file is
+    rewritten once the last row has been generated.
+    """
+
+    # Probes missing from this run keep their previous entries, so
+    # their history is not emitted again when they come back
+    state = checkpoint_load(checkpoint) if checkpoint else {}
+    new_state = dict(state)
+
+    for i, result in enumerate(results):
+        if "skipped" in result:
+            continue
+        text = result["stdout"][cmd_index]
+        if checkpoint:
+            rows = checkpoint_records(text, i, state, new_state)
+        elif intervals:
+            rows = interval_values(text)
+        else:
+            rows = (ipsla_values(text),)
+        for values in rows:
+            yield i, values
+
+    if checkpoint:
+        files.atomic_write_json(checkpoint, new_state)
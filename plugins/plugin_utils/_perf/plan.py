@@ -0,0 +1,170 @@
+"""
+Planning of staggered long-term IP SLA probe batches, and an estimate
+of how a plan runs on the device.
+"""
+
+# Probe timing and numbering used by plan_probe_batches unless overridden
+# by its options hash: the g711 codec packet count and spacing, seconds of
+# slack per probe, the first operation ID, and the probe frequency
+_PLAN_OPTIONS = {
+    "repeat": 1000,
+    "interval_ms": 20,
+    "guard_s": 2,
+    "base_id": 100000,
+    "frequency": 0,
+}
+
+
+def plan_probe_batches(
+    targets, src_ip=None, concurrency=4, ids=None, options=None
+):
+    """
+    Plans which probes from one router run at the same time. The
+    targets (such as ONLINE_TARGETS) are split in order into batches
+    of at most 'concurrency' probes, and each batch starts once the
+    previous one should have finished, so the device never runs more
+    than 'concurrency' probes at once. A probe is expected to last
+    'repeat' packets at 'interval_ms' apart (1000 and 20, the g711 codec
+    defaults), plus 'guard_s' seconds of slack (2), rounded up to whole
+    seconds. These and the 'base_id' and 'frequency' below are keys of
+    the optional options hash, eg {'repeat': 100, 'frequency': 30}.
+
+    Probes that recur every 'frequency' seconds, like the long-term
+    IP SLA operations, instead have their batches spread evenly across
+    that period rather than all starting at once. Each batch must end
+    before the next one starts, so when the batches do not fit within
+    one period the frequency is raised to the number of batches times
+    the probe duration, the returned frequency should be used to
+    schedule the probes, and a "warning" key says so.
+
+    A target whose ipv4addr is src_ip is kept in place (so the plan is
+    parallel to the target list) but marked skipped. Operation IDs are
+    taken from 'ids' when given, otherwise they are 'base_id' plus the
+    target index, so a target keeps its ID whatever the concurrency.
+    A hash is returned with the keys:
+      probes: One hash per target with the "target", operation "id",
+              "batch", "start_s" offset, "duration_s", and IOS
+              "start_time" ("now" or "after hh:mm:ss") of the probe
+      batches: Number of batches
+      concurrency: Largest batch size
+      period_s: Probe duration, the least time between batch starts
+      frequency: The frequency to use (at least the one given and
+                 long enough for every batch), or 0 for one-off probes
+      warning: Only present when the frequency given was raised
+    """
+    options = dict(_PLAN_OPTIONS, **(options or {}))
+    concurrency = max(1, int(concurrency))
+    period = -(-int(options["repeat"]) * int(options["interval_ms"]) // 1000)
+    period += int(options["guard_s"])
+    probes = [
+        {
+            "target": target,
+            "id": int(ids[i]) if ids else int(options["base_id"]) + i,
+            "duration_s": period,
+        }
+        for i, target in enumerate(targets)
+    ]
+    active = []
+    for probe in probes:
+        if src_ip is not None and probe["target"]["ipv4addr"] == src_ip:
+            probe["skipped"] = True
+        else:
+            active.append(probe)
+
+    batches = -(-len(active) // concurrency)
+    frequency = int(options["frequency"])
+    warning = None
+    if 0 < frequency < batches * period:
+        warning = (
+            "frequency raised from {0}s to {1}s to fit {2} batches of {3}s "
+            "probes".format(frequency, batches * period, batches, period)
+        )
+        frequency = batches * period
+    for slot, probe in enumerate(active):
+        probe.update(
+            _batch_start(slot // concurrency, batches, period, frequency)
+        )
+
+    plan = {
+        "probes": probes,
+        "batches": batches,
+        "concurrency": min(concurrency, len(active)),
+        "period_s": period,
+        "frequency": frequency,
+    }
+    if warning:
+        plan["warning"] = warning
+    return plan
+
+
+def _batch_start(batch, batches, period, frequency):
+    """
+    Returns the "batch", "start_s" offset and IOS "start_time" keys of
+    the probes in one batch of a plan. Batches of recurring probes are
+    spread evenly across the frequency period, and batches of one-off
+    probes start one probe duration apart.
+    """
+    if frequency > 0:
+        start = batch * frequency // batches
+    else:
+        start = batch * period
+    return {
+        "batch": batch,
+        "start_s": start,
+        "start_time": (
+            "after {0:02d}:{1:02d}:{2:02d}".format(
+                start // 3600, start // 60 % 60, start % 60
+            )
+            if start
+            else "now"
+        ),
+    }
+
+
+def simulate_probe_plan(plan, overhead_s=0.0):
+    """
+    Estimates how a plan from plan_probe_batches runs on the device,
+    without touching the network. Each probe occupies the device from
+    its start offset for its duration plus 'overhead_s' seconds (such
+    as the CLI round trip of an exec probe). Recurring probes are
+    folded into one frequency period, so probes overlapping across the
+    end of the period count towards the peak as well.
+
+    A hash is returned with the number of "probes", the "batches", the
+    "serial_s" seconds needed to run every probe one at a time (as the
+    exec probes of mperf do), the "makespan_s" seconds until the last
+    planned probe finishes, the resulting "speedup", and the "peak"
+    number of probes running at the same time.
+    """
+    events = []
+    count = 0
+    serial = makespan = 0.0
+    frequency = plan.get("frequency", 0)
+    for probe in plan["probes"]:
+        if probe.get("skipped"):
+            continue
+        count += 1
+        start = probe["start_s"]
+        end = start + probe["duration_s"] + overhead_s
+        serial += end - start
+        makespan = max(makespan, end)
+        if 0 < frequency < end:
+            # Wrap the tail of the probe to the start of the period
+            events.extend(((0.0, 1), (min(end - frequency, start), -1)))
+            end = frequency
+        events.extend(((start, 1), (end, -1)))
+
+    # Sweep the starts and ends in time order, ends first on ties
+    peak = running = 0
+    for _, step in sorted(events):
+        running += step
+        peak = max(peak, running)
+
+    return {
+        "probes": count,
+        "batches": plan["batches"],
+        "serial_s": round(serial, 3),
+        "makespan_s": round(makespan, 3),
+        "speedup": round(serial / makespan, 2) if makespan else 1.0,
+        "peak": peak,
+    }
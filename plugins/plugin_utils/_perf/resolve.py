@@ -0,0 +1,151 @@
+"""
+Threaded name resolution for the resolve filter, with an in-process
+cache and an optional JSON cache file shared between runs.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import files
+
+# In-process cache of successful resolutions shared by all threads. Each
+# key maps to an (expiry, hostname, ipv4addr) tuple; least recently used
+# entries are evicted once the size limit is reached.
+_RESOLVE_CACHE = OrderedDict()
+_RESOLVE_CACHE_MAX = 4096
+_RESOLVE_LOCK = threading.Lock()
+
+
+def resolve_host(key):
+    """
+    Resolves a single host given a key and database.
+    """
+
+    try:
+        # Resolve the IPv4 address and hostname from the key
+        new_ipv4 = socket.gethostbyname(key)
+        # print("new_ipv4: {0}".format(new_ipv4))
+        new_host = socket.gethostbyaddr(new_ipv4)[0]
+        # print("new_host: {0}".format(new_host))
+        d = {"key": key, "hostname": new_host, "ipv4addr": new_ipv4}
+    except (socket.gaierror, socket.herror, TypeError):
+        # need to add 'as ex' when uncommenting line below
+        # print("Error for key '{0}': rc={1}".format(key, ex.returncode))
+        d = {"key": key, "hostname": False, "ipv4addr": False}
+    return d
+
+
+def resolve_list(key_list, workers=16, ttl=300, cache_file=None):
+    """
+    Resolves a list of hosts given a list of keys and a database.
+    Cached keys are answered immediately while the remaining unique
+    keys are resolved on a bounded thread pool. The returned list is
+    parallel to the key list.
+    """
+    now = time.time()
+    cache_file = cache_file or os.environ.get("PERF_RESOLVE_CACHE")
+    if ttl > 0 and cache_file:
+        _cache_load(cache_file, now)
+
+    # Answer from the cache where possible; collect the rest
+    d_hash = {}
+    pending = []
+    for key in key_list:
+        if not isinstance(key, str) or key in d_hash:
+            continue
+        d = _cache_get(key, now) if ttl > 0 else None
+        if not d:
+            pending.append(key)
+        d_hash[key] = d
+
+    # Resolve unique uncached keys concurrently, preserving order
+    if pending:
+        pool_size = max(1, min(int(workers), len(pending)))
+        with ThreadPoolExecutor(max_workers=pool_size) as pool:
+            for d in pool.map(resolve_host, pending):
+                d_hash[d["key"]] = d
+
+        # Cache only the successful resolutions
+        if ttl > 0:
+            resolved = [d_hash[k] for k in pending if d_hash[k]["hostname"]]
+            _cache_put(resolved, now + ttl)
+            if resolved and cache_file:
+                _cache_save(cache_file, now)
+
+    # Copy each hash so callers never mutate cached entries. Keys that
+    # are not strings fail to resolve, as they did before caching.
+    return [
+        (dict(d_hash[key]) if isinstance(key, str) else resolve_host(key))
+        for key in key_list
+    ]
+
+
+def _cache_get(key, now):
+    """
+    Returns a resolve hash for the key from the in-process cache, or
+    None if the key is not cached or has expired.
+    """
+    try:
+        with _RESOLVE_LOCK:
+            expiry, hostname, ipv4addr = _RESOLVE_CACHE[key]
+            if expiry <= now:
+                del _RESOLVE_CACHE[key]
+                return None
+            _RESOLVE_CACHE.move_to_end(key)
+    except (KeyError, TypeError):
+        return None
+    return {"key": key, "hostname": hostname, "ipv4addr": ipv4addr}
+
+
+def _cache_put(d_list, expiry):
+    """
+    Stores a list of resolve hashes in the in-process cache with a
+    common expiry time, evicting the least recently used entries once
+    the cache is full.
+    """
+    with _RESOLVE_LOCK:
+        for d in d_list:
+            _RESOLVE_CACHE[d["key"]] = (
+                expiry,
+                d["hostname"],
+                d["ipv4addr"],
+            )
+            _RESOLVE_CACHE.move_to_end(d["key"])
+        while len(_RESOLVE_CACHE) > _RESOLVE_CACHE_MAX:
+            _RESOLVE_CACHE.popitem(last=False)
+
+
+def _cache_load(cache_file, now):
+    """
+    Loads unexpired entries from the on-disk JSON cache into the
+    in-process cache. A missing or corrupt file is ignored.
+    """
+    try:
+        with open(cache_file, "r", encoding="utf-8") as handle:
+            disk_cache = json.load(handle)
+    except (OSError, ValueError):
+        return
+    with _RESOLVE_LOCK:
+        for key, entry in disk_cache.items():
+            if entry[0] > now and key not in _RESOLVE_CACHE:
+                _RESOLVE_CACHE[key] = tuple(entry)
+
+
+def _cache_save(cache_file, now):
+    """
+    Writes unexpired in-process cache entries to the on-disk JSON
+    cache. The file is replaced atomically so concurrent runs never
+    read a partially written cache.
+    """
+    with _RESOLVE_LOCK:
+        disk_cache = {
+            key: list(entry)
+            for key, entry in _RESOLVE_CACHE.items()
+            if entry[0] > now
+        }
+    files.atomic_write_json(cache_file, disk_cache)
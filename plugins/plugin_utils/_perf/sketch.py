@@ -0,0 +1,340 @@
+"""
+DDSketch quantile sketches and the per-router SLA sketch files kept by
+the sla_sketch_* filters.
+"""
+
+import json
+import math
+from collections.abc import Mapping
+
+from . import files
+
+# DDSketch quantiles are within this relative error of the true value.
+# Values fall into logarithmic bins GAMMA wide, and once a sketch holds
+# more than _SKETCH_MAX_BINS bins the lowest ones are merged together.
+_SKETCH_ACCURACY = 0.01
+_SKETCH_GAMMA = (1 + _SKETCH_ACCURACY) / (1 - _SKETCH_ACCURACY)
+_SKETCH_LOG_GAMMA = math.log(_SKETCH_GAMMA)
+_SKETCH_MAX_BINS = 2048
+
+# Format of the SLA sketch files, and how many lperf intervals each pair
+# remembers so intervals reported again by later runs are not recounted
+_SKETCH_VERSION = 1
+_SKETCH_RECENT = 48
+
+# Quantiles reported per pair by sla_sketch_report
+_SLA_QUANTILES = (0.5, 0.95, 0.99)
+
+
+class DDSketch(object):
+    """
+    Mergeable quantile sketch (DDSketch) of non-negative values such as
+    RTTs. Each value is counted in a logarithmic bin, so any quantile is
+    within _SKETCH_ACCURACY of the true value however many values are
+    added, while memory is bounded by the number of bins. Values can be
+    added with a weight (such as a packet count) and removed again, and
+    sketches merge exactly by adding their bin counts. The minimum and
+    maximum are the extremes ever added, even after a removal.
+    """
+
+    __slots__ = ("bins", "zeros", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.bins = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value, weight=1):
+        """
+        Adds a value with the given weight, ignoring non-positive weights.
+        """
+        if weight <= 0:
+            return
+        self.count += weight
+        self.total += value * weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if value <= 0:
+            self.zeros += weight
+            return
+        key = int(math.ceil(math.log(value) / _SKETCH_LOG_GAMMA))
+        self.bins[key] = self.bins.get(key, 0) + weight
+        if len(self.bins) > _SKETCH_MAX_BINS:
+            self._collapse()
+
+    def remove(self, value, weight=1):
+        """
+        Removes a value previously added with the same weight.
+        """
+        if weight <= 0:
+            return
+        self.count -= weight
+        self.total -= value * weight
+        if value <= 0:
+            self.zeros -= weight
+            return
+        key = int(math.ceil(math.log(value) / _SKETCH_LOG_GAMMA))
+        if key not in self.bins:
+            # Collapsed values are all counted in the lowest bin
+            if not self.bins:
+                return
+            key = min(self.bins)
+        self.bins[key] -= weight
+        if self.bins[key] <= 0:
+            del self.bins[key]
+
+    def merge(self, other):
+        """
+        Adds every value of another sketch to this one.
+        """
+        for key, weight in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + weight
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        for attr, pick in (("min", min), ("max", max)):
+            mine, theirs = getattr(self, attr), getattr(other, attr)
+            if theirs is not None:
+                setattr(
+                    self, attr, theirs if mine is None else pick(mine, theirs)
+                )
+        if len(self.bins) > _SKETCH_MAX_BINS:
+            self._collapse()
+
+    def _collapse(self):
+        """
+        Merges the lowest bins into one so at most _SKETCH_MAX_BINS remain,
+        losing accuracy only for the lowest quantiles.
+        """
+        keys = sorted(self.bins)
+        extra = keys[: len(keys) - _SKETCH_MAX_BINS + 1]
+        self.bins[extra[-1]] += sum(self.bins.pop(key) for key in extra[:-1])
+
+    def quantile(self, fraction):
+        """
+        Returns the value at the given quantile (0 to 1), clamped to the
+        minimum and maximum, or None if the sketch is empty.
+        """
+        if self.count <= 0:
+            return None
+        rank = fraction * (self.count - 1)
+        seen = self.zeros
+        value = 0.0
+        if rank >= seen:
+            for key in sorted(self.bins):
+                seen += self.bins[key]
+                value = 2 * _SKETCH_GAMMA**key / (_SKETCH_GAMMA + 1)
+                if rank < seen:
+                    break
+        return min(max(value, self.min), self.max)
+
+    def rank(self, value):
+        """
+        Returns the weight of the values at or below the given value.
+        """
+        if value < 0:
+            return 0
+        if value == 0:
+            return self.zeros
+        limit = math.ceil(math.log(value) / _SKETCH_LOG_GAMMA)
+        return self.zeros + sum(
+            weight for key, weight in self.bins.items() if key <= limit
+        )
+
+    def to_dict(self):
+        """
+        Returns the sketch as a JSON-serializable hash.
+        """
+        return {
+            "bins": sorted(self.bins.items()),
+            "zeros": self.zeros,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Rebuilds a sketch from a hash returned by to_dict.
+        """
+        sketch = cls()
+        sketch.bins = {int(key): weight for key, weight in data["bins"]}
+        for attr in ("zeros", "count", "total", "min", "max"):
+            setattr(sketch, attr, data[attr])
+        return sketch
+
+
+def sla_sketch_update(stats_cols, path, src_host, lookup_hashes, sla=None):
+    """
+    Adds IP SLA results to the quantile sketches of one router, kept in
+    a JSON file at 'path' on the control machine. There is one DDSketch
+    per (src_host, dest_host) pair, so memory and file size stay
+    constant however many runs are added, and sketches from many
+    routers and runs can later be combined with sla_sketch_merge.
+
+    The stats_cols are the columns from ios_ipsla_stats_batch, whose
+    result indexes select the target from lookup_hashes. Each result
+    adds its average RTT weighted by its RTT count, approximating the
+    RTT of every packet. Probes with an RTT count of 0 are counted as
+    failed instead. The optional sla list, parallel to lookup_hashes
+    as returned by get_sla, records each pair's latency threshold.
+
+    Results with a "start_time" (lperf intervals) are remembered for
+    the last _SKETCH_RECENT intervals of each pair. An interval seen
+    again is skipped when unchanged, or replaces its earlier values if
+    it was still open, so intervals are never counted twice. The
+    number of results added or replaced is returned.
+    """
+    pairs = _sketch_load(path)
+    start_times = stats_cols.get("start_time")
+    added = 0
+    for pos, index in enumerate(stats_cols["index"]):
+        key = "{0}|{1}".format(src_host, lookup_hashes[index]["hostname"])
+        pair = pairs.setdefault(
+            key, {"sketch": DDSketch(), "failed": 0, "sla": None}
+        )
+        if sla:
+            pair["sla"] = sla[index]
+        sample = [stats_cols["rtt_avg"][pos], stats_cols["rtt_cnt"][pos]]
+
+        if start_times:
+            recent = pair.setdefault("recent", {})
+            old = recent.pop(start_times[pos], None)
+            recent[start_times[pos]] = sample
+            while len(recent) > _SKETCH_RECENT:
+                del recent[next(iter(recent))]
+            if old == sample:
+                continue
+            if old:
+                pair["sketch"].remove(*old)
+                pair["failed"] -= old[1] == 0
+
+        if sample[1] > 0 and sample[0] >= 0:
+            pair["sketch"].add(*sample)
+        elif sample[1] == 0:
+            pair["failed"] += 1
+        added += 1
+
+    _sketch_save(path, pairs)
+    return added
+
+
+def sla_sketch_merge(paths, path=None):
+    """
+    Combines the SLA sketch files of many routers and runs, given as a
+    list of paths (such as from the fileglob lookup), into one hash
+    keyed by "src_host|dest_host". Sketches of the same pair are merged
+    exactly, failures are summed, and the latest threshold wins. The
+    result is also written to 'path' when given, in the same format,
+    so merged history can be merged again later.
+    """
+    merged = {}
+    for sketch_path in sorted(paths):
+        for key, pair in _sketch_load(sketch_path).items():
+            into = merged.setdefault(
+                key, {"sketch": DDSketch(), "failed": 0, "sla": None}
+            )
+            into["sketch"].merge(pair["sketch"])
+            into["failed"] += pair["failed"]
+            if pair["sla"] is not None:
+                into["sla"] = pair["sla"]
+    if path:
+        _sketch_save(path, merged)
+    return {
+        key: dict(pair, sketch=pair["sketch"].to_dict())
+        for key, pair in merged.items()
+    }
+
+
+def sla_sketch_report(pairs, path=None, quantiles=_SLA_QUANTILES):
+    """
+    Summarizes SLA sketches, either a hash from sla_sketch_merge or the
+    path of a sketch file, with one hash per pair ordered by source and
+    destination. Each has the "src_host", "dest_host", the weighted
+    "samples" (packets) and "failed" probes, the RTT "rtt_min",
+    "rtt_avg", "rtt_max", and one "rtt_p<N>" key per quantile, the
+    "sla" threshold, and "sla_pct", the percentage of packets within
+    the threshold (to within the sketch accuracy) or None without one.
+    When 'path' is given, the report is also written there as CSV.
+    """
+    if isinstance(pairs, str):
+        pairs = _sketch_load(pairs)
+    q_keys = ["rtt_p{0:g}".format(100 * q) for q in quantiles]
+
+    report = []
+    for key in sorted(pairs):
+        pair = pairs[key]
+        sketch = pair["sketch"]
+        if isinstance(sketch, Mapping):
+            sketch = DDSketch.from_dict(sketch)
+        src_host, dest_host = key.split("|", 1)
+        row = {
+            "src_host": src_host,
+            "dest_host": dest_host,
+            "samples": sketch.count,
+            "failed": pair["failed"],
+            "rtt_min": sketch.min,
+            "rtt_avg": (sketch.total / sketch.count if sketch.count else None),
+            "rtt_max": sketch.max,
+            "sla": pair["sla"],
+            "sla_pct": None,
+        }
+        for q_key, fraction in zip(q_keys, quantiles):
+            row[q_key] = sketch.quantile(fraction)
+        if pair["sla"] is not None and sketch.count:
+            row["sla_pct"] = 100.0 * sketch.rank(pair["sla"]) / sketch.count
+        report.append(row)
+
+    if path:
+        columns = (
+            ["src_host", "dest_host", "samples", "failed", "rtt_min"]
+            + q_keys
+            + ["rtt_avg", "rtt_max", "sla", "sla_pct"]
+        )
+        files.write_csv(
+            path,
+            ",".join(columns),
+            ([row[col] for col in columns] for row in report),
+        )
+    return report
+
+
+def _sketch_load(path):
+    """
+    Reads an SLA sketch file into a hash of pairs holding DDSketch
+    objects. A missing, corrupt, or other version file is empty.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            data = json.load(handle)
+        if data.get("version") != _SKETCH_VERSION:
+            return {}
+        pairs = data["pairs"]
+        for pair in pairs.values():
+            pair["sketch"] = DDSketch.from_dict(pair["sketch"])
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return {}
+    return pairs
+
+
+def _sketch_save(path, pairs):
+    """
+    Writes a hash of pairs holding DDSketch objects as an SLA sketch
+    file, atomically replacing any existing one.
+    """
+    files.atomic_write_json(
+        path,
+        {
+            "version": _SKETCH_VERSION,
+            "accuracy": _SKETCH_ACCURACY,
+            "pairs": {
+                key: dict(pair, sketch=pair["sketch"].to_dict())
+                for key, pair in pairs.items()
+            },
+        },
+    )
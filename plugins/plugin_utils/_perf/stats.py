@@ -0,0 +1,191 @@
+"""
+Per-process filter call statistics, recorded when PERF_FILTER_STATS
+names a directory and merged by the filter_stats_merge filter.
+"""
+
+import functools
+import json
+import multiprocessing.util
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import files
+
+# Per-process filter call statistics, only recorded when the environment
+# variable PERF_FILTER_STATS names a directory. Each Ansible fork keeps its
+# own counters, which are discarded if inherited from a parent process.
+# The counters are written to the process's file every
+# _FILTER_STATS_FLUSH_CALLS calls and when the process exits.
+_FILTER_STATS = {"pid": None, "filters": {}, "unsaved": 0}
+_FILTER_STATS_LOCK = threading.Lock()
+_FILTER_STATS_FLUSH_CALLS = 256
+
+
+def instrument(name, func, stats_dir):
+    """
+    Returns a wrapper around a filter function which records the call
+    count, wall time, and input size of every call, including failed
+    calls, in this process's statistics for stats_dir.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record_call(
+                name,
+                time.perf_counter() - start,
+                args[0] if args else None,
+                stats_dir,
+            )
+
+    return wrapper
+
+
+def _record_call(name, elapsed, value, stats_dir):
+    """
+    Adds one call to the per-process filter statistics, which are kept
+    in memory and written to this process's JSON file in stats_dir
+    every _FILTER_STATS_FLUSH_CALLS calls, so writing them does not
+    distort the timings measured. Ansible forks leave through
+    os._exit, which skips atexit handlers, so the final write is
+    registered as a multiprocessing finalizer instead. These run when
+    a worker process finishes, and at interpreter exit otherwise.
+    """
+    in_bytes, in_items = _input_size(value)
+    pid = os.getpid()
+    with _FILTER_STATS_LOCK:
+        if _FILTER_STATS["pid"] != pid:
+            _FILTER_STATS.update(pid=pid, filters={}, unsaved=0)
+            multiprocessing.util.Finalize(
+                None,
+                _flush,
+                args=(stats_dir,),
+                exitpriority=10,
+            )
+        stats = _FILTER_STATS["filters"].setdefault(
+            name,
+            {
+                "calls": 0,
+                "total_s": 0.0,
+                "max_s": 0.0,
+                "in_bytes": 0,
+                "in_items": 0,
+            },
+        )
+        stats["calls"] += 1
+        stats["total_s"] += elapsed
+        stats["max_s"] = max(stats["max_s"], elapsed)
+        stats["in_bytes"] += in_bytes
+        stats["in_items"] += in_items
+        _FILTER_STATS["unsaved"] += 1
+        if _FILTER_STATS["unsaved"] >= _FILTER_STATS_FLUSH_CALLS:
+            _flush(stats_dir)
+
+
+def _flush(stats_dir):
+    """
+    Writes this process's filter statistics to its JSON file in
+    stats_dir if any calls were recorded since the last write.
+    """
+    with _FILTER_STATS_LOCK:
+        if _FILTER_STATS["pid"] != os.getpid():
+            return
+        if not _FILTER_STATS["unsaved"]:
+            return
+        _FILTER_STATS["unsaved"] = 0
+        files.atomic_write_json(
+            os.path.join(
+                stats_dir,
+                "filter_stats_{0}.json".format(_FILTER_STATS["pid"]),
+            ),
+            {
+                "pid": _FILTER_STATS["pid"],
+                "filters": _FILTER_STATS["filters"],
+            },
+        )
+
+
+def _input_size(value):
+    """
+    Estimates the size of a filter's input as a tuple of (bytes of
+    text, number of items). Text is counted directly, lists count
+    their items plus the text of any registered "stdout" outputs, and
+    columnar hashes count their rows.
+    """
+    if isinstance(value, str):
+        return len(value), 0
+    if isinstance(value, dict):
+        return 0, len(value.get("index", value))
+    if isinstance(value, list):
+        in_bytes = 0
+        for item in value:
+            if isinstance(item, dict) and "stdout" in item:
+                in_bytes += sum(len(text) for text in item["stdout"])
+        return in_bytes, len(value)
+    return 0, 0
+
+
+def _load(stats_dir):
+    """
+    Reads every per-process statistics file in stats_dir, skipping
+    unreadable ones, and returns a tuple of the per-filter totals and
+    the list of files read.
+    """
+    merged = {}
+    stats_files = []
+    for file_name in sorted(os.listdir(stats_dir)):
+        if not (
+            file_name.startswith("filter_stats_")
+            and file_name.endswith(".json")
+        ):
+            continue
+        file_path = os.path.join(stats_dir, file_name)
+        try:
+            with open(file_path, "r", encoding="utf-8") as handle:
+                proc_stats = json.load(handle)["filters"]
+        except (OSError, ValueError, KeyError):
+            continue
+        stats_files.append(file_path)
+        for name, stats in proc_stats.items():
+            total = merged.setdefault(name, dict.fromkeys(stats, 0))
+            for key, value in stats.items():
+                if key == "max_s":
+                    total[key] = max(total[key], value)
+                else:
+                    total[key] += value
+
+    return merged, stats_files
+
+
+def filter_stats_merge(stats_dir, path=None, clean=False):
+    """
+    This filter merges the per-process filter call statistics written
+    to stats_dir when the PERF_FILTER_STATS environment variable is
+    set, typically at the end of a playbook run. A hash is returned
+    with the number of processes and, per filter, the total calls,
+    cumulative and maximum wall time in seconds, mean time per call in
+    milliseconds, and the total input bytes and items. Filters are
+    ordered by cumulative time, largest first. When path is given, the
+    merged statistics are also written there as JSON, and when clean
+    is true the per-process files are removed once merged.
+    """
+    merged, stats_files = _load(stats_dir)
+
+    filter_stats = OrderedDict()
+    for name in sorted(merged, key=lambda n: -merged[n]["total_s"]):
+        stats = merged[name]
+        stats["mean_ms"] = 1000.0 * stats["total_s"] / stats["calls"]
+        filter_stats[name] = stats
+    result = {"processes": len(stats_files), "filters": filter_stats}
+
+    if path:
+        files.atomic_write_json(path, result)
+    if clean:
+        for file_path in stats_files:
+            os.remove(file_path)
+    return result
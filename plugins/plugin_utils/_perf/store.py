@@ -0,0 +1,177 @@
+"""
+Compact, typed binary history store of IP SLA statistics written by the
+ipsla_store_append filter and memory-mapped by ipsla_store_read.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections import OrderedDict
+
+from . import files, parse
+
+# Binary history store layout. Each appended block starts with a fixed
+# prefix (magic, version, JSON header length), followed by the JSON header
+# and the 8-byte aligned column data. String columns hold int32 codes into
+# the block's string dictionary; MOS columns are float64; all other stats
+# columns are int32.
+_STORE_MAGIC = b"IPSB"
+_STORE_VERSION = 1
+_STORE_PREFIX = struct.Struct("<4sII")
+_STORE_STR_COLS = ("src_host", "src_ip", "dest_host", "dest_ip")
+_STORE_FLOAT_KEYS = ("voc_mos", "voc_mos_min", "voc_mos_max")
+
+
+def ipsla_store_append(stats_cols, path, meta):
+    """
+    This filter appends one collection run to a typed, column-oriented
+    binary history store at path, as a compact alternative to the wide
+    lperf CSV. The stats_cols input is the output of
+    ios_ipsla_stats_batch. The meta hash gives the "src_host", "src_ip",
+    and "dtg" of the run, and its "lookup_hashes" list of resolve hashes
+    is indexed by the "index" column, like the meta hash given to
+    probe_archive_write. Every stats key
+    is stored as a fixed-width int32 column except MOS scores, which
+    are float64 with -1.0 when missing. Host and IP columns, plus the
+    interval start time when the stats were parsed with intervals, are
+    stored as int32 codes into a per-block string dictionary. Appends are
+    serialized with a file lock so several forks can share one store.
+    The number of rows appended is returned.
+    """
+    rows = len(stats_cols["index"])
+    targets = meta["lookup_hashes"]
+    str_values = {
+        "src_host": [meta["src_host"]] * rows,
+        "src_ip": [meta["src_ip"]] * rows,
+        "dest_host": [targets[i]["hostname"] for i in stats_cols["index"]],
+        "dest_ip": [targets[i]["ipv4addr"] for i in stats_cols["index"]],
+    }
+    if "start_time" in stats_cols:
+        str_values["start_time"] = stats_cols["start_time"]
+    strings, columns = _store_columns(stats_cols, str_values)
+    layout, data_len = _store_layout(columns)
+
+    header = json.dumps(
+        {
+            "dtg": meta["dtg"],
+            "rows": rows,
+            "byteorder": sys.byteorder,
+            "strings": strings,
+            "columns": layout,
+            "data_len": data_len,
+        }
+    ).encode("utf-8")
+
+    def _write(handle):
+        # Pad the header so the column data starts 8-byte aligned
+        start = handle.tell() + _STORE_PREFIX.size + len(header)
+        header_pad = header + b" " * (-start % 8)
+        handle.write(
+            _STORE_PREFIX.pack(_STORE_MAGIC, _STORE_VERSION, len(header_pad))
+        )
+        handle.write(header_pad)
+        for _, values in columns:
+            data = values.tobytes()
+            handle.write(data + b"\0" * (-len(data) % 8))
+
+    files.locked_append(path, _write, binary=True)
+    return rows
+
+
+def _store_columns(stats_cols, str_values):
+    """
+    Builds the typed columns of one block, returning the block's string
+    dictionary and a list of (key, array) pairs. The host and IP string
+    columns are dictionary-encoded, and the stats columns use fixed-width
+    types.
+    """
+    strings = OrderedDict()
+    columns = []
+    for key in _STORE_STR_COLS + ("start_time",):
+        if key not in str_values:
+            continue
+        codes = [strings.setdefault(v, len(strings)) for v in str_values[key]]
+        columns.append((key, array("i", codes)))
+
+    for key in parse.IPSLA_KEYS:
+        if key in _STORE_FLOAT_KEYS:
+            columns.append((key, array("d", map(float, stats_cols[key]))))
+        else:
+            columns.append((key, array("i", stats_cols[key])))
+    return list(strings), columns
+
+
+def _store_layout(columns):
+    """
+    Lays out each column at an 8-byte aligned offset, returning the
+    [key, typecode, offset, count] layout and the total data length.
+    """
+    layout = []
+    offset = 0
+    for key, values in columns:
+        nbytes = len(values) * values.itemsize
+        layout.append([key, values.typecode, offset, len(values)])
+        offset += (nbytes + 7) & ~7
+    return layout, offset
+
+
+def ipsla_store_read(path, as_lists=False):
+    """
+    Reads every block from a binary history store written by
+    ipsla_store_append. The file is memory-mapped and each column is
+    returned as a zero-copy memoryview cast to its fixed-width type
+    (copied only if the store was written with another byte order).
+    The return value is a list of hashes, one per appended run, with
+    "dtg", "rows", "strings" and "columns" keys. String columns hold
+    codes into "strings". When as_lists is true, columns are converted
+    to plain lists so the result can be used within Ansible.
+    """
+    with open(path, "rb") as handle:
+        if os.fstat(handle.fileno()).st_size == 0:
+            return []
+        buf = memoryview(mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ))
+
+    blocks = []
+    pos = 0
+    while pos < len(buf):
+        magic, version, header_len = _STORE_PREFIX.unpack_from(buf, pos)
+        if magic != _STORE_MAGIC or version != _STORE_VERSION:
+            raise ValueError("bad store block at offset {0}".format(pos))
+        pos += _STORE_PREFIX.size
+        header = json.loads(bytes(buf[pos : pos + header_len]))
+        pos += header_len
+
+        columns = _store_view(buf[pos : pos + header["data_len"]], header)
+        if as_lists:
+            columns = {key: view.tolist() for key, view in columns.items()}
+        pos += header["data_len"]
+
+        blocks.append(
+            {
+                "dtg": header["dtg"],
+                "rows": header["rows"],
+                "strings": header["strings"],
+                "columns": columns,
+            }
+        )
+    return blocks
+
+
+def _store_view(data, header):
+    """
+    Returns the columns of one block as a hash of memoryviews over its
+    column data, cast to their fixed-width types. Columns are copied into
+    byte-swapped arrays only when the block has another byte order.
+    """
+    columns = {}
+    for key, typecode, offset, count in header["columns"]:
+        size = array(typecode).itemsize
+        view = data[offset : offset + count * size].cast(typecode)
+        if header["byteorder"] != sys.byteorder:
+            view = array(typecode, view)
+            view.byteswap()
+        columns[key] = view
+    return columns
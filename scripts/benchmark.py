@@ -0,0 +1,646 @@
+#!/usr/bin/env python
+
+"""
+Micro-benchmark suite for every filter exposed by FilterModule.filters().
+Each filter is run against synthetic IOS output from ios_synth.py at a
+chosen scale, and its latency percentiles, throughput, and peak memory are
+reported. Results can be saved as a baseline JSON file and later runs on
+the same machine compared against it, failing when any case grows beyond a
+tolerance.
+
+  python scripts/benchmark.py --scale small
+  python scripts/benchmark.py --scale medium --save-baseline base.json
+  python scripts/benchmark.py --scale medium --baseline base.json
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import ios_synth
+
+# The filters are a plain module within the playbook plugin directory
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "..", "plugins", "filter"
+    ),
+)
+# pylint: disable=wrong-import-position
+from filter import FilterModule, perf
+
+# pylint: enable=wrong-import-position
+
+# Workload sizes; any of these can be overridden from the command line
+SCALES = {
+    "small": {"targets": 100, "routes": 10000, "hours": 24, "repeat": 20},
+    "medium": {"targets": 10000, "routes": 100000, "hours": 24, "repeat": 5},
+    "large": {"targets": 100000, "routes": 1000000, "hours": 24, "repeat": 3},
+}
+
+# Statistics compared against the baseline; higher is worse for each
+COMPARED = ("p50_ms", "peak_kib")
+
+
+class Case(
+    collections.namedtuple(
+        "Case", ("name", "run", "items", "each", "warm"), defaults=(None, False)
+    )
+):
+    """
+    One benchmark case. The run callable performs a single operation over
+    "items" units of work. When "each" is given, run is instead called once
+    per element of that list, and latencies are those of individual calls.
+    The in-process parse cache is emptied before every operation, so parsing
+    is really measured, unless "warm" is true.
+    """
+
+    __slots__ = ()
+
+    def filter_name(self):
+        """
+        Returns the filter name this case exercises, without any variant.
+        """
+        return self.name.split("[")[0]
+
+
+def build_cases(cfg, workdir):  # pylint: disable=too-many-locals
+    """
+    Generates the synthetic inputs for the given scale and returns the
+    list of cases, covering every filter and the most relevant options.
+    """
+    fm = FilterModule
+    rng = ios_synth.new_rng(cfg["seed"])
+    tgts = ios_synth.targets(cfg["targets"])
+    n_tgts = len(tgts)
+
+    # Per-item inputs are capped; their latency does not depend on count
+    n_each = min(n_tgts, 10000)
+    latest = [ios_synth.ipsla_latest_text(rng) for _ in range(n_each)]
+    aggregated = [
+        ios_synth.ipsla_aggregated_text(rng, cfg["hours"], i + 1)
+        for i in range(min(n_tgts, 1000))
+    ]
+    pings = [ios_synth.ping_lines(rng, t["ipv4addr"])[-1] for t in tgts]
+    loopbacks = [ios_synth.ip_interface_text(t["ipv4addr"]) for t in tgts]
+    stats = [fm.ios_ipsla_stats(text) for text in latest]
+    ping_hashes = [fm.ios_ping_stats(text) for text in pings[:n_each]]
+
+    fib = ios_synth.fib_text(cfg["routes"], tgts, rng)
+    mperf = ios_synth.probe_results("mperf", tgts, rng)
+    sperf = ios_synth.probe_results("sperf", tgts, rng)
+    lperf = ios_synth.probe_results(
+        "lperf", tgts[: max(1, n_tgts // 100)], rng, hours=cfg["hours"]
+    )
+    groups, sla = ios_synth.inventory(n_tgts)
+
+    mperf_stats = fm.ios_ipsla_stats_batch(mperf)
+    lperf_stats = fm.ios_ipsla_stats_batch(lperf, intervals=True)
+    lspv = [r["stdout_lines"][2][13] for r in mperf if "skipped" not in r]
+    mtu = fm.ios_ping_stats_batch(mperf, 1, 5)["pkt_cmp"]
+    csv_rows = "\n".join(fm.ios_ipsla_csv_batch(lperf_stats, False)) + "\n"
+    lperf_rows = len(lperf_stats["index"])
+
+    # Successive collection runs alternate, so a checkpoint always differs
+    lperf_runs = itertools.cycle((lperf, next_collection(lperf)))
+
+    # Stores and rollups grow with every run, so each case writes its own
+    store_read = os.path.join(workdir, "read.ipsb")
+    store_meta = {
+        "src_host": "r1",
+        "src_ip": "1.1.1.1",
+        "dtg": "x",
+        "lookup_hashes": tgts,
+    }
+    fm.ipsla_store_append(lperf_stats, store_read, store_meta)
+    resolve_keys = ["localhost", "127.0.0.1"] * (n_tgts // 2)
+
+    # Full mesh of sperf results between a share of the targets
+    mesh_hosts, mesh_vars = sperf_mesh(tgts[: min(n_tgts, 300)], rng)
+    mesh_path = os.path.join(workdir, "sperf")
+
+    # Raw probe output archived for offline reprocessing
+    archive = os.path.join(workdir, "archive.json.gz")
+    fm.probe_archive_write(mperf, archive, {"file_id": "mperf"})
+
+    # Probe plan of every target spread over a recurring period
+    probe_plan = fm.plan_probe_batches(
+        tgts, concurrency=8, options={"frequency": 30}
+    )
+
+    # FIB snapshots: one matching the FIB, and one alternating between the
+    # FIB and a copy missing a route, so that every call sees a change
+    fib_snap = os.path.join(workdir, "fib.snap")
+    fm.intersect_block_delta(fib, tgts, fib_snap)
+    fib_flips = itertools.cycle((fib.rsplit("\n", 2)[0] + "\n", fib))
+    flip_snap = os.path.join(workdir, "flip.snap")
+
+    # On-disk parse cache holding one entry per aggregation interval
+    cache_db = os.path.join(workdir, "parse_cache.db")
+    for i, values in enumerate(zip(*lperf_stats.values())):
+        perf.cache.parse_cache_write(
+            cache_db, "{0:032x}".format(i), list(values)
+        )
+
+    # Raw output archive of one mperf run from each of several routers, and
+    # a random sample of its entries to read back
+    raw_seg = os.path.join(workdir, "read.seg")
+    for router in range(8):
+        fm.raw_archive_append(
+            mperf, raw_seg, {"src_host": "r{0}".format(router), "dtg": "x"}
+        )
+    raw_count = len(fm.raw_archive_index(raw_seg))
+    raw_entries = rng.sample(range(raw_count), min(raw_count, n_tgts))
+
+    # SLA sketches of several routers, each holding every lperf interval
+    sketch_paths = []
+    for router in range(8):
+        sketch_paths.append(
+            os.path.join(workdir, "sla_{0}.json".format(router))
+        )
+        fm.sla_sketch_update(
+            lperf_stats, sketch_paths[-1], "r{0}".format(router), tgts
+        )
+    sketch_pairs = fm.sla_sketch_merge(sketch_paths)
+
+    # One statistics file per Ansible fork, as written by instrumentation
+    stats_dir = os.path.join(workdir, "filter_stats")
+    write_filter_stats(stats_dir, fm.filters(), 64)
+
+    return [
+        Case("resolve", lambda: fm.resolve(resolve_keys), len(resolve_keys)),
+        Case("ios_ipsla_stats", fm.ios_ipsla_stats, n_each, latest),
+        Case(
+            "ios_ipsla_intervals",
+            fm.ios_ipsla_intervals,
+            len(aggregated),
+            aggregated,
+        ),
+        Case("ios_ipsla_csv", fm.ios_ipsla_csv, n_each, stats),
+        Case("ios_ping_stats", fm.ios_ping_stats, n_tgts, pings),
+        Case("ios_ping_csv", fm.ios_ping_csv, n_each, ping_hashes),
+        Case(
+            "intersect_block",
+            lambda: fm.intersect_block(fib, tgts),
+            cfg["routes"],
+        ),
+        Case(
+            "intersect_block[lpm]",
+            lambda: fm.intersect_block(fib, tgts, lpm=True),
+            cfg["routes"],
+        ),
+        Case(
+            "intersect_block_delta",
+            lambda: fm.intersect_block_delta(next(fib_flips), tgts, flip_snap),
+            cfg["routes"],
+        ),
+        Case(
+            "intersect_block_delta[unchanged]",
+            lambda: fm.intersect_block_delta(fib, tgts, fib_snap),
+            cfg["routes"],
+        ),
+        Case("ios_parse_ip", fm.ios_parse_ip, n_tgts, loopbacks),
+        Case("perf_synopsis", fm.perf_synopsis, n_each, stats),
+        Case("get_sla", lambda: fm.get_sla(sla, groups, tgts), n_tgts),
+        Case(
+            "plan_probe_batches",
+            lambda: fm.plan_probe_batches(tgts, tgts[0]["ipv4addr"], 8),
+            n_tgts,
+        ),
+        Case(
+            "simulate_probe_plan",
+            lambda: fm.simulate_probe_plan(probe_plan, 4.0),
+            n_tgts,
+        ),
+        Case(
+            "ios_ipsla_stats_batch",
+            lambda: fm.ios_ipsla_stats_batch(mperf),
+            n_tgts,
+        ),
+        Case(
+            "ios_ipsla_stats_batch[intervals]",
+            lambda: fm.ios_ipsla_stats_batch(lperf, intervals=True),
+            lperf_rows,
+        ),
+        Case(
+            "ios_ipsla_stats_batch[warm]",
+            lambda: fm.ios_ipsla_stats_batch(lperf, intervals=True),
+            lperf_rows,
+            warm=True,
+        ),
+        Case(
+            "ios_ipsla_stats_batch[checkpoint]",
+            lambda: fm.ios_ipsla_stats_batch(
+                next(lperf_runs), checkpoint=os.path.join(workdir, "ckpt.json")
+            ),
+            lperf_rows,
+        ),
+        Case(
+            "ios_ipsla_csv_batch",
+            lambda: fm.ios_ipsla_csv_batch(lperf_stats, False),
+            lperf_rows,
+        ),
+        Case(
+            "ios_ping_stats_batch",
+            lambda: fm.ios_ping_stats_batch(sperf, 0, 4),
+            n_tgts,
+        ),
+        Case(
+            "ios_ping_stats_batch[full]",
+            lambda: fm.ios_ping_stats_batch(mperf, 1),
+            n_tgts,
+        ),
+        Case(
+            "ios_ping_loss_batch",
+            lambda: fm.ios_ping_loss_batch(mperf, 1),
+            n_tgts,
+        ),
+        Case(
+            "perf_synopsis_batch",
+            lambda: fm.perf_synopsis_batch(mperf_stats, lspv, mtu),
+            len(lspv),
+        ),
+        Case(
+            "rollup_write",
+            lambda: fm.rollup_write(
+                csv_rows, os.path.join(workdir, "rollup.csv"), "header"
+            ),
+            lperf_rows,
+        ),
+        Case(
+            "ipsla_store_append",
+            lambda: fm.ipsla_store_append(
+                lperf_stats,
+                os.path.join(workdir, "append.ipsb"),
+                store_meta,
+            ),
+            lperf_rows,
+        ),
+        Case(
+            "sperf_matrix",
+            lambda: fm.sperf_matrix(
+                mesh_hosts, mesh_vars, mesh_hosts, mesh_path
+            ),
+            len(mesh_hosts) ** 2,
+        ),
+        Case(
+            "mperf_rows",
+            lambda: fm.mperf_rows(mperf, "r1", "1.1.1.1"),
+            n_tgts,
+        ),
+        Case(
+            "lperf_rows",
+            lambda: fm.lperf_rows(lperf_stats, "r1", "1.1.1.1", tgts),
+            lperf_rows,
+        ),
+        Case("sperf_row", lambda: fm.sperf_row(sperf, "r1"), n_tgts),
+        Case(
+            "probe_archive_write",
+            lambda: fm.probe_archive_write(
+                mperf, os.path.join(workdir, "write.json.gz"), {}
+            ),
+            n_tgts,
+        ),
+        Case(
+            "probe_archive_read", lambda: fm.probe_archive_read(archive), n_tgts
+        ),
+        Case(
+            "parse_cache_trim",
+            lambda: fm.parse_cache_trim(cache_db, 1024),
+            lperf_rows,
+        ),
+        Case(
+            "raw_archive_append",
+            lambda: fm.raw_archive_append(
+                mperf,
+                os.path.join(workdir, "append.seg"),
+                {"src_host": "r1", "dtg": "x"},
+            ),
+            n_tgts,
+        ),
+        Case(
+            "raw_archive_index",
+            lambda: fm.raw_archive_index(raw_seg, probe="1"),
+            raw_count,
+        ),
+        Case(
+            "raw_archive_read",
+            lambda: fm.raw_archive_read(raw_seg, raw_entries),
+            len(raw_entries),
+        ),
+        Case(
+            "sla_sketch_update",
+            lambda: fm.sla_sketch_update(
+                mperf_stats, os.path.join(workdir, "sla.json"), "r1", tgts
+            ),
+            len(mperf_stats["index"]),
+        ),
+        Case(
+            "sla_sketch_update[intervals]",
+            lambda: fm.sla_sketch_update(
+                lperf_stats, sketch_paths[0], "r0", tgts
+            ),
+            lperf_rows,
+        ),
+        Case(
+            "sla_sketch_merge",
+            lambda: fm.sla_sketch_merge(sketch_paths),
+            lperf_rows * len(sketch_paths),
+        ),
+        Case(
+            "sla_sketch_report",
+            lambda: fm.sla_sketch_report(
+                sketch_pairs, os.path.join(workdir, "sla.csv")
+            ),
+            len(sketch_pairs),
+        ),
+        Case(
+            "filter_stats_merge",
+            lambda: fm.filter_stats_merge(stats_dir),
+            64,
+        ),
+        Case(
+            "ipsla_store_read",
+            lambda: fm.ipsla_store_read(store_read, as_lists=True),
+            lperf_rows,
+        ),
+    ]
+
+
+def percentile(ordered, pct):
+    """
+    Returns the nearest-rank percentile of an already sorted list.
+    """
+    rank = int(round(pct / 100.0 * len(ordered))) - 1
+    return ordered[max(0, min(rank, len(ordered) - 1))]
+
+
+def sperf_mesh(mesh, rng):
+    """
+    Returns the host names and host_vars of a full mesh of sperf results
+    between the mesh targets, where each host skips itself as a target.
+    """
+    mesh_hosts = [t["key"] for t in mesh]
+    mesh_vars = {}
+    for i, host in enumerate(mesh_hosts):
+        results = ios_synth.probe_results("sperf", mesh, rng, skipped=0)
+        results[i] = {"skipped": True, "item": mesh[i]}
+        mesh_vars[host] = {"PROBE_OUTPUT": {"results": results}}
+    return mesh_hosts, mesh_vars
+
+
+def next_collection(results):
+    """
+    Returns a copy of lperf probe results as collected one run later, when
+    only the still accumulating latest interval of each probe has grown
+    (by one more failure), so a checkpoint run parses just that interval.
+    """
+    later = []
+    for result in results:
+        if "skipped" in result:
+            later.append(result)
+            continue
+        head, count = result["stdout"][0].rsplit("Number of failures: ", 1)
+        text = "{0}Number of failures: {1}\n".format(head, int(count) + 1)
+        later.append(
+            dict(result, stdout=[text], stdout_lines=[text.split("\n")])
+        )
+    return later
+
+
+def write_filter_stats(stats_dir, names, procs):
+    """
+    Writes one filter statistics file per process into stats_dir, as the
+    instrumentation of that many Ansible forks would, each holding a call
+    of every filter in names.
+    """
+    os.makedirs(stats_dir)
+    for pid in range(procs):
+        proc_stats = {
+            name: {
+                "calls": 1,
+                "total_s": 0.1,
+                "max_s": 0.1,
+                "in_bytes": 1,
+                "in_items": 1,
+            }
+            for name in names
+        }
+        path = os.path.join(stats_dir, "filter_stats_{0}.json".format(pid))
+        with open(path, "w", encoding="utf-8") as handle:
+            json.dump({"pid": pid, "filters": proc_stats}, handle)
+
+
+def measure(case, repeat):
+    """
+    Runs a case and returns its statistics. One untimed warm-up operation
+    is performed first, then latencies are gathered without tracemalloc
+    (which slows allocation-heavy code), and finally one more operation is
+    traced to find the peak memory allocated while it ran.
+    """
+    if case.each is None:
+        op_args = [()]
+        call_args = [()] * repeat
+    else:
+        op_args = [(arg,) for arg in case.each]
+        call_args = op_args * max(1, repeat // 5)
+
+    run = case.run
+    clear = (lambda: None) if case.warm else perf.cache.parse_cache_clear
+    for args in op_args:
+        run(*args)
+    latencies = []
+    for args in call_args:
+        clear()
+        start = time.perf_counter()
+        run(*args)
+        latencies.append(time.perf_counter() - start)
+    total = sum(latencies)
+
+    tracemalloc.start()
+    for args in op_args:
+        clear()
+        run(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Per-item cases measure single calls, so each call is one item
+    if case.each is None:
+        items = case.items * len(call_args)
+    else:
+        items = len(call_args)
+    latencies.sort()
+    return {
+        "calls": len(call_args),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "items_per_s": items / total if total else 0.0,
+        "peak_kib": peak / 1024.0,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results to a baseline, returning a list of regression
+    strings for every compared statistic that grew beyond the tolerance.
+    Cases absent from the baseline are skipped.
+    """
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        for key in COMPARED:
+            limit = base[key] * (1 + tolerance)
+            if stats[key] > limit and stats[key] - base[key] > 0.01:
+                regressions.append(
+                    "{0} {1}: {2:.3f} > {3:.3f} (baseline {4:.3f})".format(
+                        name, key, stats[key], limit, base[key]
+                    )
+                )
+    return regressions
+
+
+def print_table(results, baseline):
+    """
+    Prints the results as aligned columns, with the change in median
+    latency against the baseline when one is given.
+    """
+    fmt = "{0:<36}{1:>8}{2:>11}{3:>11}{4:>11}{5:>14}{6:>11}{7:>9}"
+    print(
+        fmt.format(
+            "filter",
+            "calls",
+            "p50 ms",
+            "p90 ms",
+            "p99 ms",
+            "items/s",
+            "peak KiB",
+            "vs base",
+        )
+    )
+    base_results = baseline.get("results", {}) if baseline else {}
+    for name, stats in results.items():
+        delta = ""
+        base = base_results.get(name)
+        if base and base["p50_ms"]:
+            delta = "{0:+.0f}%".format(
+                100.0 * (stats["p50_ms"] / base["p50_ms"] - 1)
+            )
+        print(
+            fmt.format(
+                name,
+                stats["calls"],
+                "{0:.3f}".format(stats["p50_ms"]),
+                "{0:.3f}".format(stats["p90_ms"]),
+                "{0:.3f}".format(stats["p99_ms"]),
+                "{0:.0f}".format(stats["items_per_s"]),
+                "{0:.0f}".format(stats["peak_kib"]),
+                delta,
+            )
+        )
+
+
+def parse_args(argv):
+    """
+    Parses the command line, filling unspecified sizes from the scale.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--targets", type=int, help="number of targets")
+    parser.add_argument("--routes", type=int, help="number of FIB routes")
+    parser.add_argument("--hours", type=int, help="aggregated SLA intervals")
+    parser.add_argument("--repeat", type=int, help="timed runs per case")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--only", action="append", help="run only cases with this prefix"
+    )
+    parser.add_argument("--baseline", help="baseline JSON to compare with")
+    parser.add_argument("--save-baseline", help="write results to this JSON")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="allowed relative growth before a regression is reported",
+    )
+    args = parser.parse_args(argv)
+    cfg = dict(SCALES[args.scale], seed=args.seed)
+    for key in ("targets", "routes", "hours", "repeat"):
+        if getattr(args, key) is not None:
+            cfg[key] = getattr(args, key)
+    return args, cfg
+
+
+def main(argv=None):
+    """
+    Runs the benchmark. The exit code is 1 when any case regressed
+    against the baseline and 2 when a filter has no benchmark case.
+    """
+    args, cfg = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="perf_bench_")
+    try:
+        print("Generating synthetic inputs: {0}".format(cfg))
+        cases = build_cases(cfg, workdir)
+        results = {}
+        for case in cases:
+            if args.only and not any(
+                case.name.startswith(prefix) for prefix in args.only
+            ):
+                continue
+            results[case.name] = measure(case, cfg["repeat"])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as handle:
+            baseline = json.load(handle)
+    print_table(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as handle:
+            json.dump(
+                {
+                    "config": cfg,
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                handle,
+                indent=2,
+                sort_keys=True,
+            )
+
+    status = 0
+    if baseline:
+        if baseline.get("config") != cfg:
+            print(
+                "Warning: baseline was recorded with {0}".format(
+                    baseline.get("config")
+                )
+            )
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: {0}".format(regression))
+        status = 1 if regressions else 0
+
+    # Every filter must be benchmarked so new filters are not forgotten
+    covered = {case.filter_name() for case in cases}
+    missing = sorted(set(FilterModule.filters()) - covered)
+    if missing:
+        print("No benchmark case for: {0}".format(", ".join(missing)))
+        status = 2
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
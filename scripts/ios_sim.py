@@ -0,0 +1,695 @@
+#!/usr/bin/env python
+
+"""
+Simulates any number of Cisco IOS routers over SSH, so the playbooks can
+be run end to end at scale without a network. Each router listens on its
+own local port and answers the commands the playbooks send (loopback,
+NTP, FIB, exec IP SLA probes, pings, LSP verifications, and long-term
+IP SLA configuration and statistics) with synthetic output from
+ios_synth, using the latency, loss, and FIB size given.
+
+  python scripts/ios_sim.py --routers 200 --out-dir /tmp/sim
+  python scripts/ios_sim.py --routers 2000 --fib-routes 50000 --loss 0.02
+"""
+
+import argparse
+import json
+import os
+import re
+import selectors
+import signal
+import socket
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+
+import paramiko
+import yaml
+
+import ios_synth
+
+# Prompt suffix and banner line ending, as sent by IOS
+CRLF = "\r\n"
+
+# Seconds of idle time after which a session is closed, like exec-timeout
+IDLE_TIMEOUT = 600
+
+# Reply to any command the simulator does not implement
+INVALID = "% Invalid input detected at '^' marker."
+
+# Configuration submodes entered by the commands lperf_put sends
+_SUBMODES = (
+    (re.compile(r"^ip sla (\d+)$"), "config-ip-sla"),
+    (re.compile(r"^udp-jitter "), "config-ip-sla-jitter"),
+)
+
+# Configuration commands leaving the current mode, and the mode entered
+_MODE_EXITS = {"end": "exec", "exit": "config"}
+
+# Options of the ping and IP SLA commands that change their output
+_RE_OPTION = re.compile(r"\b(repeat|size|codec-numpackets) (\d+)")
+
+# Output of the exec commands that does not depend on any state
+_STATIC_OUTPUT = {
+    "show version": (
+        "Cisco IOS XE Software, Version 16.09.01\n"
+        "{name} uptime is 1 week, 2 days, 3 hours, 4 minutes\n"
+        "cisco CSR1000V (VXE) processor with 2392579K/3075K bytes "
+        "of memory.\n"
+    ),
+    "show privilege": "Current privilege level is 15",
+    "show ntp status": (
+        "Clock is synchronized, stratum 3, reference is 10.0.0.1\n"
+        "nominal freq is 250.0000 Hz, actual freq is 250.0000 Hz\n"
+    ),
+}
+
+# Other exec commands, matched by prefix in order, and the SimRouter
+# method building the output of each
+_EXEC_COMMANDS = (
+    ("show ip interface Loopback0", "show_loopback"),
+    ("show ip cef", "show_cef"),
+    ("show running-config", "show_running_config"),
+    ("show ip sla statistics aggregated", "show_ipsla_aggregated"),
+    ("ip sla udp-jitter ", "ipsla_udp_jitter"),
+    ("ping mpls ", "ping_mpls"),
+    ("ping ", "ping"),
+)
+
+
+class SimSlas(object):
+    """
+    The IP SLA operations configured on one router and the hours of
+    statistics each keeps, shared by all sessions to the router.
+    """
+
+    def __init__(self):
+        self.hours = {}
+        self.current = None
+        self.lock = threading.Lock()
+
+    def configure(self, command, mode):
+        """
+        Applies one configuration command, tracking the IP SLA operations
+        so they appear in the running configuration and statistics.
+        Returns the output, the mode it leaves the session in, and the
+        simulated seconds it takes, like SimRouter.respond.
+        """
+        if command in _MODE_EXITS:
+            return "", _MODE_EXITS[command], 0.0
+        words = command.split()
+        if command.startswith("no ip sla ") and words[3].isdigit():
+            with self.lock:
+                self.hours.pop(int(words[3]), None)
+            return "", "config", 0.0
+        if command.startswith("history hours-of-statistics-kept "):
+            with self.lock:
+                self.hours[self.current] = int(words[-1])
+            return "", mode, 0.0
+        for regex, submode in _SUBMODES:
+            match = regex.match(command)
+            if match:
+                if match.groups():
+                    self.current = int(match.group(1))
+                    with self.lock:
+                        self.hours.setdefault(self.current, 1)
+                return "", submode, 0.0
+
+        # Indented settings stay in the submode; others return to config
+        if mode != "config" and not command.startswith("ip sla "):
+            return "", mode, 0.0
+        return "", "config", 0.0
+
+    def running_config(self):
+        """
+        Returns the "ip sla" lines of the running configuration.
+        """
+        with self.lock:
+            return "\n".join(
+                "ip sla {0}".format(oper_id) for oper_id in sorted(self.hours)
+            )
+
+
+class SimRouter(object):
+    """
+    State of one simulated router: its name, loopback address, the IP SLA
+    operations configured on it, and a random generator seeded from the
+    router index so its output is repeatable. The exec commands it
+    answers are listed in _STATIC_OUTPUT and _EXEC_COMMANDS.
+    """
+
+    def __init__(self, index, target, cfg):
+        self.index = index
+        self.name = target["hostname"]
+        self.address = target["ipv4addr"]
+        self.cfg = cfg
+        self.slas = SimSlas()
+        self.lock = threading.Lock()
+        self.rng = ios_synth.new_rng(cfg["seed"] * 1000003 + index)
+
+    def respond(self, command, mode):
+        """
+        Returns the output of one command and the mode it leaves the
+        session in ("exec", "config", or a config submode), plus the
+        simulated seconds the device spends running it.
+        """
+        command = " ".join(command.split())
+        if mode != "exec":
+            return self.slas.configure(command, mode)
+
+        pipe = None
+        if " | include " in command:
+            command, pipe = command.split(" | include ", 1)
+            pipe = re.compile(pipe.replace("_", r"[\s,]"))
+        if command in ("configure terminal", "config terminal"):
+            return "", "config", 0.0
+        if command == "end":
+            return "", "exec", 0.0
+
+        with self.lock:
+            output, busy = self._exec(command)
+        if pipe is not None:
+            output = "\n".join(
+                line for line in output.split("\n") if pipe.search(line)
+            )
+        return output, "exec", busy
+
+    def _exec(self, command):
+        """
+        Builds the output of an exec mode command and the seconds of
+        simulated probe time it takes.
+        """
+        words = command.split()
+        if command.startswith("terminal ") or not words:
+            return "", 0.0
+        if command in _STATIC_OUTPUT:
+            return _STATIC_OUTPUT[command].format(name=self.name), 0.0
+        options = {key: int(val) for key, val in _RE_OPTION.findall(command)}
+        for prefix, method in _EXEC_COMMANDS:
+            if command.startswith(prefix):
+                return getattr(self, method)(words, options)
+        return INVALID, 0.0
+
+    def show_loopback(self, *_):
+        """
+        Returns the router's "show ip interface Loopback0" output.
+        """
+        return ios_synth.ip_interface_text(self.address), 0.0
+
+    def show_cef(self, *_):
+        """
+        Returns the router's "show ip cef" table, holding host routes to
+        most of the other routers. It is rebuilt on each request from a
+        seed so thousands of large tables are never held in memory.
+        """
+        cfg = self.cfg
+        rng = ios_synth.new_rng(zlib.crc32(self.name.encode("utf-8")))
+        text = ios_synth.fib_text(
+            cfg["fib_routes"], cfg["targets"], rng, cfg["reachable"]
+        )
+        return text, 0.0
+
+    def show_running_config(self, *_):
+        """
+        Returns the IP SLA operations of the running configuration.
+        """
+        return self.slas.running_config(), 0.0
+
+    def show_ipsla_aggregated(self, words, _):
+        """
+        Returns the aggregated statistics of the IP SLA operation given,
+        covering the hours of statistics it keeps.
+        """
+        cfg = self.cfg
+        oper_id = int(words[-1]) if words[-1].isdigit() else 1
+        with self.slas.lock:
+            hours = self.slas.hours.get(oper_id, cfg["hours"])
+        text = ios_synth.ipsla_aggregated_text(
+            self.rng, hours, oper_id, cfg["rtt"], cfg["loss"]
+        )
+        return text, 0.0
+
+    def ipsla_udp_jitter(self, _, options):
+        """
+        Returns the output of an exec-issued UDP jitter probe, which runs
+        for 20 ms per packet.
+        """
+        cfg = self.cfg
+        failed = self.rng.random() < cfg["loss"]
+        text = ios_synth.ipsla_latest_text(
+            self.rng, failed, cfg["rtt"], cfg["loss"]
+        )
+        return text, options.get("codec-numpackets", 1000) * 0.02
+
+    def ping_mpls(self, words, _):
+        """
+        Returns the output of an LSP verification to the prefix given.
+        """
+        dest = words[3].split("/")[0]
+        lines = ios_synth.lspv_lines(self.rng, dest, loss=self.cfg["loss"])
+        return "\n".join(lines), self._ping_time(lines[-1], 2)
+
+    def ping(self, words, options):
+        """
+        Returns the output of a ping to the address given, honoring its
+        repeat, size, and df-bit options.
+        """
+        cfg = self.cfg
+        lines = ios_synth.ping_lines(
+            self.rng,
+            words[1],
+            options.get("repeat", 5),
+            cfg["loss"],
+            size=options.get("size", 100),
+            df_bit="df-bit" in words,
+            rtt=cfg["rtt"],
+        )
+        marks = "".join(line for line in lines if set(line) <= set("!."))
+        return "\n".join(lines), self._ping_time(marks, 1)
+
+    def _ping_time(self, marks, timeout):
+        """
+        Estimates how long a ping with the given result marks runs: each
+        echo takes the midpoint RTT, or the timeout when it is lost.
+        """
+        rtt = sum(self.cfg["rtt"]) / 2000.0
+        return marks.count("!") * rtt + marks.count(".") * timeout
+
+
+class SimServer(paramiko.ServerInterface):
+    """
+    Accepts any user name and password and a single interactive shell,
+    like a lab router with no AAA.
+    """
+
+    def __init__(self):
+        self.shell = threading.Event()
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return "password,publickey"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, *_):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell.set()
+        return True
+
+
+class Stats(object):
+    """
+    Counts sessions, commands, and bytes across all routers, and the time
+    spent building responses and (scaled) running probes.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = Counter()
+        self.commands = Counter()
+        self.seconds = Counter()
+        self.sent = 0
+        self.start = time.time()
+
+    def add(self, kind, seconds, sent):
+        """
+        Records one command of the given kind.
+        """
+        with self.lock:
+            self.commands[kind] += 1
+            self.seconds[kind] += seconds
+            self.sent += sent
+
+    def line(self):
+        """
+        Returns a one line progress summary.
+        """
+        with self.lock:
+            elapsed = time.time() - self.start
+            total = sum(self.commands.values())
+            return (
+                "{0:8.1f}s sessions {1}/{2} commands {3} ({4:.1f}/s) "
+                "sent {5:.1f} MB".format(
+                    elapsed,
+                    self.sessions["open"],
+                    self.sessions["total"],
+                    total,
+                    total / elapsed if elapsed else 0.0,
+                    self.sent / 1e6,
+                )
+            )
+
+    def report(self):
+        """
+        Returns the final summary with one line per command kind.
+        """
+        lines = [
+            self.line(),
+            "{0:<28}{1:>10}{2:>12}".format("kind", "count", "avg ms"),
+        ]
+        with self.lock:
+            for kind, count in self.commands.most_common():
+                lines.append(
+                    "{0:<28}{1:>10}{2:>12.3f}".format(
+                        kind, count, 1000 * self.seconds[kind] / count
+                    )
+                )
+        return "\n".join(lines)
+
+
+def command_kind(command):
+    """
+    Returns a short label grouping commands for the statistics, such as
+    "ping" or "show ip cef".
+    """
+    words = command.split(" | ")[0].split()
+    if words[:2] == ["ping", "mpls"]:
+        return "ping mpls"
+    if words[:2] == ["ip", "sla"]:
+        return "ip sla " + (words[2] if len(words) > 2 else "")
+    if words and words[0] == "show":
+        return " ".join(words[:4] if "sla" in words else words[:3])
+    return words[0] if words else "(empty)"
+
+
+class SimSession(object):
+    """
+    The CLI session of one SSH client on one router, echoing each command
+    followed by its output and the prompt, as IOS does.
+    """
+
+    def __init__(self, router, channel, stats, args):
+        self.router = router
+        self.channel = channel
+        self.stats = stats
+        self.args = args
+        self.mode = "exec"
+        self.prompts = {"exec": router.name + "#"}
+
+    def run(self):
+        """
+        Sends the first prompt, then runs each command line received until
+        the client disconnects.
+        """
+        self.channel.settimeout(IDLE_TIMEOUT)
+        self.channel.sendall((CRLF + self.prompts["exec"]).encode("utf-8"))
+        pending = ""
+        while True:
+            data = self.channel.recv(65536)
+            if not data:
+                break
+            pending += data.decode("utf-8", "replace")
+            while re.search(r"[\r\n]", pending):
+                command, pending = re.split(r"\r\n|\r|\n", pending, 1)
+                self.execute(command)
+
+    def execute(self, command):
+        """
+        Runs one command, waiting for the configured CLI delay and scaled
+        probe time, and sends the echoed command, output, and prompt.
+        """
+        began = time.time()
+        output, self.mode, busy = self.router.respond(command, self.mode)
+        delay = (
+            self.args.cli_delay_ms / 1000.0 + busy * self.args.probe_time_scale
+        )
+        if delay:
+            time.sleep(delay)
+        prompt = self.prompts.setdefault(
+            self.mode, "{0}({1})#".format(self.router.name, self.mode)
+        )
+        reply = command + CRLF
+        if output:
+            reply += output.replace("\n", CRLF).rstrip() + CRLF
+        reply = (reply + prompt).encode("utf-8")
+        self.channel.sendall(reply)
+        self.stats.add(command_kind(command), time.time() - began, len(reply))
+
+
+def serve_session(router, transport, host_key, stats, args):
+    """
+    Runs the SSH session of one client on one router until the client
+    disconnects.
+    """
+    opened = False
+    try:
+        transport.add_server_key(host_key)
+        server = SimServer()
+        transport.start_server(server=server)
+        channel = transport.accept(timeout=30)
+        if channel is None or not server.shell.wait(30):
+            return
+        with stats.lock:
+            stats.sessions["open"] += 1
+            stats.sessions["total"] += 1
+        opened = True
+        SimSession(router, channel, stats, args).run()
+    except (EOFError, OSError, paramiko.SSHException):
+        pass
+    finally:
+        transport.close()
+        if opened:
+            with stats.lock:
+                stats.sessions["open"] -= 1
+
+
+def inventory_regions(groups, args):
+    """
+    Returns the regional groups of the inventory, giving the local address
+    and port of each simulated router as its ansible_host and
+    ansible_port.
+    """
+    regions = {}
+    for group, hosts in groups.items():
+        if group.endswith("_region"):
+            regions[group] = {
+                "hosts": {
+                    host: {
+                        "ansible_host": args.listen,
+                        "ansible_port": args.base_port + int(host[3:]),
+                    }
+                    for host in hosts
+                }
+            }
+    return regions
+
+
+def write_inventory(out_dir, routers, args):
+    """
+    Writes the files needed to run the playbooks against the simulated
+    routers into out_dir: an inventory (hosts.yml) spreading them across
+    regional groups, extra vars (vars.yml) with their targets, SLAs, and
+    credentials, and a resolve cache (resolve.json) so the router names
+    resolve without DNS. Returns the paths written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    groups, sla = ios_synth.inventory(len(routers))
+    inventory = {
+        "all": {
+            "hosts": {"localhost": None},
+            "children": {
+                "perf_routers": {"children": inventory_regions(groups, args)}
+            },
+        }
+    }
+    extra_vars = {
+        "ansible_user": "sim",
+        "ansible_password": "sim",
+        "ansible_ssh_pass": "sim",
+        "regional_sla": sla,
+        "targets": [
+            {"id": 100000 + router.index, "target": router.name}
+            for router in routers
+        ],
+    }
+
+    # Entries in the format of the resolve filter's cache file
+    expiry = time.time() + 10 * 365 * 86400
+    resolve = {
+        router.name: [expiry, router.name, router.address] for router in routers
+    }
+
+    paths = []
+    for name, data in (
+        ("hosts.yml", inventory),
+        ("vars.yml", extra_vars),
+        ("resolve.json", resolve),
+    ):
+        path = os.path.join(out_dir, name)
+        with open(path, "w", encoding="utf-8") as handle:
+            if name.endswith(".json"):
+                json.dump(resolve, handle)
+            else:
+                yaml.safe_dump(data, handle, default_flow_style=False)
+        paths.append(path)
+    return paths
+
+
+def parse_rtt(text):
+    """
+    Parses an RTT range such as "20-80" in milliseconds.
+    """
+    low, _, high = text.partition("-")
+    low, high = int(low), int(high or low)
+    if not 0 < low <= high:
+        raise argparse.ArgumentTypeError("expected LOW-HIGH, eg 20-80")
+    return (low, high)
+
+
+def parse_args(argv):
+    """
+    Parses the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--routers", type=int, default=10)
+    parser.add_argument("--listen", default="127.0.0.1")
+    parser.add_argument("--base-port", type=int, default=20000)
+    parser.add_argument(
+        "--rtt", type=parse_rtt, default=(1, 200), help="RTT range, eg 20-80"
+    )
+    parser.add_argument(
+        "--loss", type=float, default=0.05, help="share of packets lost"
+    )
+    parser.add_argument("--fib-routes", type=int, default=1000)
+    parser.add_argument(
+        "--reachable",
+        type=float,
+        default=0.9,
+        help="share of routers with a host route in each FIB",
+    )
+    parser.add_argument(
+        "--hours", type=int, default=1, help="IP SLA history hours"
+    )
+    parser.add_argument(
+        "--cli-delay-ms", type=float, default=0.0, help="delay per command"
+    )
+    parser.add_argument(
+        "--probe-time-scale",
+        type=float,
+        default=0.0,
+        help="share of the real probe duration to wait, eg 1 for real time",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host-key", help="RSA host key file to use")
+    parser.add_argument(
+        "--out-dir", help="write hosts.yml, vars.yml, and resolve.json here"
+    )
+    parser.add_argument(
+        "--stats-interval", type=float, default=10.0, help="0 to disable"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=0.0, help="seconds; 0 runs forever"
+    )
+    return parser.parse_args(argv)
+
+
+def listen(routers, args):
+    """
+    Opens a listening socket per router on consecutive ports from
+    args.base_port, returning a selector with each socket registered
+    along with its router.
+    """
+    selector = selectors.DefaultSelector()
+    for router in routers:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((args.listen, args.base_port + router.index))
+        sock.listen(64)
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ, router)
+    return selector
+
+
+def accept_sessions(selector, host_key, stats, args):
+    """
+    Waits up to a second for new connections and serves each in its own
+    thread.
+    """
+    for key, _ in selector.select(timeout=1.0):
+        try:
+            conn, _ = key.fileobj.accept()
+        except OSError:
+            continue
+        conn.setblocking(True)
+        transport = paramiko.Transport(conn)
+        threading.Thread(
+            target=serve_session,
+            args=(key.data, transport, host_key, stats, args),
+            daemon=True,
+        ).start()
+
+
+def main(argv=None):
+    """
+    Starts a listener per router, then accepts connections until
+    interrupted or the duration ends, printing progress and a final
+    summary of the commands served.
+    """
+    args = parse_args(argv)
+    targets = ios_synth.targets(args.routers)
+    cfg = {
+        "seed": args.seed,
+        "rtt": args.rtt,
+        "loss": args.loss,
+        "fib_routes": args.fib_routes,
+        "reachable": args.reachable,
+        "hours": args.hours,
+        "targets": targets,
+    }
+    routers = [SimRouter(i, tgt, cfg) for i, tgt in enumerate(targets)]
+    if args.host_key:
+        host_key = paramiko.RSAKey(filename=args.host_key)
+    else:
+        host_key = paramiko.RSAKey.generate(2048)
+
+    selector = listen(routers, args)
+    if args.out_dir:
+        for path in write_inventory(args.out_dir, routers, args):
+            print("Wrote {0}".format(path))
+    print(
+        "Simulating {0} routers on {1}:{2}-{3}".format(
+            len(routers),
+            args.listen,
+            args.base_port,
+            args.base_port + len(routers) - 1,
+        )
+    )
+    sys.stdout.flush()
+
+    # Stop on SIGTERM as well, such as when run in the background
+    def _interrupt(*_):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, _interrupt)
+    stats = Stats()
+    deadline = time.time() + args.duration if args.duration else None
+    next_report = time.time() + args.stats_interval
+    try:
+        while deadline is None or time.time() < deadline:
+            accept_sessions(selector, host_key, stats, args)
+            if args.stats_interval and time.time() >= next_report:
+                print(stats.line())
+                sys.stdout.flush()
+                next_report += args.stats_interval
+    except KeyboardInterrupt:
+        pass
+    finally:
+        selector.close()
+    print(stats.report())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
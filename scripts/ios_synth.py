@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+
+"""
+Generates synthetic Cisco IOS command outputs, and Ansible registered
+results built from them, in the same formats the filters in
+plugins/filter/filter.py parse. This allows the filters to be exercised
+at production scale (tens of thousands of targets, FIBs with a million
+routes, a full day of aggregated IP SLA intervals) without any devices.
+Every generator takes a random.Random instance so output is repeatable
+for a given seed.
+"""
+
+import random
+from datetime import datetime, timedelta
+
+# First synthetic target loopback; targets count upwards from here
+_TARGET_BASE = (10 << 24) | (32 << 16)
+
+# Reference start time for the first aggregation interval
+_EPOCH = datetime(2017, 11, 23, 16, 15, 11)
+
+
+def new_rng(seed=0):
+    """
+    Returns a seeded pseudo-random generator. The values only need to look
+    like plausible device output, so cryptographic strength is irrelevant.
+    """
+    return random.Random(seed)  # nosec
+
+
+def ipv4(value):
+    """
+    Converts a 32-bit integer into a dotted IPv4 address string.
+    """
+    return "{0}.{1}.{2}.{3}".format(
+        (value >> 24) & 255,
+        (value >> 16) & 255,
+        (value >> 8) & 255,
+        value & 255,
+    )
+
+
+def targets(count):
+    """
+    Returns a list of resolve-style hashes (key, hostname, ipv4addr), one
+    per target, like the LOOKUP_HASHES fact built by the playbooks.
+    """
+    return [
+        {
+            "key": "tgt{0}".format(i),
+            "hostname": "tgt{0}".format(i),
+            "ipv4addr": ipv4(_TARGET_BASE + i),
+        }
+        for i in range(count)
+    ]
+
+
+def fib_text(routes, target_list, rng, reachable=0.9):
+    """
+    Returns "show ip cef" style output containing the given number of
+    routes. A /32 host route is included for roughly the reachable share of
+    the targets and the remainder of the table is filled with random
+    shorter prefixes, so both exact and longest-prefix lookups do real work.
+    """
+    lines = ["Prefix               Next Hop             Interface"]
+    for tgt in target_list:
+        if len(lines) > routes:
+            break
+        if rng.random() < reachable:
+            lines.append(
+                "{0:<21}10.0.0.1             GigabitEthernet0/0/0".format(
+                    tgt["ipv4addr"] + "/32"
+                )
+            )
+    while len(lines) <= routes:
+        length = rng.randint(8, 30)
+        net = rng.getrandbits(32) & ((0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF)
+        lines.append(
+            "{0:<21}10.0.0.{1:<14}GigabitEthernet0/0/{1}".format(
+                "{0}/{1}".format(ipv4(net), length), rng.randint(1, 8)
+            )
+        )
+    return "\n".join(lines) + "\n"
+
+
+def _triplet(rng, low=1, high=200):
+    """
+    Returns a "min/avg/max" string of sane, ordered random integers.
+    """
+    values = sorted(rng.randint(low, high) for _ in range(3))
+    return "{0}/{1}/{2}".format(*values)
+
+
+def _pair(rng, low=0, high=20):
+    """
+    Returns a "min/max" string of ordered random integers.
+    """
+    values = sorted(rng.randint(low, high) for _ in range(2))
+    return "{0}/{1}".format(*values)
+
+
+def _ipsla_body(rng, rtt_cnt, rtt=(1, 200), loss=None):
+    """
+    Returns the statistics shared by the latest and aggregated forms of
+    "show ip sla statistics" output, starting at the RTT values. RTTs are
+    drawn from the rtt range and one-way latencies from half of it. When
+    loss is given, that share of the packets is lost in each direction,
+    otherwise a handful are.
+    """
+    if loss is None:
+        loss_sd = rng.randint(0, 5)
+        loss_ds = rng.randint(0, 5)
+    else:
+        loss_sd = loss_ds = int(round(rtt_cnt * loss))
+    one_way = (max(1, rtt[0] // 2), max(1, rtt[1] // 2))
+    return (
+        "RTT Values:\n"
+        "Number Of RTT: {0}\t\tRTT Min/Avg/Max: {1} milliseconds\n"
+        "Latency one-way time:\n"
+        "Number of Latency one-way Samples: {0}\n"
+        "Source to Destination Latency one way Min/Avg/Max: {2} milliseconds\n"
+        "Destination to Source Latency one way Min/Avg/Max: {3} milliseconds\n"
+        "Jitter Time:\n"
+        "Number of SD Jitter Samples: {4}\n"
+        "Number of DS Jitter Samples: {4}\n"
+        "Source to Destination Jitter Min/Avg/Max: {5} milliseconds\n"
+        "Destination to Source Jitter Min/Avg/Max: {6} milliseconds\n"
+        "Over Threshold:\n"
+        "Number Of RTT Over Threshold: {7} ({8}%)\n"
+        "Packet Loss Values:\n"
+        "Loss Source to Destination: {9}\n"
+        "Source to Destination Loss Periods Number: {10}\n"
+        "Source to Destination Loss Period Length Min/Max: {11}\n"
+        "Source to Destination Inter Loss Period Length Min/Max: {12}\n"
+        "Loss Destination to Source: {13}\n"
+        "Destination to Source Loss Periods Number: {14}\n"
+        "Destination to Source Loss Period Length Min/Max: {15}\n"
+        "Destination to Source Inter Loss Period Length Min/Max: {16}\n"
+        "Out Of Sequence: {17}\tTail Drop: {18}\n"
+        "Packet Late Arrival: {19}\tPacket Skipped: {20}\n"
+    ).format(
+        rtt_cnt,
+        _triplet(rng, *rtt),
+        _triplet(rng, *one_way),
+        _triplet(rng, *one_way),
+        max(rtt_cnt - 1, 0),
+        _triplet(rng, 0, 30),
+        _triplet(rng, 0, 30),
+        rng.randint(0, 10),
+        rng.randint(0, 10),
+        loss_sd,
+        min(loss_sd, 2),
+        _pair(rng),
+        _pair(rng, 0, 900),
+        loss_ds,
+        min(loss_ds, 2),
+        _pair(rng),
+        _pair(rng, 0, 900),
+        rng.randint(0, 3),
+        rng.randint(0, 3),
+        rng.randint(0, 3),
+        rng.randint(0, 3),
+    )
+
+
+def ipsla_latest_text(rng, failed=False, rtt=(1, 200), loss=None):
+    """
+    Returns "show ip sla statistics <id> details" output for a single
+    exec-issued udp-jitter probe run, as collected by mperf. A failed
+    probe reports an RTT count of 0. The rtt range and loss share are
+    passed to _ipsla_body.
+    """
+    rtt_cnt = 0 if failed else rng.randint(90, 100)
+    return (
+        "Type of operation: udp-jitter\n"
+        "Latest RTT: {0} milliseconds\n"
+        "Latest operation start time: 15:42:34 UTC Sat Nov 11 2017\n"
+        "Latest operation return code: OK\n"
+        "{1}"
+        "Voice Score Values:\n"
+        "Calculated Planning Impairment Factor (ICPIF): {2}\n"
+        "MOS score: {3}.{4:02d}\n"
+        "Number of successes: {5}\n"
+        "Number of failures: {6}\n"
+    ).format(
+        rng.randint(*rtt),
+        _ipsla_body(rng, rtt_cnt, rtt, loss),
+        rng.randint(0, 20),
+        rng.randint(1, 4),
+        rng.randint(0, 99),
+        int(not failed),
+        int(failed),
+    )
+
+
+def ipsla_aggregated_text(rng, hours, oper_id=1, rtt=(1, 200), loss=None):
+    """
+    Returns "show ip sla statistics aggregated details" output for one
+    scheduled probe keeping the given number of hourly intervals, as
+    collected by lperf_get. Each interval has its own start time index.
+    The rtt range and loss share are passed to _ipsla_body.
+    """
+    chunks = ["IPSLA operation id: {0}\n".format(oper_id)]
+    for hour in range(hours):
+        start = _EPOCH + timedelta(hours=hour)
+        mos_min = rng.randint(100, 440)
+        chunks.append(
+            "Start Time Index: {0}\n"
+            "Type of operation: udp-jitter\n"
+            "Voice Scores:\n"
+            "MinOfICPIF: {1}\tMaxOfICPIF: {2}\t"
+            "MinOfMOS: {3:.2f}\tMaxOfMOS: {4:.2f}\n"
+            "{5}"
+            "Number of successes: {6}\n"
+            "Number of failures: {7}\n".format(
+                start.strftime("%H:%M:%S UTC %a %b %d %Y"),
+                rng.randint(0, 5),
+                rng.randint(5, 20),
+                mos_min / 100.0,
+                rng.randint(mos_min, 440) / 100.0,
+                _ipsla_body(rng, rng.randint(3000, 3600), rtt, loss),
+                rng.randint(55, 60),
+                rng.randint(0, 5),
+            )
+        )
+    return "".join(chunks)
+
+
+def ping_lines(rng, dest, count=5, loss=0.05, **options):
+    """
+    Returns the lines of an extended IOS ping, including the result
+    characters (wrapped every 70 echoes, as IOS does) and the trailing
+    success rate line. Each echo is lost with the given probability. The
+    options may give the datagram "size" (100 by default), set "df_bit",
+    and give the "rtt" range the round-trip times are drawn from (1 to
+    200 ms by default).
+    """
+    marks = "".join("." if rng.random() < loss else "!" for _ in range(count))
+    lines = [
+        "Type escape sequence to abort.",
+        "Sending {0}, {1}-byte ICMP Echos to {2}, timeout is 1 seconds:".format(
+            count, options.get("size", 100), dest
+        ),
+        "Packet sent with a source address of 10.0.0.1 ",
+    ]
+    if options.get("df_bit"):
+        lines.append("Packet sent with the DF bit set")
+    lines.extend(marks[pos : pos + 70] for pos in range(0, count, 70))
+
+    success = marks.count("!")
+    rate = "Success rate is {0} percent ({1}/{2})".format(
+        100 * success // count, success, count
+    )
+    if success:
+        rtt = options.get("rtt", (1, 200))
+        rate += ", round-trip min/avg/max = {0} ms".format(_triplet(rng, *rtt))
+    lines.append(rate)
+    return lines
+
+
+def lspv_lines(rng, dest, count=5, loss=0.05):
+    """
+    Returns the lines of an IOS "ping mpls ipv4" LSP verification, whose
+    result code string is on line 13 as the mperf template expects.
+    """
+    codes = "".join("." if rng.random() < loss else "!" for _ in range(count))
+    legend = [
+        "Sending {0}, 100-byte MPLS Echos to {1}/32,".format(count, dest),
+        "     timeout is 2 seconds, send interval is 0 msec:",
+        "",
+        "Codes: '!' - success, 'Q' - request not sent, '.' - timeout,",
+        "  'L' - labeled output interface, 'B' - unlabeled output interface,",
+        "  'D' - DS Map mismatch, 'F' - no FEC mapping, 'f' - FEC mismatch,",
+        "  'M' - malformed request, 'm' - unsupported tlvs, 'N' - no label",
+        "  'P' - no rx intf label prot, 'p' - premature termination of LSP,",
+        "  'R' - transit router, 'I' - unknown upstream index,",
+        "  'l' - Label switched with FEC change, 'd' - see DDMAP for return",
+        "  'X' - unknown return code, 'x' - return code 0",
+        "",
+        "Type escape sequence to abort.",
+        codes,
+    ]
+    return legend
+
+
+def ip_interface_text(address, length=32):
+    """
+    Returns the filtered "show ip interface Loopback0" line used to learn
+    a router's loopback address.
+    """
+    return "  Internet address is {0}/{1}".format(address, length)
+
+
+def probe_results(kind, target_list, rng, hours=24, skipped=0.05):
+    """
+    Returns a list of Ansible registered loop results, like PROBE_OUTPUT
+    .results, for the given playbook kind ("mperf", "lperf", or "sperf").
+    A share of the targets is marked as skipped, as happens when the
+    inventory host pings itself. Each result carries both "stdout" and
+    "stdout_lines" just like the ios_command module returns.
+    """
+    results = []
+    for i, tgt in enumerate(target_list):
+        if rng.random() < skipped:
+            results.append({"skipped": True, "item": tgt})
+            continue
+        dest = tgt["ipv4addr"]
+        if kind == "mperf":
+            outputs = [
+                ipsla_latest_text(rng, failed=rng.random() < 0.05).split("\n"),
+                ping_lines(rng, dest, size=1500, df_bit=True),
+                lspv_lines(rng, dest),
+            ]
+        elif kind == "lperf":
+            outputs = [
+                ipsla_aggregated_text(rng, hours, oper_id=i + 1).split("\n")
+            ]
+        else:
+            outputs = [ping_lines(rng, dest)]
+        results.append(
+            {
+                "item": tgt,
+                "stdout": ["\n".join(lines) for lines in outputs],
+                "stdout_lines": outputs,
+            }
+        )
+    return results
+
+
+def inventory(host_count, regions=("usa", "emear", "apjc")):
+    """
+    Returns (groups, sla) for get_sla: an Ansible "groups" hash spreading
+    host_count hosts named like the targets across regional groups, plus
+    the matching regional_sla hash of RTT thresholds.
+    """
+    groups = {"all": [], "ungrouped": []}
+    sla = {}
+    for r_index, region in enumerate(regions):
+        groups["{0}_region".format(region)] = []
+        sla["{0}_region".format(region)] = 100 * (r_index + 1)
+    for i in range(host_count):
+        host = "tgt{0}".format(i)
+        groups["all"].append(host)
+        groups["{0}_region".format(regions[i % len(regions)])].append(host)
+    return groups, sla
@@ -0,0 +1,728 @@
+#!/usr/bin/env python
+
+"""
+Streams historical rollup CSV files (as written to rollups/ by the mperf,
+lperf_get, and sperf playbooks) and computes per (src_host, dest_host)
+aggregates: run and failure counts, median and 95th percentile RTT, mean
+jitter, loss, mean and worst MOS, plus least-squares trends per day.
+
+  python scripts/perf_analytics.py rollups/
+  python scripts/perf_analytics.py rollups/ --kind lperf --bucket day
+  python scripts/perf_analytics.py rollups/*.csv --since 20180101 -o out.csv
+"""
+
+import argparse
+import functools
+import math
+import mmap
+import os
+import re
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+# The sketch is in the private helper package of the filters, within the
+# plugin_utils directory of the playbook plugins
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(REPO_DIR, "plugins", "plugin_utils"))
+from _perf.sketch import DDSketch  # pylint: disable=wrong-import-position
+
+# Bytes of a memory-mapped file split into lines at a time
+CHUNK_BYTES = 1 << 22
+
+# DTG embedded in rollup file names, as set by the dtg role
+_RE_DTG = re.compile(r"(\d{8}T\d{6})")
+
+# Output columns, one row per pair (and time bucket)
+OUTPUT_HEADER = (
+    "kind,src_host,dest_host,bucket,runs,failed,first,last,"
+    "rtt_p50,rtt_p95,rtt_max,jitter_avg,loss_pct,mos_avg,mos_min,"
+    "rtt_trend,loss_trend,mos_trend"
+)
+
+# Time bucket lengths; months are handled separately
+BUCKETS = ("none", "hour", "day", "week", "month")
+
+
+class ExactSum(object):
+    """
+    Running float sum kept as non-overlapping partials (Shewchuk), so the
+    total is exact and does not depend on the order in which samples and
+    the sums of other workers are added.
+    """
+
+    __slots__ = ("partials",)
+
+    def __init__(self):
+        self.partials = []
+
+    def add(self, value):
+        """
+        Adds one value.
+        """
+        partials = self.partials
+        i = 0
+        for part in partials:
+            if abs(value) < abs(part):
+                value, part = part, value
+            high = value + part
+            low = part - (high - value)
+            if low:
+                partials[i] = low
+                i += 1
+            value = high
+        partials[i:] = [value]
+
+    def merge(self, other):
+        """
+        Adds the values of another sum into this one.
+        """
+        for part in other.partials:
+            self.add(part)
+
+    def value(self):
+        """
+        Returns the sum correctly rounded to a float.
+        """
+        return math.fsum(self.partials)
+
+
+class Trend(object):
+    """
+    Running least-squares fit of a value against time in days, keeping
+    only five sums so memory does not grow with the number of samples.
+    """
+
+    __slots__ = ("n", "st", "sy", "stt", "sty")
+
+    def __init__(self):
+        self.n = 0
+        self.st, self.sy, self.stt, self.sty = (ExactSum() for _ in range(4))
+
+    def add(self, days, value):
+        """
+        Adds one (time, value) sample.
+        """
+        self.n += 1
+        self.st.add(days)
+        self.sy.add(value)
+        self.stt.add(days * days)
+        self.sty.add(days * value)
+
+    def merge(self, other):
+        """
+        Adds the samples of another fit into this one.
+        """
+        self.n += other.n
+        self.st.merge(other.st)
+        self.sy.merge(other.sy)
+        self.stt.merge(other.stt)
+        self.sty.merge(other.sty)
+
+    def slope(self):
+        """
+        Returns the fitted change per day, or None with fewer than two
+        distinct sample times.
+        """
+        st, stt = self.st.value(), self.stt.value()
+        denom = self.n * stt - st * st
+        if self.n < 2 or denom <= 1e-9 * self.n * stt:
+            return None
+        return (self.n * self.sty.value() - st * self.sy.value()) / denom
+
+
+class PairStats(object):  # pylint: disable=too-many-instance-attributes
+    """
+    Aggregates for one (kind, src_host, dest_host, bucket). The size is
+    fixed apart from the bounded RTT sketch.
+    """
+
+    __slots__ = (
+        "runs",
+        "failed",
+        "first",
+        "last",
+        "rtt",
+        "rtt_min",
+        "rtt_max",
+        "jitter_sum",
+        "jitter_n",
+        "lost",
+        "sent",
+        "mos_sum",
+        "mos_n",
+        "mos_min",
+        "rtt_trend",
+        "loss_trend",
+        "mos_trend",
+    )
+
+    def __init__(self):
+        self.runs = self.failed = 0
+        self.first = self.last = None
+        self.rtt = DDSketch()
+        self.rtt_min = self.rtt_max = None
+        self.jitter_sum = ExactSum()
+        self.jitter_n = 0
+        self.lost = self.sent = 0
+        self.mos_sum = ExactSum()
+        self.mos_n = 0
+        self.mos_min = None
+        self.rtt_trend = Trend()
+        self.loss_trend = Trend()
+        self.mos_trend = Trend()
+
+    def add(self, sample):
+        """
+        Adds one sample, a (time, days, rtt, jitter, lost, sent, mos)
+        tuple where rtt, jitter, and mos may be None when not measured.
+        A sample without an RTT counts as a failed run.
+        """
+        when, days, rtt, jitter, lost, sent, mos = sample
+        self.runs += 1
+        self.first = when if self.first is None else min(self.first, when)
+        self.last = when if self.last is None else max(self.last, when)
+        if rtt is None:
+            self.failed += 1
+        else:
+            self.rtt.add(rtt)
+            if self.rtt_max is None:
+                self.rtt_min = self.rtt_max = rtt
+            self.rtt_min = min(self.rtt_min, rtt)
+            self.rtt_max = max(self.rtt_max, rtt)
+            self.rtt_trend.add(days, rtt)
+        if jitter is not None:
+            self.jitter_sum.add(jitter)
+            self.jitter_n += 1
+        if sent:
+            self.lost += lost
+            self.sent += sent
+            self.loss_trend.add(days, 100.0 * lost / sent)
+        if mos is not None:
+            self.mos_sum.add(mos)
+            self.mos_n += 1
+            self.mos_min = (
+                mos if self.mos_min is None else min(self.mos_min, mos)
+            )
+            self.mos_trend.add(days, mos)
+
+    def merge(self, other):
+        """
+        Adds the samples of another PairStats of the same pair and bucket,
+        such as one aggregated by another worker.
+        """
+        self.runs += other.runs
+        self.failed += other.failed
+        self.first = min(self.first, other.first)
+        self.last = max(self.last, other.last)
+        self.rtt.merge(other.rtt)
+        if other.rtt_max is not None:
+            if self.rtt_max is None:
+                self.rtt_min, self.rtt_max = other.rtt_min, other.rtt_max
+            self.rtt_min = min(self.rtt_min, other.rtt_min)
+            self.rtt_max = max(self.rtt_max, other.rtt_max)
+        self.jitter_sum.merge(other.jitter_sum)
+        self.jitter_n += other.jitter_n
+        self.lost += other.lost
+        self.sent += other.sent
+        self.mos_sum.merge(other.mos_sum)
+        self.mos_n += other.mos_n
+        if other.mos_min is not None:
+            self.mos_min = (
+                other.mos_min
+                if self.mos_min is None
+                else min(self.mos_min, other.mos_min)
+            )
+        self.rtt_trend.merge(other.rtt_trend)
+        self.loss_trend.merge(other.loss_trend)
+        self.mos_trend.merge(other.mos_trend)
+
+    def row(self):
+        """
+        Returns the output values following the pair and bucket columns.
+        """
+        return [
+            self.runs,
+            self.failed,
+            self.first.strftime("%Y%m%dT%H%M%S"),
+            self.last.strftime("%Y%m%dT%H%M%S"),
+            self.rtt.quantile(0.5),
+            self.rtt.quantile(0.95),
+            self.rtt_max,
+            self.jitter_sum.value() / self.jitter_n if self.jitter_n else None,
+            100.0 * self.lost / self.sent if self.sent else None,
+            self.mos_sum.value() / self.mos_n if self.mos_n else None,
+            self.mos_min,
+            self.rtt_trend.slope(),
+            self.loss_trend.slope(),
+            self.mos_trend.slope(),
+        ]
+
+
+def detect_kind(columns):
+    """
+    Identifies the playbook that wrote a rollup from its header columns:
+    sperf headers start with an empty cell, mperf headers end with the
+    synopsis, and lperf headers hold over-threshold counts. Returns None
+    for any other CSV file, such as the sperf analysis files.
+    """
+    if len(columns) > 1 and columns[0] == "":
+        return "sperf"
+    if "voice_mos" in columns and "synopsis" in columns:
+        return "mperf"
+    if "rtt_ovthp" in columns and "voc_mos_min" in columns:
+        return "lperf"
+    return None
+
+
+def file_time(path):
+    """
+    Returns the DTG from a rollup file name as a datetime, falling back
+    to the file modification time when the name holds no DTG.
+    """
+    re_search = _RE_DTG.search(os.path.basename(path))
+    if re_search:
+        return datetime.strptime(re_search.group(1), "%Y%m%dT%H%M%S")
+    return datetime.fromtimestamp(os.path.getmtime(path))
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_start_time(text):
+    """
+    Parses an IP SLA "Start Time Index" such as "16:15:11 UTC Thu Nov 23
+    2017" into a naive datetime, ignoring the time zone name. Returns None
+    for an empty or unrecognized string.
+    """
+    parts = text.split()
+    if len(parts) != 6:
+        return None
+    try:
+        return datetime.strptime(
+            " ".join(parts[:1] + parts[2:]), "%H:%M:%S %a %b %d %Y"
+        )
+    except ValueError:
+        return None
+
+
+def bucket_start(when, bucket):
+    """
+    Returns the start of the time bucket containing a datetime, or None
+    when results are not bucketed.
+    """
+    if bucket == "hour":
+        return when.replace(minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        return when.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "week":
+        day = when.replace(hour=0, minute=0, second=0, microsecond=0)
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return when.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return None
+
+
+def bucket_end(start, bucket):
+    """
+    Returns the end of the time bucket beginning at start.
+    """
+    if bucket == "month":
+        return (start + timedelta(days=32)).replace(day=1)
+    lengths = {"hour": 1 / 24.0, "day": 1, "week": 7}
+    return start + timedelta(days=lengths[bucket])
+
+
+def iter_lines(path):
+    """
+    Yields each line of a file as bytes, without the newline, by mapping
+    the file into memory and splitting it a chunk at a time. Only one
+    chunk is held in memory regardless of the file size.
+    """
+    with open(path, "rb") as handle:
+        if os.fstat(handle.fileno()).st_size == 0:
+            return
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = 0
+            size = len(mm)
+            while pos < size:
+                end = mm.rfind(b"\n", pos, min(pos + CHUNK_BYTES, size))
+                if end < 0 or pos + CHUNK_BYTES >= size:
+                    end = size
+                chunk = mm[pos:end]
+                pos = end + 1
+                for line in chunk.split(b"\n"):
+                    if line:
+                        yield line.rstrip(b"\r")
+
+
+def _num(value):
+    """
+    Converts a CSV cell to a float, returning None for empty, negative
+    (missing) or invalid values.
+    """
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+    return number if number >= 0 else None
+
+
+def _probe_sample(cells, idx):
+    """
+    Converts an mperf or lperf row into the measured values of a sample
+    (rtt, jitter, lost, sent, mos), or None if the probe was not parsed.
+    """
+    rtt_cnt = _num(cells[idx["rtt_cnt"]])
+    if rtt_cnt is None:
+        return None
+    jitters = [
+        _num(cells[idx[key]])
+        for key in ("jit_sd_avg", "jit_ds_avg")
+        if _num(cells[idx[key]]) is not None
+    ]
+    lost = sum(_num(cells[idx[key]]) or 0 for key in ("los_sd", "los_ds"))
+    return (
+        _num(cells[idx["rtt_avg"]]) if rtt_cnt > 0 else None,
+        sum(jitters) / len(jitters) if jitters and rtt_cnt > 0 else None,
+        lost,
+        rtt_cnt + lost,
+        _num(cells[idx["mos"]]) if rtt_cnt > 0 else None,
+    )
+
+
+class Analyzer(object):
+    """
+    Aggregates the rows of one worker's share of the files, which must
+    be fed in time order. Since lperf_get reports every interval a device
+    still keeps on each run, lperf intervals are held per pair until they
+    are older than the window, and only the most recent report of each
+    is aggregated. Buckets are closed, and their rows emitted, once they
+    end more than the window before the newest file.
+
+    Shares after the first start at the time of their first file. Data
+    from before that time may also be reported by the previous share, so
+    intervals starting earlier stay pending and buckets starting earlier
+    stay open, to be merged across workers by finish_partitions.
+    """
+
+    def __init__(self, bucket, window, origin, start=None):
+        self.bucket = bucket
+        self.window = window
+        self.origin = origin
+        self.start = start
+        self.buckets = OrderedDict()
+        self.pending = {}
+        self.rows = []
+
+    def owns(self, when):
+        """
+        Returns True when no earlier share can hold data of a time.
+        """
+        return self.start is None or when >= self.start
+
+    def add(self, kind, src, dst, when, values):
+        """
+        Adds one sample for a pair to the statistics of its bucket.
+        """
+        days = (when - self.origin).total_seconds() / 86400.0
+        start = bucket_start(when, self.bucket)
+        pairs = self.buckets.get(start)
+        if pairs is None:
+            pairs = self.buckets[start] = {}
+        key = (kind, src, dst)
+        stats = pairs.get(key)
+        if stats is None:
+            stats = pairs[key] = PairStats()
+        stats.add((when, days) + values)
+
+    def feed(self, path, when):
+        """
+        Parses one rollup file, skipping files of unknown format.
+        """
+        lines = iter_lines(path)
+        header = next(lines, b"").decode("utf-8", "replace")
+        columns = [col.strip() for col in header.split(",")]
+        kind = detect_kind(columns)
+        if kind is None:
+            return False
+        if kind == "sperf":
+            self._feed_sperf(lines, columns, when)
+        else:
+            self._feed_probe(lines, columns, kind, when)
+        self._flush(when)
+        return kind
+
+    def _feed_sperf(self, lines, columns, when):
+        """
+        Adds the cells of an sperf matrix. Empty cells (the host itself)
+        and -1 (unparsed output) are skipped; 0 means no echo returned.
+        """
+        dests = [col.encode("utf-8") for col in columns]
+        for line in lines:
+            cells = line.split(b",")
+            for dst, cell in zip(dests[1:], cells[1:]):
+                rtt = _num(cell) if cell else None
+                if rtt is None:
+                    continue
+                failed = rtt == 0
+                values = (None if failed else rtt, None, int(failed), 1, None)
+                self.add("sperf", cells[0], dst, when, values)
+
+    def _feed_probe(self, lines, columns, kind, when):
+        """
+        Adds the rows of an mperf or lperf rollup. lperf rows carrying a
+        start time are held as pending intervals, keyed by pair and start
+        time, so a later report of the same interval replaces them.
+        """
+        idx = {col: i for i, col in enumerate(columns)}
+        idx["mos"] = idx["voice_mos" if kind == "mperf" else "voc_mos_min"]
+        start_col = idx.get("start_time")
+        width = len(columns)
+        for line in lines:
+            cells = line.split(b",", width - 1)
+            if len(cells) < width:
+                continue
+            values = _probe_sample(cells, idx)
+            if values is None:
+                continue
+            start = None
+            if start_col is not None:
+                start = parse_start_time(cells[start_col].decode("utf-8"))
+            if start is None:
+                self.add(kind, cells[0], cells[2], when, values)
+            else:
+                key = (kind, cells[0], cells[2], start)
+                self.pending[key] = (when, values)
+
+    def _flush(self, now):
+        """
+        Aggregates pending lperf intervals older than the window, then
+        closes buckets ending before the window, oldest first.
+        """
+        limit = now - self.window
+        final = [k for k in self.pending if self.owns(k[3]) and k[3] < limit]
+        for key in final:
+            self.add(key[0], key[1], key[2], key[3], self.pending.pop(key)[1])
+        if self.bucket == "none":
+            return
+        for start in sorted(self.buckets):
+            if bucket_end(start, self.bucket) > limit:
+                break
+            if self.owns(start):
+                self._emit(start, self.buckets.pop(start))
+
+    def merge(self, buckets, pending):
+        """
+        Adds the open buckets and pending intervals of another worker.
+        For intervals reported by both, the most recent report is kept.
+        """
+        for start, pairs in buckets.items():
+            mine = self.buckets.setdefault(start, {})
+            for key, stats in pairs.items():
+                if key in mine:
+                    mine[key].merge(stats)
+                else:
+                    mine[key] = stats
+        for key, report in pending.items():
+            if key not in self.pending or report[0] >= self.pending[key][0]:
+                self.pending[key] = report
+
+    def finish(self):
+        """
+        Aggregates all pending intervals, closes every bucket, and returns
+        the output rows.
+        """
+        for key, (_, values) in self.pending.items():
+            self.add(key[0], key[1], key[2], key[3], values)
+        self.pending = {}
+        for start in sorted(self.buckets, key=lambda s: s or datetime.min):
+            self._emit(start, self.buckets[start])
+        self.buckets = OrderedDict()
+        return self.rows
+
+    def _emit(self, start, pairs):
+        """
+        Appends the output rows of one bucket.
+        """
+        label = start.strftime("%Y%m%dT%H%M%S") if start else "all"
+        for (kind, src, dst), stats in pairs.items():
+            self.rows.append(
+                [kind, src.decode("utf-8"), dst.decode("utf-8"), label]
+                + stats.row()
+            )
+
+
+def split_files(files, workers):
+    """
+    Splits the time-ordered (path, time) tuples into at most 'workers'
+    contiguous shares of about the same total size, so each worker reads
+    only its own files. Files of the same time stay in one share, so
+    every share starts later than all of the files before it.
+    """
+    sizes = [os.path.getsize(path) for path, _ in files]
+    total = sum(sizes) or 1
+    shares = [[] for _ in range(workers)]
+    share = done = 0
+    for item, size in zip(files, sizes):
+        if not shares[share] or item[1] > shares[share][-1][1]:
+            share = min(workers - 1, done * workers // total)
+        shares[share].append(item)
+        done += size
+    return [share for share in shares if share]
+
+
+def analyze_partition(job):
+    """
+    Runs the analysis over one worker's share of the files, starting at
+    'start' (None for the first share). Returns the rows of the buckets
+    it closed, its open buckets and pending lperf intervals, and the
+    number of files of each kind that were read.
+    """
+    files, start, bucket, window, origin = job
+    analyzer = Analyzer(bucket, window, origin, start)
+    kinds = {}
+    for path, when in files:
+        kind = analyzer.feed(path, when)
+        kinds[kind] = kinds.get(kind, 0) + 1
+    return analyzer.rows, analyzer.buckets, analyzer.pending, kinds
+
+
+def finish_partitions(results, bucket, window, origin):
+    """
+    Merges the open buckets and pending intervals of every worker, in
+    file order, and returns all output rows and the number of files of
+    each kind that were read. The per-pair statistics merge exactly, so
+    the rows do not depend on the number of workers.
+    """
+    merged = Analyzer(bucket, window, origin)
+    rows = []
+    kinds = {}
+    for worker_rows, buckets, pending, worker_kinds in results:
+        rows.extend(worker_rows)
+        merged.merge(buckets, pending)
+        for kind, count in worker_kinds.items():
+            kinds[kind] = kinds.get(kind, 0) + count
+    rows.extend(merged.finish())
+    rows.sort(key=lambda row: row[:4])
+    return rows, kinds
+
+
+def find_files(paths, kinds, since, until):
+    """
+    Expands directories into their CSV files and returns (path, time)
+    tuples sorted by time, limited to the requested kinds (by file name
+    prefix) and time range.
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            names = sorted(os.listdir(path))
+            found.extend(
+                os.path.join(path, n) for n in names if n.endswith(".csv")
+            )
+        else:
+            found.append(path)
+    files = []
+    for path in found:
+        name = os.path.basename(path)
+        if kinds and not any(name.startswith(kind) for kind in kinds):
+            continue
+        when = file_time(path)
+        if (since and when < since) or (until and when > until):
+            continue
+        files.append((path, when))
+    files.sort(key=lambda item: item[1])
+    return files
+
+
+def _parse_time(text):
+    """
+    Parses a command line time such as 20180602 or 20180602T155001.
+    """
+    fmt = "%Y%m%dT%H%M%S" if "T" in text else "%Y%m%d"
+    return datetime.strptime(text, fmt)
+
+
+def _cell(value):
+    """
+    Formats an output value; floats are rounded and None is left empty.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return "{0:.4f}".format(value).rstrip("0").rstrip(".")
+    return str(value)
+
+
+def write_rows(handle, rows):
+    """
+    Writes the output header and rows as CSV to an open file.
+    """
+    handle.write(OUTPUT_HEADER + "\n")
+    for row in rows:
+        handle.write(",".join(map(_cell, row)) + "\n")
+
+
+def main(argv=None):
+    """
+    Parses the command line, runs the workers, and writes the results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("paths", nargs="+", help="rollup files or dirs")
+    parser.add_argument(
+        "--kind", action="append", choices=("mperf", "lperf", "sperf")
+    )
+    parser.add_argument("--since", type=_parse_time, help="YYYYMMDD[THHMMSS]")
+    parser.add_argument("--until", type=_parse_time, help="YYYYMMDD[THHMMSS]")
+    parser.add_argument("--bucket", choices=BUCKETS, default="none")
+    parser.add_argument(
+        "--window-hours",
+        type=float,
+        default=48,
+        help="how long an lperf interval may still be re-reported",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("-o", "--output", help="output CSV (default stdout)")
+    args = parser.parse_args(argv)
+
+    files = find_files(args.paths, args.kind, args.since, args.until)
+    if not files:
+        print("No rollup files found", file=sys.stderr)
+        return 1
+
+    window = timedelta(hours=args.window_hours)
+    origin = files[0][1]
+    shares = split_files(files, max(1, args.workers))
+    jobs = [
+        (share, share[0][1] if i else None, args.bucket, window, origin)
+        for i, share in enumerate(shares)
+    ]
+    if len(jobs) == 1:
+        results = [analyze_partition(jobs[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=len(jobs)) as pool:
+            results = list(pool.map(analyze_partition, jobs))
+    rows, kinds = finish_partitions(results, args.bucket, window, origin)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            write_rows(handle, rows)
+    else:
+        write_rows(sys.stdout, rows)
+
+    print(
+        "Read {0} files ({1}) into {2} rows".format(
+            len(files),
+            ", ".join(
+                "{0}: {1}".format(kind or "skipped", count)
+                for kind, count in sorted(kinds.items(), key=str)
+            ),
+            len(rows),
+        ),
+        file=sys.stderr,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
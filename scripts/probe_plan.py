@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+"""
+Estimates how long probing takes from each router for a given number of
+targets, comparing running the probes one at a time (as the mperf exec
+probes do) against batches planned by the 'plan_probe_batches' filter at
+one or more per-router concurrency limits. Nothing is sent to a device.
+
+  python scripts/probe_plan.py --targets 200 --concurrency 1 4 8 16
+  python scripts/probe_plan.py --inventory hosts.yml --repeat 50
+  python scripts/probe_plan.py --targets 60 --frequency 30 --plan
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import yaml
+
+# The filters are a plain module within the playbook plugin directory
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(REPO_DIR, "plugins", "filter"))
+from filter import FilterModule  # pylint: disable=wrong-import-position
+
+# Columns of the estimate table, one row per concurrency limit
+COLUMNS = (
+    "concurrency",
+    "batches",
+    "peak",
+    "serial_s",
+    "makespan_s",
+    "speedup",
+)
+
+
+def inventory_hosts(path, group="perf_routers"):
+    """
+    Returns the names of every host below the given group of a YAML
+    inventory such as hosts.yml, searching nested child groups.
+    """
+    with open(path, "r", encoding="utf-8") as handle:
+        inventory = yaml.safe_load(handle)
+
+    def _walk(node, found, inside):
+        for name, child in (node or {}).get("children", {}).items():
+            _walk(child, found, inside or name == group)
+        if inside:
+            found.extend((node or {}).get("hosts") or {})
+        return found
+
+    return sorted(set(_walk(inventory.get("all", inventory), [], False)))
+
+
+def make_targets(args):
+    """
+    Builds target hashes like ONLINE_TARGETS, either from the inventory
+    or numbered synthetic hosts. Every router probes all the others, so
+    the router itself is excluded.
+    """
+    if args.inventory:
+        names = inventory_hosts(args.inventory)[1:]
+    else:
+        names = ["host{0}".format(i) for i in range(args.targets)]
+    return [
+        {"hostname": name, "ipv4addr": "10.{0}.{1}.1".format(*divmod(i, 256))}
+        for i, name in enumerate(names)
+    ]
+
+
+def parse_args(argv):
+    """
+    Parses the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--targets", type=int, default=100)
+    source.add_argument("--inventory", help="YAML inventory, eg hosts.yml")
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16]
+    )
+    parser.add_argument("--repeat", type=int, default=1000)
+    parser.add_argument("--interval-ms", type=int, default=20)
+    parser.add_argument("--guard-s", type=int, default=2)
+    parser.add_argument(
+        "--overhead-s",
+        type=float,
+        default=0.0,
+        help="extra seconds per probe, eg for the mperf ping and LSPV",
+    )
+    parser.add_argument(
+        "--frequency", type=int, default=0, help="recurring probe period"
+    )
+    parser.add_argument(
+        "--plan", action="store_true", help="print the last plan as JSON"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Plans and simulates the probes at each concurrency limit and prints
+    one row of estimates per limit.
+    """
+    args = parse_args(argv)
+    targets = make_targets(args)
+    if not targets:
+        print("No targets to plan", file=sys.stderr)
+        return 1
+
+    print(" ".join("{0:>12}".format(col) for col in COLUMNS))
+    plan = None
+    for concurrency in args.concurrency:
+        plan = FilterModule.plan_probe_batches(
+            targets,
+            concurrency=concurrency,
+            options={
+                "repeat": args.repeat,
+                "interval_ms": args.interval_ms,
+                "guard_s": args.guard_s,
+                "frequency": args.frequency,
+            },
+        )
+        sim = FilterModule.simulate_probe_plan(plan, args.overhead_s)
+        sim["concurrency"] = concurrency
+        print(" ".join("{0:>12}".format(sim[col]) for col in COLUMNS))
+        if "warning" in plan:
+            print(
+                "concurrency {0}: {1}".format(concurrency, plan["warning"]),
+                file=sys.stderr,
+            )
+
+    if args.plan:
+        print(json.dumps(plan, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+"""
+Lists and prints the raw probe outputs kept in an archive segment written
+by the 'raw_archive_append' filter, such as 'mperf.seg' in the directory
+given by 'raw_archive_dir'. Listing reads only the small metadata of each
+output, and printing decompresses only the outputs asked for.
+
+  python scripts/raw_archive.py archive/mperf.seg --src-host csr1
+  python scripts/raw_archive.py archive/mperf.seg --dest-host csr2 --probe lspv
+  python scripts/raw_archive.py archive/mperf.seg --show 12 13
+"""
+
+import argparse
+import os
+import sys
+
+# The filters are a plain module within the playbook plugin directory
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(REPO_DIR, "plugins", "filter"))
+from filter import FilterModule  # pylint: disable=wrong-import-position
+
+# Columns of the listing, one row per output
+COLUMNS = ("entry", "dtg", "src_host", "dest_host", "probe")
+
+
+def parse_args(argv):
+    """
+    Parses the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("segment", help="archive segment, eg mperf.seg")
+    parser.add_argument("--src-host")
+    parser.add_argument("--dest-host")
+    parser.add_argument("--probe")
+    parser.add_argument("--dtg")
+    parser.add_argument(
+        "--show",
+        type=int,
+        nargs="+",
+        metavar="ENTRY",
+        help="print the text of these entries instead of listing",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Prints the text of the requested entries, or else one row per output
+    matching the filters given.
+    """
+    args = parse_args(argv)
+    if not os.path.exists(args.segment):
+        print("No archive at {0}".format(args.segment), file=sys.stderr)
+        return 1
+
+    if args.show:
+        for output in FilterModule.raw_archive_read(args.segment, args.show):
+            print(
+                "### {0} {1} {2}->{3} {4}".format(
+                    *(output[col] for col in COLUMNS)
+                )
+            )
+            print(output["text"])
+        return 0
+
+    listing = FilterModule.raw_archive_index(
+        args.segment, args.src_host, args.dest_host, args.probe, args.dtg
+    )
+    print(",".join(COLUMNS))
+    for output in listing:
+        print(",".join(str(output[col]) for col in COLUMNS))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
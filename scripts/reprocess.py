@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+"""
+Rebuilds mperf, lperf, and sperf rollups from raw probe output saved by
+the playbooks when 'probe_archive_dir' is set, without Ansible or access
+to the routers. Each archive holds one host's PROBE_OUTPUT results for one
+run and is parsed by the same filters the templates use, so the rebuilt
+rollups match the originals unless the filters have changed since.
+
+  python scripts/reprocess.py archive/ -o rollups_new/
+  python scripts/reprocess.py archive/mperf_20180602T155001 --workers 8
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+# The filters are a plain module within the playbook plugin directory
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(REPO_DIR, "plugins", "filter"))
+from filter import FilterModule  # pylint: disable=wrong-import-position
+
+# Playbook defining the csv_header of each rollup kind
+PLAYBOOKS = {
+    "mperf": "mperf_playbook.yml",
+    "lperf": "lperf_get_playbook.yml",
+    "sperf": "sperf_playbook.yml",
+}
+
+
+def find_archives(paths, kinds=None):
+    """
+    Expands directories (searched recursively) into the archive files
+    they contain and returns all archive paths, sorted so the archives of
+    each run are adjacent. Archives are kept in a directory per run named
+    after the rollup, so other kinds are skipped by that name.
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                found.extend(
+                    os.path.join(root, name)
+                    for name in names
+                    if name.endswith(".json.gz")
+                )
+        else:
+            found.append(path)
+    if kinds:
+        found = [
+            path
+            for path in found
+            if os.path.basename(os.path.dirname(path)).split("_")[0] in kinds
+        ]
+    return sorted(found)
+
+
+def playbook_header(file_id):
+    """
+    Returns the csv_header currently defined by the playbook that writes
+    the given rollup kind, or None when it is templated (as for sperf,
+    whose header lists the targets of each run) or cannot be found.
+    """
+    path = os.path.join(REPO_DIR, PLAYBOOKS.get(file_id, ""))
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as handle:
+        plays = yaml.safe_load(handle)
+    for play in plays:
+        play_vars = play.get("vars", {})
+        if play_vars.get("file_id") == file_id:
+            header = play_vars.get("csv_header")
+            if header and "{{" not in header:
+                return header
+    return None
+
+
+def rebuild(path):
+    """
+    Rebuilds the rollup rows of one archive, returning its metadata, the
+    rows text, and (for sperf only) the results needed for the matrix.
+    """
+    archive = FilterModule.probe_archive_read(path)
+    meta, results = archive["meta"], archive["results"]
+    file_id = meta["file_id"]
+    if file_id == "mperf":
+        rows = FilterModule.mperf_rows(
+            results, meta["src_host"], meta["src_ip"]
+        )
+    elif file_id == "lperf":
+        lookup_hashes = meta.get("lookup_hashes") or [
+            result["item"][1] for result in results
+        ]
+        stats = FilterModule.ios_ipsla_stats_batch(results, intervals=True)
+        rows = FilterModule.lperf_rows(
+            stats, meta["src_host"], meta["src_ip"], lookup_hashes
+        )
+    elif file_id == "sperf":
+        rows = FilterModule.sperf_row(results, meta["src_host"]) + "\n"
+    else:
+        raise ValueError("{0}: unknown file_id {1}".format(path, file_id))
+    return meta, rows, results if file_id == "sperf" else None
+
+
+def write_run(out_dir, run, header, hosts, sperf_results):
+    """
+    Writes the rollup of one run, with the rows of each host in host name
+    order, and rebuilds the sperf matrix outputs beside it.
+    """
+    file_id, dtg = run
+    path = os.path.join(out_dir, "{0}_{1}.csv".format(file_id, dtg))
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write(header + "\n")
+        for host in sorted(hosts):
+            handle.write(hosts[host])
+
+    summary = None
+    if sperf_results:
+        host_vars = {
+            host: {"PROBE_OUTPUT": {"results": results}}
+            for host, results in sperf_results.items()
+        }
+        summary = FilterModule.sperf_matrix(
+            sorted(host_vars),
+            host_vars,
+            header.split(",")[1:],
+            path[: -len(".csv")],
+        )
+    return path, summary
+
+
+def parse_args(argv):
+    """
+    Parses the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("paths", nargs="+", help="archive files or dirs")
+    parser.add_argument(
+        "-o", "--output", default="rollups", help="output rollup directory"
+    )
+    parser.add_argument(
+        "--kind", action="append", choices=("mperf", "lperf", "sperf")
+    )
+    parser.add_argument(
+        "--playbook-header",
+        action="store_true",
+        help="use the playbook's current csv_header, eg after adding a column",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """
+    Rebuilds every archived run in parallel, writing each rollup as soon
+    as all of its hosts are done, so only one run is held in memory.
+    """
+    args = parse_args(argv)
+    archives = find_archives(args.paths, args.kind)
+    if not archives:
+        print("No archives found", file=sys.stderr)
+        return 1
+    os.makedirs(args.output, exist_ok=True)
+
+    state = {"run": None, "header": None, "hosts": {}, "sperf": {}}
+    written = 0
+
+    def _flush():
+        if state["run"] is None:
+            return
+        path, summary = write_run(
+            args.output,
+            state["run"],
+            state["header"],
+            state["hosts"],
+            state["sperf"],
+        )
+        print("Wrote {0} ({1} hosts)".format(path, len(state["hosts"])))
+        if summary:
+            print("  sperf matrix: {0}".format(summary))
+
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        for meta, rows, results in pool.map(rebuild, archives, chunksize=4):
+            run = (meta["file_id"], meta["dtg"])
+            if run != state["run"]:
+                _flush()
+                written += state["run"] is not None
+                header = meta.get("csv_header")
+                if args.playbook_header:
+                    header = playbook_header(meta["file_id"]) or header
+                state.update(run=run, header=header, hosts={}, sperf={})
+            state["hosts"][meta["src_host"]] = rows
+            if results is not None:
+                state["sperf"][meta["src_host"]] = results
+        _flush()
+        written += state["run"] is not None
+
+    print(
+        "Rebuilt {0} rollups from {1} archives".format(written, len(archives))
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())